@@ -1,35 +1,251 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+import asyncio
+import math
+import zipfile
+from typing import List
+from fastapi import APIRouter, File, Query, UploadFile, HTTPException
 from fastapi.responses import StreamingResponse
 from core.orchestrator import Orchestrator
+from core.executor import ServiceBusy
+from utils import metrics
 from utils.logger import get_logger
-from PIL import Image
 import io
 
 router = APIRouter()
-orchestrator = Orchestrator()
-logger = get_logger()
+orchestrator = Orchestrator(defer_loading=True)
+logger = get_logger(__name__)
+
+MAX_BATCH_IMAGES = 256
+# Uncompressed bytes of all images in a batch, archive members included
+MAX_BATCH_BYTES = 256 * 1024 * 1024
+
+async def _read(file: UploadFile) -> bytes:
+    with metrics.stage("upload_read"):
+        return await file.read()
+
+async def _read_uploads(files: List[UploadFile]) -> list:
+    """Read the raw uploads as (filename, contents) pairs; see _expand_uploads."""
+    return [(file.filename, await _read(file)) for file in files]
+
+def _expand_uploads(uploads: list) -> list:
+    """Expand uploads (plain images or zip archives) into (filename, image) pairs.
+
+    Runs on the executor. The batch limits are checked against archive
+    directories before any member is decompressed; zipfile never inflates
+    a member past its declared size. Images that cannot be opened are
+    returned as the exception so the batch can report them per item
+    instead of failing the whole request.
+    """
+    entries = []
+    count = total = 0
+    for filename, contents in uploads:
+        if zipfile.is_zipfile(io.BytesIO(contents)):
+            archive = zipfile.ZipFile(io.BytesIO(contents))
+            members = [info for info in archive.infolist() if not info.is_dir()]
+            count += len(members)
+            total += sum(info.file_size for info in members)
+            entries.append((archive, members))
+        else:
+            count += 1
+            total += len(contents)
+            entries.append((filename, contents))
+        if count > MAX_BATCH_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_IMAGES} images per batch")
+        if total > MAX_BATCH_BYTES:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_BYTES} bytes of images per batch")
+
+    items = []
+    for source, data in entries:
+        if isinstance(source, zipfile.ZipFile):
+            with source as archive:
+                for info in data:
+                    try:
+                        items.append((info.filename, _open_image(archive.read(info))))
+                    except Exception as e:
+                        items.append((info.filename, e))
+        else:
+            items.append((source, _open_image(data)))
+    return items
+
+def _open_image(contents: bytes):
+    try:
+        return orchestrator.open_image(contents)
+    except Exception as e:
+        return e
+
+def _batch_timeout(count: int) -> float:
+    # Scale the per-request timeout with the number of inference batches
+    return orchestrator.executor.timeout * max(1, math.ceil(count / orchestrator.batch_size))
 
 @router.post("/identify")
 async def identify_face(file: UploadFile = File(...)):
     try:
-        contents = await file.read()        
-        image = Image.open(io.BytesIO(contents))
-        response = orchestrator.identify(image)
-        logger.info(f"Identify response: {response}")
+        contents = await _read(file)        
+        image = orchestrator.open_image(contents)
+        response = await orchestrator.executor.run(orchestrator.identify, image, contents)
+        logger.info("Identify response: %s", response)
+        return {"response": response}
+    except ServiceBusy as e:
+        logger.warning("Rejected identify_face: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out processing image")
+    except Exception as e:
+        logger.error("Error in identify_face: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
+
+@router.post("/identify_all")
+async def identify_all_faces(file: UploadFile = File(...), max_faces: int = 0):
+    """Identify every face in the image; max_faces > 0 keeps only the largest ones."""
+    try:
+        contents = await _read(file)
+        image = orchestrator.open_image(contents)
+        response = await orchestrator.executor.run(orchestrator.identify_faces, image, max_faces)
+        logger.info("Identify-all found %s faces", len(response['faces']))
         return {"response": response}
+    except ServiceBusy as e:
+        logger.warning("Rejected identify_all_faces: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out processing image")
     except Exception as e:
-        logger.error(f"Error in identify_face: {str(e)}")
+        logger.error("Error in identify_all_faces: %s", e)
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
 @router.post("/register")
 async def register_face(name: str, file: UploadFile = File(...)):
     try:
-        contents = await file.read()        
-        image = Image.open(io.BytesIO(contents))
-        face_id = orchestrator.register(image, name)
-        logger.info(f"Registered face ID: {face_id} for name: {name}")
+        contents = await _read(file)        
+        image = orchestrator.open_image(contents)
+        face_id = await orchestrator.executor.run(orchestrator.register, image, name, contents)
+        logger.info("Registered face ID: %s for name: %s", face_id, name)
         return {"response": face_id}
+    except ServiceBusy as e:
+        logger.warning("Rejected register_face: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out processing image")
+    except Exception as e:
+        logger.error("Error in register_face: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
+
+@router.post("/identify_batch")
+async def identify_faces_batch(files: List[UploadFile] = File(...)):
+    try:
+        items = await orchestrator.executor.run(_expand_uploads, await _read_uploads(files))
+        images = [image for _, image in items]
+        responses = await orchestrator.executor.run(
+            orchestrator.identify_batch, images, timeout=_batch_timeout(len(images))
+        )
+        logger.info("Batch identify processed %s images", len(responses))
+        return {"responses": [
+            {"filename": filename, "response": response}
+            for (filename, _), response in zip(items, responses)
+        ]}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        logger.warning("Rejected identify_faces_batch: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out processing images")
+    except Exception as e:
+        logger.error("Error in identify_faces_batch: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error processing images: {str(e)}")
+
+@router.post("/register_batch")
+async def register_faces_batch(names: List[str] = Query(...), files: List[UploadFile] = File(...)):
+    """Register many images; pass one name for all of them or one name per image."""
+    try:
+        items = await orchestrator.executor.run(_expand_uploads, await _read_uploads(files))
+        if len(names) == 1:
+            names = names * len(items)
+        if len(names) != len(items):
+            raise HTTPException(status_code=400, detail=f"Got {len(names)} names for {len(items)} images")
+        images = [image for _, image in items]
+        responses = await orchestrator.executor.run(
+            orchestrator.register_batch, images, names, timeout=_batch_timeout(len(images))
+        )
+        logger.info("Batch register processed %s images", len(responses))
+        return {"responses": [
+            {"filename": filename, "response": response}
+            for (filename, _), response in zip(items, responses)
+        ]}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        logger.warning("Rejected register_faces_batch: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out processing images")
     except Exception as e:
-        logger.error(f"Error in register_face: {str(e)}")
+        logger.error("Error in register_faces_batch: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error processing images: {str(e)}")
+
+@router.delete("/delete/{face_id}")
+async def delete_face(face_id: str):
+    """Delete a face from the gallery along with its stored image."""
+    try:
+        deleted = await orchestrator.executor.run(orchestrator.delete_faces, [face_id])
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Face ID not found")
+        logger.info("Deleted face ID: %s", face_id)
+        return {"status": "success", "face_id": face_id}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        logger.warning("Rejected delete_face: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out deleting face")
+    except Exception as e:
+        logger.error("Error in delete_face: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error deleting face: {str(e)}")
+
+@router.post("/merge")
+async def merge_faces(source_id: str, target_id: str):
+    """Merge source_id into target_id when both are the same person."""
+    try:
+        response = await orchestrator.executor.run(orchestrator.merge_faces, source_id, target_id)
+        if response is None:
+            raise HTTPException(status_code=404, detail="Face ID not found")
+        logger.info("Merged face ID: %s into %s", source_id, target_id)
+        return {"response": response}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        logger.warning("Rejected merge_faces: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out merging faces")
+    except Exception as e:
+        logger.error("Error in merge_faces: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error merging faces: {str(e)}")
+
+@router.post("/reembed/{face_id}")
+async def reembed_face(face_id: str, file: UploadFile = File(...)):
+    """Replace a face's embedding and stored image with a new photo."""
+    try:
+        contents = await _read(file)
+        image = orchestrator.open_image(contents)
+        response = await orchestrator.executor.run(orchestrator.reembed, face_id, image)
+        if response is None:
+            raise HTTPException(status_code=404, detail="Face ID not found")
+        logger.info("Re-embed response: %s", response)
+        return {"response": response}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        logger.warning("Rejected reembed_face: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out processing image")
+    except Exception as e:
+        logger.error("Error in reembed_face: %s", e)
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
-    
\ No newline at end of file
+
+@router.get("/cache_stats")
+async def embedding_cache_stats():
+    """Hit/miss counters of the upload embedding cache."""
+    if orchestrator.embedding_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **orchestrator.embedding_cache.stats()}
@@ -1,28 +1,143 @@
 import io
-from fastapi import APIRouter
+import asyncio
+import base64
+from typing import List, Optional
+from fastapi import APIRouter, Query, Request
 from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
+from PIL import Image
 from core.orchestrator import Orchestrator
+from core.executor import ServiceBusy
+from storage.db import IMAGE_KINDS, CODECS, content_hash
 from utils.logger import get_logger
+from utils.lru import LRUCache
 
 router = APIRouter()
-orchestrator = Orchestrator()
-logger = get_logger()
+orchestrator = Orchestrator(defer_loading=True)
+logger = get_logger(__name__)
+
+MIN_VARIANT_SIZE = 16
+MAX_VARIANT_SIZE = 1024
+MAX_THUMBNAILS = 500
+# Stored images change only on re-embed, so clients may reuse them briefly
+# and revalidate with If-None-Match afterwards
+CACHE_CONTROL = "private, max-age=60"
+
+# Resized variants keyed by (source content hash, size); the hash changes
+# whenever the stored image does, so entries never go stale
+variants = LRUCache(max_items=4096, max_bytes=64 * 1024 * 1024)
+
+def _not_modified(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _check_size(size: Optional[int]):
+    if size is not None and not MIN_VARIANT_SIZE <= size <= MAX_VARIANT_SIZE:
+        raise HTTPException(status_code=400, detail=f"size must be between {MIN_VARIANT_SIZE} and {MAX_VARIANT_SIZE}")
+
+def _variant(data: bytes, fmt: str, digest: str, size: int) -> bytes:
+    """``data`` scaled to fit ``size`` x ``size``, memoized; small images are returned as is."""
+    key = (digest, size)
+    resized = variants.get(key)
+    if resized is None:
+        image = Image.open(io.BytesIO(data))
+        if max(image.size) <= size:
+            resized = data
+        else:
+            # Lets JPEG decode straight at a reduced scale
+            image.draft(image.mode, (size, size))
+            image.thumbnail((size, size))
+            resized = orchestrator.image_db.encode(image, fmt)
+        variants.put(key, resized)
+    return resized
+
+def _load_image(face_id: str, kind: Optional[str], size: Optional[int], if_none_match: Optional[str]):
+    """``(data, format, etag)`` of the image, with data None when ``if_none_match`` matches.
+
+    The ETag comes from the hash stored with the image, so a matching
+    request reads and resizes nothing.
+    """
+    tagged = orchestrator.image_db.get_image_etag(face_id, kind)
+    if tagged is None:
+        return None
+    digest, fmt = tagged
+    etag = f'"{digest}"' if size is None else f'"{digest}-{size}"'
+    if _not_modified(if_none_match, etag):
+        return None, fmt, etag
+
+    data = variants.get((digest, size)) if size is not None else None
+    if data is None:
+        stored = orchestrator.image_db.get_image_bytes(face_id, kind)
+        if stored is None:
+            return None
+        data = stored[0]
+        if size is not None:
+            data = _variant(data, fmt, digest, size)
+    return data, fmt, etag
+
+def _load_thumbnails(face_ids: List[str], size: Optional[int]) -> dict:
+    thumbnails = {}
+    for face_id, (data, fmt) in orchestrator.image_db.get_thumbnail_bytes(face_ids).items():
+        if size is not None:
+            data = _variant(data, fmt, content_hash(data), size)
+        thumbnails[face_id] = f"data:{CODECS[fmt]};base64,{base64.b64encode(data).decode('ascii')}"
+    return thumbnails
 
 @router.get("/get_image/{face_id}")
-async def get_image_by_face_id(face_id: str):
+async def get_image_by_face_id(request: Request, face_id: str, kind: Optional[str] = None, size: Optional[int] = None):
+    """Image stored for a face: kind is "thumb", "crop" or "full" (if kept).
+
+    The stored bytes are returned as they are, or scaled to fit ``size``
+    pixels. Responses carry an ETag and honour If-None-Match.
+    """
     try:
-        image = orchestrator.image_db.get_image_by_face_id(face_id)
-        if image is None:
+        if kind is not None and kind not in IMAGE_KINDS:
+            raise HTTPException(status_code=400, detail=f"kind must be one of {list(IMAGE_KINDS)}")
+        _check_size(size)
+        loaded = await orchestrator.executor.run(
+            _load_image, face_id, kind, size, request.headers.get("if-none-match")
+        )
+        if loaded is None:
             raise HTTPException(status_code=404, detail="Image not found")
-        
-        # Convert PIL Image to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)  # Important: reset pointer to beginning
-        logger.info(f"Retrieved image for face_id: {face_id}")
-        # Return as StreamingResponse with proper media type
-        return StreamingResponse(img_byte_arr, media_type="image/png")
+
+        data, fmt, etag = loaded
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if data is None:
+            return Response(status_code=304, headers=headers)
+        logger.info("Retrieved image for face_id: %s", face_id)
+        return Response(content=data, media_type=CODECS[fmt], headers=headers)
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out retrieving image")
     except Exception as e:
-        logger.error(f"Error retrieving image for face_id {face_id}: {str(e)}")
+        logger.error("Error retrieving image for face_id %s: %s", face_id, e)
         raise HTTPException(status_code=400, detail=f"Error retrieving image: {str(e)}")
+
+@router.get("/thumbnails")
+async def get_thumbnails(face_ids: List[str] = Query(...), size: Optional[int] = None):
+    """Thumbnails of many faces in one response, as data URIs keyed by face_id.
+
+    Faces without a stored image are listed under "missing".
+    """
+    try:
+        if len(face_ids) > MAX_THUMBNAILS:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_THUMBNAILS} face_ids per request")
+        _check_size(size)
+        thumbnails = await orchestrator.executor.run(_load_thumbnails, face_ids, size)
+        missing = [face_id for face_id in dict.fromkeys(face_ids) if face_id not in thumbnails]
+        logger.info("Retrieved %s thumbnails, %s missing", len(thumbnails), len(missing))
+        return {"thumbnails": thumbnails, "missing": missing}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out retrieving thumbnails")
+    except Exception as e:
+        logger.error("Error retrieving thumbnails: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error retrieving thumbnails: {str(e)}")
@@ -1,44 +1,165 @@
-from fastapi import APIRouter
+import asyncio
+import base64
+from typing import List, Optional
+from fastapi import APIRouter, Query
 from fastapi import HTTPException
+from fastapi.responses import JSONResponse
 from core.orchestrator import Orchestrator
+from core.executor import ServiceBusy
+from storage.db import CODECS
 from utils.logger import get_logger
 
-logger = get_logger()
+logger = get_logger(__name__)
 router = APIRouter()
-orchestrator = Orchestrator()
+orchestrator = Orchestrator(defer_loading=True)
+
+MAX_CLUSTERS_PER_PAGE = 100
+MAX_REPRESENTATIVES = 16
+CLUSTERING_RETRY_AFTER = 2
+
+def _cluster_page(offset: int, limit: int, min_size: int, representatives: int, refresh: bool):
+    result = orchestrator.get_face_clusters(offset=offset, limit=limit, min_size=min_size, refresh=refresh)
+    if result is None or representatives == 0:
+        return result
+    for cluster in result["clusters"]:
+        cluster["representatives"] = cluster["face_ids"][:representatives]
+    # One query for the thumbnails of the whole page
+    stored = orchestrator.image_db.get_thumbnail_bytes(
+        face_id for cluster in result["clusters"] for face_id in cluster["representatives"]
+    )
+    for cluster in result["clusters"]:
+        cluster["thumbnails"] = {
+            face_id: f"data:{CODECS[fmt]};base64,{base64.b64encode(data).decode('ascii')}"
+            for face_id, (data, fmt) in ((f, stored[f]) for f in cluster["representatives"] if f in stored)
+        }
+    return result
 
 @router.get("/unnamed")
 async def get_unnamed_faces():
     try:
-        unnamed_faces = orchestrator.get_unnamed_faces()
-        logger.info(f"Retrieved unnamed faces: {unnamed_faces}")
+        unnamed_faces = await orchestrator.executor.run(orchestrator.get_unnamed_faces)
+        logger.info("Retrieved %s unnamed faces", len(unnamed_faces))
         return {"unnamed_faces": unnamed_faces}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out retrieving unnamed faces")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error retrieving unnamed faces: {str(e)}")
     
 @router.get("/get_name/{face_id}")
 async def get_name_by_face_id(face_id: str):
     try:
-        result = orchestrator.image_db.retrieve_by_face_id(face_id)
+        result = await orchestrator.executor.run(orchestrator.image_db.retrieve_by_face_id, face_id)
         if result is None:
-            logger.warning(f"Face ID not found: {face_id}")
+            logger.warning("Face ID not found: %s", face_id)
             raise HTTPException(status_code=404, detail="Face ID not found")
         face_id, name = result
-        logger.info(f"Retrieved name: {name} for face_id: {face_id}")
+        logger.info("Retrieved name: %s for face_id: %s", name, face_id)
         return {"face_id": face_id, "name": name}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out retrieving name")
     except Exception as e:
-        logger.error(f"Error retrieving name for face_id {face_id}: {str(e)}")
+        logger.error("Error retrieving name for face_id %s: %s", face_id, e)
         raise HTTPException(status_code=400, detail=f"Error retrieving name: {str(e)}")
     
+@router.get("/find_by_name")
+async def find_face_ids_by_name(name: str):
+    try:
+        face_ids = await orchestrator.executor.run(orchestrator.image_db.get_face_ids_by_name, name)
+        logger.info("Found %s face_ids for name: %s", len(face_ids), name)
+        return {"name": name, "face_ids": face_ids}
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out looking up name")
+    except Exception as e:
+        logger.error("Error looking up name %s: %s", name, e)
+        raise HTTPException(status_code=400, detail=f"Error looking up name: {str(e)}")
+
 @router.put("/update_name/{face_id}")
 async def update_name_by_face_id(face_id: str, name: str):
     try:
-        result = orchestrator.image_db.update_name(face_id, name)
+        result = await orchestrator.executor.run(orchestrator.image_db.update_name, face_id, name)
         if not result:
-            logger.warning(f"Face ID not found for update: {face_id}")
+            logger.warning("Face ID not found for update: %s", face_id)
             raise HTTPException(status_code=404, detail="Face ID not found")
-        logger.info(f"Updated name to: {name} for face_id: {face_id}")
+        logger.info("Updated name to: %s for face_id: %s", name, face_id)
         return {"status": "success", "face_id": face_id, "name": name}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out updating name")
+    except Exception as e:
+        logger.error("Error updating name for face_id %s: %s", face_id, e)
+        raise HTTPException(status_code=400, detail=f"Error updating name: {str(e)}")
+
+@router.get("/clusters")
+async def get_face_clusters(
+    offset: int = 0,
+    limit: int = 20,
+    min_size: int = 2,
+    representatives: int = 4,
+    refresh: bool = False
+):
+    """Unnamed faces grouped by likely identity, largest groups first.
+
+    Each cluster lists its face_ids, most typical first, with thumbnails
+    (data URIs) of the first ``representatives``. Clusters are computed in
+    the background: the first call answers 202 until they are ready, and
+    "stale" is true while a newer clustering is being computed.
+    """
+    try:
+        if offset < 0 or not 1 <= limit <= MAX_CLUSTERS_PER_PAGE:
+            raise HTTPException(status_code=400, detail=f"offset must be >= 0 and limit between 1 and {MAX_CLUSTERS_PER_PAGE}")
+        if min_size < 1 or not 0 <= representatives <= MAX_REPRESENTATIVES:
+            raise HTTPException(status_code=400, detail=f"min_size must be >= 1 and representatives between 0 and {MAX_REPRESENTATIVES}")
+        result = await orchestrator.executor.run(_cluster_page, offset, limit, min_size, representatives, refresh)
+        if result is None:
+            return JSONResponse(
+                status_code=202,
+                content={"status": "clustering"},
+                headers={"Retry-After": str(CLUSTERING_RETRY_AFTER)}
+            )
+        logger.info("Retrieved %s of %s face clusters", len(result["clusters"]), result["total"])
+        return {**result, "offset": offset, "limit": limit}
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out retrieving face clusters")
+    except Exception as e:
+        logger.error("Error retrieving face clusters: %s", e)
+        raise HTTPException(status_code=400, detail=f"Error retrieving face clusters: {str(e)}")
+
+@router.put("/clusters/{cluster_id}")
+async def name_face_cluster(cluster_id: str, name: str, exclude: Optional[List[str]] = Query(None)):
+    """Name every still-unnamed face of a cluster in one write.
+
+    ``exclude`` leaves out faces that do not belong in the cluster. The
+    cluster_id comes from the last ``/clusters`` listing; 404 if that
+    clustering has been replaced since and no longer has it.
+    """
+    try:
+        result = await orchestrator.executor.run(orchestrator.name_face_cluster, cluster_id, name, exclude or ())
+        if result is None:
+            raise HTTPException(status_code=404, detail="Cluster not found")
+        return result
+    except HTTPException:
+        raise
+    except ServiceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out naming cluster")
     except Exception as e:
-        logger.error(f"Error updating name for face_id {face_id}: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Error updating name: {str(e)}")
\ No newline at end of file
+        logger.error("Error naming cluster %s: %s", cluster_id, e)
+        raise HTTPException(status_code=400, detail=f"Error naming cluster: {str(e)}")
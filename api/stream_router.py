@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from core.orchestrator import Orchestrator
+from core.executor import ServiceBusy
+from core.video import VideoPipeline
+from utils.logger import get_logger
+
+router = APIRouter()
+orchestrator = Orchestrator(defer_loading=True)
+logger = get_logger(__name__)
+
+MAX_FRAME_BYTES = 8 * 1024 * 1024
+
+def _identify_frame(pipeline: VideoPipeline, lock: threading.Lock, data: bytes, frame_index: int) -> list:
+    # Frames between detections are never decoded
+    frame = orchestrator.open_image(data)
+    # A frame that timed out may still be running on a worker thread
+    with lock:
+        pipeline.process_frame(frame, frame_index)
+        return [
+            {
+                "track_id": track.track_id,
+                "bbox": [round(float(v), 1) for v in track.bbox],
+                "face_id": track.face_id,
+                "name": track.name,
+                "similarity": "N/A" if track.similarity is None else str(track.similarity),
+            }
+            for track in pipeline.tracks if track.missed == 0
+        ]
+
+class _LatestFrame:
+    """Single-slot mailbox: a new frame replaces one that was not picked up yet."""
+
+    def __init__(self):
+        self.frame = None
+        self.received_at = 0.0
+        self.dropped = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def put(self, frame: bytes):
+        if self.frame is not None:
+            self.dropped += 1
+        self.frame = frame
+        self.received_at = time.perf_counter()
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def take(self):
+        await self.ready.wait()
+        self.ready.clear()
+        frame, self.frame = self.frame, None
+        return frame, self.received_at
+
+async def _receive(websocket: WebSocket, mailbox: _LatestFrame):
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            data = message.get("bytes")
+            if data is None:
+                await websocket.send_json({"error": "Frames must be sent as binary messages"})
+            elif len(data) > MAX_FRAME_BYTES:
+                await websocket.send_json({"error": f"Frame larger than {MAX_FRAME_BYTES} bytes"})
+            else:
+                mailbox.put(data)
+    finally:
+        mailbox.close()
+
+@router.websocket("/identify")
+async def identify_stream(websocket: WebSocket, detect_every: int = 1, register_unknown: bool = False):
+    """Identify faces in a stream of encoded frames (JPEG/PNG binary messages).
+
+    Each processed frame is answered with the tracked faces in it. Frames
+    arriving while one is processed replace each other, so only the latest
+    is processed and latency does not build up; the reply counts the dropped
+    frames. Tracks keep their identity across frames and are re-embedded
+    only when their face quality improves. Unknown faces are registered only
+    with register_unknown.
+    """
+    await websocket.accept()
+    if not orchestrator.ready:
+        # 1013: try again later
+        await websocket.close(code=1013, reason="Service is starting")
+        return
+    pipeline = VideoPipeline(orchestrator, detect_every=detect_every, register_unknown=register_unknown)
+    lock = threading.Lock()
+    mailbox = _LatestFrame()
+    receiver = asyncio.create_task(_receive(websocket, mailbox))
+    frame_index = 0
+    logger.info("Stream connection opened")
+    try:
+        while True:
+            data, received_at = await mailbox.take()
+            if data is None:
+                if mailbox.closed:
+                    break
+                continue
+            try:
+                faces = await orchestrator.executor.run(_identify_frame, pipeline, lock, data, frame_index)
+                reply = {"frame": frame_index, "faces": faces}
+            except ServiceBusy as e:
+                reply = {"frame": frame_index, "error": str(e), "retry_after": e.retry_after}
+            except asyncio.TimeoutError:
+                reply = {"frame": frame_index, "error": "Timed out processing frame"}
+            except Exception as e:
+                logger.error("Error in identify_stream: %s", e)
+                reply = {"frame": frame_index, "error": f"Error processing frame: {str(e)}"}
+            reply["dropped"] = mailbox.dropped
+            reply["latency_ms"] = round((time.perf_counter() - received_at) * 1000.0, 1)
+            await websocket.send_json(reply)
+            frame_index += 1
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        logger.info("Stream connection closed: %s, dropped %s frames", pipeline.stats(), mailbox.dropped)
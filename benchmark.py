@@ -1,30 +1,329 @@
+"""Stage-level benchmarks: where request time goes and how it scales.
+
+Usage:
+    python benchmark.py                                   # every stage, generated fixtures
+    python benchmark.py --stages decode search --gallery-sizes 1000 100000 1000000
+    python benchmark.py --stages search --million --backends flat hnsw
+    python benchmark.py --image face.jpg --json results.json
+    python benchmark.py --baseline baseline.json --tolerance 0.15
+
+Stages:
+    decode   upload bytes -> BGR (PIL path vs single reduced-resolution decode)
+    detect   face detection on the decoded fixtures
+    quality  quality gates on detection results
+    embed    recognition on aligned 112x112 crops, batch 1 and 8
+    search   FAISS top-1 search over synthetic galleries of each size; 1M
+             vectors with --million
+    sqlite   image DB writes and reads
+    http     end-to-end requests through the FastAPI app
+
+Everything runs on CPU by default. Generated images contain no faces, so
+detect and http time the detector and the no-face path; pass ``--image``
+with a face photo to time the full identify path. Embedding cost does not
+depend on crop content, so it always uses generated crops. Each case
+reports p50/p95/p99 latency and throughput; with ``--baseline`` cases whose
+p50 or p95 got slower by more than ``--tolerance`` are flagged and the exit
+status is 1.
+
+The 1M-vector search case is opt-in because of its cost. One index is held
+at a time. A flat float32 index takes about 2 GB (1 GB with ``--dtype
+float16``), and hnsw adds about 0.3 GB of graph links. Generating and adding
+the vectors takes under a minute for flat. Flat searches are single-threaded
+and scan every row, so expect roughly 0.2-0.5 s per query, or 10-30 s at the
+default ``--repeat``. Building hnsw or ivf_* at this size on one thread can
+take from tens of minutes to over an hour.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
 import time
-from face_engine.engine import FacialRecognitionEngine
+
+import cv2
 import numpy as np
 from PIL import Image
-import onnxruntime as ort
-print(ort.get_available_providers())
-
-preload_start = time.time()
-def test_face_engine_initialization():
-    fr_engine = FacialRecognitionEngine(
-            model_name="antelopev2",
-            device=0,
-            det_size=(320, 320)
+
+STAGES = ("decode", "detect", "quality", "embed", "search", "sqlite", "http")
+ENGINE_STAGES = ("detect", "embed")
+# Opt-in search size (--million)
+LARGE_GALLERY = 1000000
+
+
+def summarize(samples: list, items: int = 1) -> dict:
+    """Latency percentiles in ms and throughput in items per second."""
+    ms = np.array(samples) * 1000.0
+    return {
+        "n": len(samples),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "throughput_per_s": float(items * len(samples) / max(ms.sum() / 1000.0, 1e-9)),
+    }
+
+
+def timed(fn, repeat: int, warmup: int = 3, items: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples, items)
+
+
+def _jpeg(width: int, height: int, rng) -> bytes:
+    """A smooth photo-like JPEG; noise would make decode times unrealistic."""
+    small = rng.integers(0, 255, (max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+    ok, data = cv2.imencode(".jpg", cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC),
+                            [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return data.tobytes()
+
+
+def fixtures(args) -> dict:
+    """Encoded upload fixtures by name."""
+    rng = np.random.default_rng(args.seed)
+    images = {"vga": _jpeg(640, 480, rng), "phone": _jpeg(4032, 3024, rng)}
+    if args.image:
+        with open(args.image, "rb") as f:
+            images["image"] = f.read()
+    return images
+
+
+def bench_decode(ctx, args) -> dict:
+    from face_engine.engine import EncodedImage, to_bgr
+
+    min_side = 4 * args.det_size
+    results = {}
+    for name, data in ctx["fixtures"].items():
+        results[f"{name}/pil"] = timed(lambda: to_bgr(Image.open(io.BytesIO(data))), args.repeat)
+        results[f"{name}/encoded"] = timed(lambda: EncodedImage(data, min_side).decode(), args.repeat)
+    return results
+
+
+def bench_detect(ctx, args) -> dict:
+    from face_engine.engine import EncodedImage
+
+    engine = ctx["engine"]
+    results = {}
+    for name, data in ctx["fixtures"].items():
+        image = EncodedImage(data, 4 * args.det_size)
+        image.decode()
+        results[name] = timed(lambda: engine.detect(image), args.repeat)
+    return results
+
+
+def bench_quality(ctx, args) -> dict:
+    from core.orchestrator import MIN_FACE_SIZE
+    from core.quality_check import QualityCheck
+    from face_engine.engine import FaceDetections
+
+    checker = QualityCheck()
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    for faces in (1, 16):
+        x1y1 = rng.uniform(0, 400, (faces, 2)).astype(np.float32)
+        bboxes = np.hstack([x1y1, x1y1 + rng.uniform(40, 200, (faces, 2)).astype(np.float32)])
+        kps = x1y1[:, None, :] + rng.uniform(0, 40, (faces, 5, 2)).astype(np.float32)
+        detections = FaceDetections(None, bboxes, kps, np.full(faces, 0.9, dtype=np.float32))
+        results[f"faces_{faces}"] = timed(
+            lambda: checker.passing_faces(detections, min_size=MIN_FACE_SIZE, angle_threshold=50), args.repeat * 10
         )
-    
-    img =  "1.jpg"  # Replace with actual image path
-    image = Image.open(img).convert("RGB")
-    embedding = fr_engine.get_embedding_from_pil(image)
-    start_time = time.time()
-    for i in range(1000):
-        embedding = fr_engine.get_embedding_from_pil(image)
-        print(f"Iteration {i}")
-    # print(embedding)
-    end_time = time.time()
-    print(f"Time taken for 1000 iterations: {end_time - start_time} seconds")
-    print(f"load time: {start_time - preload_start} seconds")
-    print("FaceEngine initialization test passed.")
+    return results
+
+
+def bench_embed(ctx, args) -> dict:
+    engine = ctx["engine"]
+    rng = np.random.default_rng(args.seed)
+    size = engine.rec_model.input_size[0]
+    crops = [rng.integers(0, 255, (size, size, 3), dtype=np.uint8) for _ in range(8)]
+    return {
+        "batch_1": timed(lambda: engine.embed_aligned(crops[:1]), args.repeat),
+        "batch_8": timed(lambda: engine.embed_aligned(crops), max(1, args.repeat // 4), items=8),
+    }
+
+
+def bench_index(backend: str, rows: int, queries: np.ndarray, rng, args):
+    """Build a ``backend`` index of ``rows`` random vectors and time top-1 searches.
+
+    The index only lives in this call, so each size's memory is released
+    before the next one is built. Returns None when there are too few rows
+    to train the index.
+    """
+    from vector_db import backends
+
+    index = backends.make_index(backend, 512, args.dtype, rows)
+    started = time.perf_counter()
+    for start in range(0, rows, 100000):
+        chunk = rng.standard_normal((min(100000, rows - start), 512)).astype(np.float32)
+        chunk /= np.linalg.norm(chunk, axis=1, keepdims=True)
+        if start == 0:
+            if backends.train_rows_needed(index) > rows:
+                return None
+            backends.train(index, chunk)
+        index.add_with_ids(chunk, np.arange(start, start + len(chunk), dtype=np.int64))
+    build_s = time.perf_counter() - started
+    position = iter(range(10 ** 9))
+    result = timed(lambda: index.search(queries[next(position) % len(queries)][None, :], 1), args.repeat)
+    result["build_s"] = build_s
+    return result
+
+
+def bench_search(ctx, args) -> dict:
+    import faiss
+
+    faiss.omp_set_num_threads(1)
+    rng = np.random.default_rng(args.seed)
+    queries = rng.standard_normal((args.repeat, 512)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    sizes = list(args.gallery_sizes)
+    if args.million and LARGE_GALLERY not in sizes:
+        sizes.append(LARGE_GALLERY)
+    results = {}
+    for rows in sizes:
+        for backend in args.backends:
+            result = bench_index(backend, rows, queries, rng, args)
+            if result is None:
+                print(f"  skipping {backend} at {rows} rows: too few rows to train")
+                continue
+            results[f"{backend}/{rows}"] = result
+    return results
+
+
+def bench_sqlite(ctx, args) -> dict:
+    from storage.db import ImageDB
+
+    rng = np.random.default_rng(args.seed)
+    db = ImageDB(db_path=os.path.join(ctx["tmp"], "bench_images.db"))
+    thumb = Image.fromarray(rng.integers(0, 255, (160, 160, 3), dtype=np.uint8))
+    crop = Image.fromarray(rng.integers(0, 255, (112, 112, 3), dtype=np.uint8))
+    counter = iter(range(10 ** 9))
+
+    def write():
+        face_id = str(next(counter))
+        db.store_image({"thumb": thumb, "crop": crop}, face_id=face_id)
+
+    results = {"write_face": timed(write, args.repeat)}
+    ids = [str(i) for i in range(args.repeat)]
+    position = iter(range(10 ** 9))
+    results["read_name"] = timed(lambda: db.get_names([ids[next(position) % len(ids)]]), args.repeat * 4)
+    results["read_image"] = timed(lambda: db.get_image_bytes(ids[next(position) % len(ids)], "thumb"), args.repeat * 4)
+    results["read_thumbnails_50"] = timed(lambda: db.get_thumbnail_bytes(ids[:50]), args.repeat, items=50)
+    db.close()
+    return results
+
+
+def bench_http(ctx, args) -> dict:
+    from core.orchestrator import Orchestrator
+
+    # Must run before main is imported: the routers share this singleton,
+    # which keeps its gallery and image DB in the scratch directory.
+    # The embedding cache would turn every repeat into a cache hit.
+    ctx["orchestrator"] = Orchestrator(
+        device=args.device,
+        det_size=(args.det_size, args.det_size),
+        data_dir=os.path.join(ctx["tmp"], "http"),
+        embedding_cache_size=0
+    )
+    from fastapi.testclient import TestClient
+    import main
+
+    client = TestClient(main.app)
+    results = {"health": timed(lambda: client.get("/health"), args.repeat)}
+    for name, data in ctx["fixtures"].items():
+        def identify():
+            response = client.post("/face/identify", files={"file": ("upload.jpg", data, "image/jpeg")})
+            response.raise_for_status()
+        results[f"identify/{name}"] = timed(identify, args.repeat)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Cases whose p50 or p95 exceeds the baseline by more than ``tolerance``."""
+    regressions = []
+    for case, current in results.items():
+        previous = baseline.get(case)
+        if previous is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if previous[metric] > 0 and current[metric] > previous[metric] * (1.0 + tolerance):
+                regressions.append((case, metric, previous[metric], current[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--image", help="Face photo to use as an extra upload fixture")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per case")
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--million", action="store_true",
+                        help=f"Also time search over {LARGE_GALLERY} vectors (see the module docstring for the cost)")
+    parser.add_argument("--backends", nargs="+", default=["flat"])
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--det-size", type=int, default=320)
+    parser.add_argument("--device", type=int, default=-1, help="-1 for CPU, else the GPU ordinal")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown before flagging")
+    args = parser.parse_args()
+
+    ctx = {"fixtures": fixtures(args), "tmp": tempfile.mkdtemp(prefix="fr-bench-")}
+    if any(stage in ENGINE_STAGES for stage in args.stages):
+        from face_engine.engine import FacialRecognitionEngine
+
+        ctx["engine"] = FacialRecognitionEngine(device=args.device, det_size=(args.det_size, args.det_size))
+
+    results = {}
+    try:
+        for stage in STAGES:
+            if stage not in args.stages:
+                continue
+            print(f"Running {stage} ...")
+            for case, summary in globals()[f"bench_{stage}"](ctx, args).items():
+                results[f"{stage}/{case}"] = summary
+    finally:
+        if "orchestrator" in ctx:
+            ctx["orchestrator"].vector_store.close()
+            ctx["orchestrator"].image_db.close()
+        shutil.rmtree(ctx["tmp"], ignore_errors=True)
+
+    print(f"{'case':<36}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per s':>12}")
+    for case, r in results.items():
+        print(f"{case:<36}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['throughput_per_s']:>12.1f}")
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "det_size": args.det_size,
+            "device": args.device,
+            "repeat": args.repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for case, metric, before, after in regressions:
+            print(f"REGRESSION {case} {metric}: {before:.3f} -> {after:.3f} ms (+{(after / before - 1) * 100:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
 
 if __name__ == "__main__":
-    test_face_engine_initialization()
+    main()
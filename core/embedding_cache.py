@@ -0,0 +1,179 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.lru import LRUCache
+
+logger = get_logger(__name__)
+
+# Cached result of an upload whose largest face failed the quality gate
+REJECTED = "rejected"
+
+
+class CachedFace:
+    """Detection and embedding of the largest face of an upload.
+
+    Holds no pixels; the upload is decoded again only when its images have
+    to be stored.
+    """
+
+    __slots__ = ("embedding", "bbox", "kps", "det_score")
+
+    def __init__(self, embedding: np.ndarray, bbox: np.ndarray, kps: Optional[np.ndarray], det_score: float):
+        self.embedding = embedding
+        self.bbox = bbox
+        self.kps = kps
+        self.det_score = det_score
+
+    @property
+    def nbytes(self) -> int:
+        return self.embedding.nbytes + self.bbox.nbytes + (0 if self.kps is None else self.kps.nbytes) + 64
+
+
+def _sizeof(entry) -> int:
+    return entry.nbytes if isinstance(entry, CachedFace) else 64
+
+
+class EmbeddingCache:
+    """Upload bytes -> largest-face embedding, so repeated uploads skip inference.
+
+    Keys hash the upload together with ``fingerprint``, which must describe
+    everything that changes the result (model, detector size, quality gate).
+    Entries live in a bounded in-memory LRU and, when ``disk_path`` is set,
+    in a SQLite table that survives restarts. Both tiers expire entries after
+    ``ttl`` seconds. Only the embedding is cached, never a match: callers still
+    search the gallery, so deletes and merges are respected.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        max_items: int = 4096,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        ttl: Optional[float] = 3600.0,
+        disk_path: Optional[str] = None
+    ):
+        self.fingerprint = fingerprint.encode()
+        self.ttl = ttl
+        self.memory = LRUCache(max_items=max_items, max_bytes=max_bytes, ttl=ttl, sizeof=_sizeof)
+        self.disk_path = disk_path
+        self._disk = None
+        self._disk_lock = threading.Lock()
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, isolation_level=None, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=NORMAL")
+            self._disk.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB,
+                    bbox BLOB,
+                    kps BLOB,
+                    det_score REAL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            self._expire_disk()
+            logger.info("Embedding cache disk tier at %s", disk_path)
+
+    def key(self, content: bytes) -> str:
+        digest = hashlib.blake2b(self.fingerprint, digest_size=20)
+        digest.update(b"\0")
+        digest.update(content)
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """The cached CachedFace or REJECTED for ``key``, or None on a miss."""
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+        if self._disk is not None:
+            entry = self._get_disk(key)
+            if entry is not None:
+                self.disk_hits += 1
+                self.memory.put(key, entry)
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key: str, entry):
+        self.memory.put(key, entry)
+        if self._disk is None:
+            return
+        if isinstance(entry, CachedFace):
+            row = (
+                key,
+                entry.embedding.astype(np.float32).tobytes(),
+                entry.bbox.astype(np.float32).tobytes(),
+                None if entry.kps is None else entry.kps.astype(np.float32).tobytes(),
+                float(entry.det_score),
+                time.time(),
+            )
+        else:
+            row = (key, None, None, None, None, time.time())
+        try:
+            with self._disk_lock:
+                self._disk.execute("INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?, ?, ?)", row)
+        except sqlite3.Error as e:
+            # The disk tier is best effort; the memory tier still holds the entry
+            logger.warning("Embedding cache write failed: %s", e)
+
+    def _get_disk(self, key: str):
+        try:
+            with self._disk_lock:
+                row = self._disk.execute(
+                    "SELECT embedding, bbox, kps, det_score, stored_at FROM embedding_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Embedding cache read failed: %s", e)
+            return None
+        if row is None:
+            return None
+        embedding, bbox, kps, det_score, stored_at = row
+        if self.ttl is not None and time.time() - stored_at > self.ttl:
+            return None
+        if embedding is None:
+            return REJECTED
+        return CachedFace(
+            np.frombuffer(embedding, dtype=np.float32),
+            np.frombuffer(bbox, dtype=np.float32),
+            None if kps is None else np.frombuffer(kps, dtype=np.float32).reshape(-1, 2),
+            det_score,
+        )
+
+    def _expire_disk(self):
+        if self.ttl is None:
+            return
+        with self._disk_lock:
+            removed = self._disk.execute(
+                "DELETE FROM embedding_cache WHERE stored_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+        if removed:
+            logger.info("Expired %s embedding cache entries", removed)
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        hits = memory["hits"] + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "entries": memory["entries"],
+            "bytes": memory["bytes"],
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": memory["evictions"],
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._disk is not None:
+            with self._disk_lock:
+                self._disk.close()
+            self._disk = None
@@ -0,0 +1,294 @@
+"""Offline bulk enrollment of a directory tree or CSV manifest of face images.
+
+Usage:
+    python -m core.enroll photos/                    # photos/<name>/*.jpg
+    python -m core.enroll manifest.csv --workers 8   # columns: path,name
+
+In a directory, images in a subdirectory are registered under the
+subdirectory's path (``photos/alice/1.jpg`` as "alice") and images directly
+in the root are identified without a name. Manifest paths are relative to
+the manifest; an empty name identifies.
+
+Decoding, detection, embedding and crop encoding run in worker processes.
+The parent resolves embeddings against the gallery in file order and
+commits every ``--commit-every`` images as one gallery append and one
+ImageDB transaction, so the gallery and image DB end up as sequential
+``/face/register`` and ``/face/identify`` calls would have left them. The
+gallery is indexed exactly (flat) while enrolling and ``--index-backend`` is
+built once at the end if the gallery has reached ``--ann-min-rows``, as the
+server would. Committed paths are recorded in a state file; running the
+same command again after an interruption skips them.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from storage.db import encode_image
+from vector_db import backends
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+# Set in each worker process by _init_worker
+_worker = None
+
+
+def walk_directory(root: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yield ``(path, name)`` for each image under ``root``, in sorted order."""
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        relative = os.path.relpath(directory, root)
+        name = None if relative == "." else relative.replace(os.sep, "/")
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(directory, filename), name
+
+
+def read_manifest(manifest: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yield ``(path, name)`` for each row of a CSV with ``path`` and ``name`` columns."""
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            path = row["path"].strip()
+            yield os.path.join(base, path), (row.get("name") or "").strip() or None
+
+
+def list_sources(source: str) -> List[Tuple[str, Optional[str]]]:
+    if os.path.isdir(source):
+        return list(walk_directory(source))
+    return list(read_manifest(source))
+
+
+def _init_worker(options: dict, codec: str, quality: int):
+    global _worker
+    from core.orchestrator import Orchestrator
+
+    # Only the models: the parent owns the gallery and the image DB
+    orchestrator = Orchestrator(defer_loading=True, embedding_cache_size=0, **options)
+    orchestrator.start(components=("fr_engine",))
+    _worker = (orchestrator, codec, quality)
+
+
+def _use_local_worker(orchestrator, codec: str, quality: int):
+    # --workers 0: embed with the parent's own orchestrator
+    global _worker
+    _worker = (orchestrator, codec, quality)
+
+
+def embed_files(paths: List[str]) -> list:
+    """Embed the largest face of each file, as ``/face/register`` would.
+
+    Returns per path ``("ok", embedding, {kind: encoded bytes})``,
+    ``("rejected", None, None)`` when the quality gate fails or
+    ``("error", message, None)``.
+    """
+    orchestrator, codec, quality = _worker
+    images = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                images.append(orchestrator.open_image(f.read()))
+        except Exception as e:
+            images.append(e)
+
+    results = []
+    for embedded in orchestrator.embed_faces(images):
+        if embedded is None:
+            results.append(("rejected", None, None))
+        elif isinstance(embedded, Exception):
+            results.append(("error", str(embedded), None))
+        else:
+            embedding, face_images = embedded
+            try:
+                encoded = {kind: encode_image(image, codec, quality) for kind, image in face_images.items()}
+                results.append(("ok", embedding, encoded))
+            except Exception as e:
+                results.append(("error", str(e), None))
+    return results
+
+
+def read_state(path: str) -> set:
+    """Paths already committed by an earlier run; failed ones are retried."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    line = "\n"
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by the interruption
+                continue
+            if entry.get("status") != "error":
+                done.add(entry["path"])
+    if not line.endswith("\n"):
+        # Start this run's entries on a line of their own
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n")
+    return done
+
+
+def commit(orchestrator, items: list, state) -> dict:
+    """Resolve and store one batch of ``(path, name, result)`` in file order.
+
+    Returns the number of images per outcome.
+    """
+    counts = {"registered": 0, "exists": 0, "rejected": 0, "error": 0}
+    accepted = [(k, name, result) for k, (_, name, result) in enumerate(items) if result[0] == "ok"]
+    enrolled = orchestrator.enroll([(result[1], result[2], name) for _, name, result in accepted])
+    outcome = {k: ("registered" if is_new else "exists", face_id)
+               for (k, _, _), (face_id, is_new) in zip(accepted, enrolled)}
+
+    for k, (path, _, result) in enumerate(items):
+        status, face_id = outcome.get(k, (result[0], None))
+        counts[status] += 1
+        entry = {"path": path, "status": status, "face_id": face_id}
+        if status == "error":
+            entry["error"] = result[1]
+        state.write(json.dumps(entry) + "\n")
+    state.flush()
+    os.fsync(state.fileno())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Directory of images (one subdirectory per name) or CSV manifest")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Embedding processes (0: embed in this process)")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Images per worker task")
+    parser.add_argument("--commit-every", type=int, default=1024, help="Images per gallery/DB commit")
+    parser.add_argument("--state", help="Progress file used to resume (default: <source>.enroll-state.jsonl)")
+    parser.add_argument("--data-dir", help="Gallery and image DB directory (default: the server's)")
+    parser.add_argument("--model-name", default="antelopev2")
+    parser.add_argument("--device", type=int, help="GPU id, -1 for CPU (default: GPU if available)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per engine call in a worker")
+    parser.add_argument("--similarity-threshold", type=float, default=0.3)
+    parser.add_argument("--index-backend", default="flat", choices=backends.BACKENDS,
+                        help="Index built once enrollment is done")
+    parser.add_argument("--ann-min-rows", type=int, default=50000,
+                        help="Gallery size from which --index-backend replaces the flat index, as on the server")
+    parser.add_argument("--image-codec", default="JPEG")
+    parser.add_argument("--image-quality", type=int, default=90)
+    parser.add_argument("--thumbnail-size", type=int, default=160)
+    parser.add_argument("--keep-full-frame", action="store_true")
+    args = parser.parse_args()
+
+    from core.orchestrator import Orchestrator
+
+    sources = list_sources(args.source)
+    state_path = args.state or os.path.normpath(args.source).rstrip(os.sep) + ".enroll-state.jsonl"
+    done = read_state(state_path)
+    todo = [(path, name) for path, name in sources if path not in done]
+    print(f"{len(sources)} images, {len(sources) - len(todo)} done in an earlier run, {len(todo)} to go")
+    if not todo:
+        return
+
+    # The options that decide embeddings and stored crops, shared with the workers
+    model_options = {
+        "model_name": args.model_name,
+        "device": args.device,
+        "batch_size": args.batch_size,
+        "thumbnail_size": args.thumbnail_size,
+        "keep_full_frame": args.keep_full_frame,
+        "warmup": False,
+    }
+    orchestrator = Orchestrator(
+        defer_loading=True,
+        embedding_cache_size=0,
+        similarity_threshold=args.similarity_threshold,
+        image_codec=args.image_codec,
+        image_quality=args.image_quality,
+        data_dir=args.data_dir,
+        # Exact search while enrolling; the real index is built once at the end
+        index_backend="flat",
+        ann_min_rows=args.ann_min_rows,
+        **model_options
+    )
+    components = ("vector_store", "image_db") if args.workers > 0 else ("fr_engine", "vector_store", "image_db")
+    orchestrator.start(components=components)
+
+    chunks = [todo[start:start + args.chunk_size] for start in range(0, len(todo), args.chunk_size)]
+    pool = None
+    if args.workers > 0:
+        pool = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_options, args.image_codec, args.image_quality)
+        )
+    else:
+        _use_local_worker(orchestrator, args.image_codec, args.image_quality)
+
+    totals = {"registered": 0, "exists": 0, "rejected": 0, "error": 0}
+    processed = 0
+    started = time.perf_counter()
+    batch = []
+    in_flight = deque()
+    next_chunk = 0
+    try:
+        with open(state_path, "a", encoding="utf-8") as state:
+            while next_chunk < len(chunks) or in_flight:
+                # Results are consumed in file order; a bounded window keeps
+                # every worker busy without holding all crops in memory
+                while pool is not None and next_chunk < len(chunks) and len(in_flight) < 2 * args.workers:
+                    chunk = chunks[next_chunk]
+                    in_flight.append((chunk, pool.submit(embed_files, [path for path, _ in chunk])))
+                    next_chunk += 1
+                if pool is None:
+                    chunk = chunks[next_chunk]
+                    results = embed_files([path for path, _ in chunk])
+                    next_chunk += 1
+                else:
+                    chunk, future = in_flight.popleft()
+                    results = future.result()
+                batch.extend((path, name, result) for (path, name), result in zip(chunk, results))
+
+                if len(batch) >= args.commit_every or (next_chunk == len(chunks) and not in_flight):
+                    for status, count in commit(orchestrator, batch, state).items():
+                        totals[status] += count
+                    processed += len(batch)
+                    batch = []
+                    elapsed = time.perf_counter() - started
+                    rate = processed / elapsed if elapsed > 0 else 0.0
+                    eta = (len(todo) - processed) / rate if rate > 0 else 0.0
+                    print(
+                        f"{processed}/{len(todo)} images, {rate:.1f} images/s, ETA {eta:.0f}s - "
+                        + ", ".join(f"{status} {count}" for status, count in totals.items()),
+                        flush=True
+                    )
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    store = orchestrator.vector_store
+    store.backend = args.index_backend
+    if store.desired_backend() != args.index_backend:
+        # The server would swap the index back to flat on load
+        print(
+            f"Keeping the flat index: the gallery has {len(store)} faces, below --ann-min-rows "
+            f"{args.ann_min_rows} at which {args.index_backend} takes over",
+            file=sys.stderr
+        )
+    if store.needs_rebuild():
+        store.rebuild()
+    store.close()
+    orchestrator.image_db.close()
+    elapsed = time.perf_counter() - started
+    print(f"Enrolled {processed} images in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.1f} images/s)")
+    if totals["error"]:
+        print(f"{totals['error']} images failed; see {state_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
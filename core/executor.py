@@ -0,0 +1,88 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from face_engine.scheduler import SchedulerQueueFull, submitted_futures
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ServiceBusy(RuntimeError):
+    """Admission was refused because the executor queue is full."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """Runs blocking inference and storage work off the asyncio event loop.
+
+    At most ``max_pending`` calls may be running or queued at once; beyond
+    that ``run`` fails fast with ``ServiceBusy`` instead of letting latency
+    pile up. A call that exceeds its timeout is cancelled, which drops it
+    from the queue if it has not started yet, along with any images it
+    queued on the BatchScheduler that no batch has picked up.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        max_pending: int = 64,
+        timeout: Optional[float] = 30.0,
+        retry_after: int = 1,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        logger.info(
+            "InferenceExecutor started: max_workers=%s, max_pending=%s, timeout=%s",
+            max_workers, max_pending, timeout
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self, _future):
+        with self._pending_lock:
+            self._pending -= 1
+        self._slots.release()
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise ServiceBusy(f"Server busy ({self.max_pending} requests pending)", self.retry_after)
+        with self._pending_lock:
+            self._pending += 1
+
+        # Run in a copy of the caller's context so request-scoped state
+        # (per-request stage timings) follows the work into the pool
+        context = contextvars.copy_context()
+        scheduled = []
+        context.run(submitted_futures.set, scheduled)
+        future = self._pool.submit(context.run, fn, *args, **kwargs)
+        future.add_done_callback(self._release)
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # Only cancels work that is still queued; running work finishes,
+            # but images it is waiting on are dropped before inference
+            future.cancel()
+            for pending in scheduled:
+                pending.cancel()
+            logger.warning("Request timed out after %ss: %s", timeout, getattr(fn, '__name__', fn))
+            raise
+        except SchedulerQueueFull as e:
+            raise ServiceBusy(str(e), self.retry_after) from e
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,179 @@
+"""Clusters of unnamed faces, for naming many faces at once.
+
+``identify`` registers every unknown face under a new face_id, so a person
+seen many times before being named shows up as many unnamed faces.
+``FaceClusters`` groups unnamed faces whose embeddings are close (see
+``vector_db.cluster``) so an operator can name a whole group in one go.
+
+Clustering a large gallery takes seconds, so it runs on a background thread
+and readers page through the last finished snapshot. Faces named or deleted
+since then are left out of its clusters when read, so naming does not call
+for a new run. A snapshot is stale once an unnamed face has been stored
+after it was taken; asking for a stale snapshot starts a new run.
+"""
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from vector_db.cluster import cluster_embeddings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Cluster:
+    """Unnamed faces that likely show one person, most central first.
+
+    ``cluster_id`` is the lowest face_id in the cluster, so it stays the
+    same across runs as long as that face stays in it.
+    """
+
+    __slots__ = ("cluster_id", "face_ids")
+
+    def __init__(self, cluster_id: str, face_ids: List[str]):
+        self.cluster_id = cluster_id
+        self.face_ids = face_ids
+
+
+class ClusterSnapshot:
+    """Result of one clustering run, largest clusters first."""
+
+    def __init__(self, clusters: List[Cluster], faces: int, last_row_id: int, seconds: float):
+        self.clusters = clusters
+        self.by_id = {cluster.cluster_id: cluster for cluster in clusters}
+        self.faces = faces
+        # Newest ImageDB row when the run started; unnamed faces in later rows
+        # are not in any cluster
+        self.last_row_id = last_row_id
+        self.seconds = seconds
+        self.computed_at = time.time()
+
+    def remove(self, cluster: Cluster):
+        self.clusters.remove(cluster)
+        del self.by_id[cluster.cluster_id]
+
+
+class FaceClusters:
+    def __init__(self, vector_store, image_db, threshold: float = 0.3, k: int = 10, exact_max_rows: int = 20000):
+        self.vector_store = vector_store
+        self.image_db = image_db
+        # Faces are linked to their k nearest unnamed neighbours at least
+        # threshold similar; clusters are the connected groups
+        self.threshold = threshold
+        self.k = k
+        self.exact_max_rows = exact_max_rows
+        self.error = None
+        self._snapshot = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stale(self, snapshot: ClusterSnapshot) -> bool:
+        return self.image_db.has_unnamed_after(snapshot.last_row_id)
+
+    def snapshot(self, refresh: bool = False) -> Optional[ClusterSnapshot]:
+        """The last finished snapshot, or None before the first run ends.
+
+        Starts a run in the background when there is no snapshot, it is
+        stale, or ``refresh`` is set.
+        """
+        snapshot = self._snapshot
+        if refresh or snapshot is None or self.stale(snapshot):
+            self.start()
+        return snapshot
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._thread = threading.Thread(target=self._run, name="face-clusters", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            snapshot = self.compute()
+        except Exception as e:
+            self.error = e
+            logger.error("Clustering unnamed faces failed: %s", e)
+            return
+        with self._lock:
+            self._snapshot = snapshot
+            self.error = None
+
+    def compute(self) -> ClusterSnapshot:
+        """Cluster every unnamed face in the gallery now."""
+        started = time.perf_counter()
+        last_row_id = self.image_db.last_row_id()
+        unnamed = [face["face_id"] for face in self.image_db.get_unnamed_faces()]
+        face_ids, embeddings = self.vector_store.face_embeddings(unnamed)
+        labels = cluster_embeddings(embeddings, k=self.k, threshold=self.threshold,
+                                    exact_max_rows=self.exact_max_rows)
+
+        clusters = []
+        if len(labels):
+            order = np.argsort(labels, kind="stable")
+            labels, face_ids, embeddings = labels[order], face_ids[order], embeddings[order]
+            starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+            sizes = np.diff(np.r_[starts, len(labels)])
+            # Similarity of each face to its cluster's mean orders the members
+            centroids = np.add.reduceat(embeddings, starts, axis=0)
+            centrality = np.einsum("ij,ij->i", embeddings, np.repeat(centroids, sizes, axis=0))
+            for start, size in zip(starts.tolist(), sizes.tolist()):
+                members = face_ids[start:start + size]
+                ranked = members[np.argsort(-centrality[start:start + size], kind="stable")]
+                clusters.append(Cluster(str(members.min()), [str(face_id) for face_id in ranked]))
+        clusters.sort(key=lambda cluster: (-len(cluster.face_ids), int(cluster.cluster_id)))
+
+        seconds = time.perf_counter() - started
+        logger.info("Clustered %s unnamed faces into %s clusters in %.2fs", len(face_ids), len(clusters), seconds)
+        return ClusterSnapshot(clusters, len(face_ids), last_row_id, seconds)
+
+    def page(self, snapshot: ClusterSnapshot, offset: int = 0, limit: int = 20,
+             min_size: int = 2) -> Tuple[List[Cluster], int]:
+        """Clusters ``offset`` to ``offset + limit`` of those with at least ``min_size`` faces.
+
+        Faces named or deleted since the snapshot was taken are left out
+        before clusters are sized, ordered and counted. Returns the page and
+        the number of such clusters.
+        """
+        unnamed = self.image_db.get_unnamed_face_ids()
+        with self._lock:
+            clusters = list(snapshot.clusters)
+        live = []
+        shrunk = False
+        for cluster in clusters:
+            if len(cluster.face_ids) < min_size:
+                # Snapshot clusters are largest first and only ever shrink
+                break
+            if unnamed.issuperset(cluster.face_ids):
+                live.append(cluster)
+                continue
+            face_ids = [face_id for face_id in cluster.face_ids if face_id in unnamed]
+            if len(face_ids) >= min_size:
+                live.append(Cluster(cluster.cluster_id, face_ids))
+                shrunk = True
+        if shrunk:
+            live.sort(key=lambda cluster: (-len(cluster.face_ids), int(cluster.cluster_id)))
+        return live[offset:offset + limit], len(live)
+
+    def name(self, cluster_id: str, name: str, exclude=()) -> Optional[List[str]]:
+        """Name every unnamed face of a cluster in one write, except ``exclude``.
+
+        Returns the face_ids named, or None when the last snapshot has no
+        such cluster. The cluster is dropped from the snapshot.
+        """
+        snapshot = self._snapshot
+        with self._lock:
+            cluster = snapshot.by_id.get(cluster_id) if snapshot is not None else None
+            if cluster is None:
+                return None
+            snapshot.remove(cluster)
+        exclude = set(exclude)
+        return self.image_db.update_names(
+            [face_id for face_id in cluster.face_ids if face_id not in exclude], name, only_unnamed=True
+        )
@@ -1,14 +1,28 @@
-from face_engine.engine import FacialRecognitionEngine
+from face_engine.engine import FacialRecognitionEngine, FaceDetections, EncodedImage, DEFAULT_MODULES, to_bgr, decode, decode_scale
+from face_engine.scheduler import BatchScheduler
+from core.executor import InferenceExecutor
 from core.quality_check import QualityCheck
+from core.embedding_cache import EmbeddingCache, CachedFace, REJECTED
+from core.face_clusters import FaceClusters
 from vector_db.store import VectorStore
 from storage.db import ImageDB
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import numpy as np
+import os
+import threading
+import time
 import uuid as uuid
 from uuid import uuid4
 from utils.logger import get_logger
+from utils import metrics
 
-logger = get_logger()
+logger = get_logger(__name__)
+
+MIN_FACE_SIZE = 80
+
+# matched / registered faces and uploads rejected by the quality gate
+FACES = metrics.counter("fr_faces_total", "Faces resolved against the gallery, by result", ["result"])
 
 class Orchestrator:
     _instance = None
@@ -24,98 +38,654 @@ class Orchestrator:
         model_name: str = "antelopev2",
         device: int = None,
         det_size: tuple = (320, 320),
-        similarity_threshold: float = 0.3
+        det_thresh: float = 0.3,
+        similarity_threshold: float = 0.3,
+        modules: tuple = DEFAULT_MODULES,
+        batch_size: int = 8,
+        batch_wait_ms: float = 2.0,
+        batch_queue_size: int = 256,
+        workers: int = 8,
+        max_pending: int = 64,
+        request_timeout: float = 30.0,
+        embedding_dtype: str = "float32",
+        index_backend: str = "flat",
+        ann_min_rows: int = 50000,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        image_codec: str = "JPEG",
+        image_quality: int = 90,
+        thumbnail_size: int = 160,
+        keep_full_frame: bool = False,
+        embedding_cache_size: int = 4096,
+        embedding_cache_ttl: float = 3600.0,
+        embedding_cache_path: str = None,
+        decode_min_side: int = None,
+        data_dir: str = None,
+        cluster_threshold: float = None,
+        cluster_neighbors: int = 10,
+        warmup: bool = True,
+        defer_loading: bool = False
     ):
         if self.__class__._initialized:
             return
 
-        self.fr_engine = FacialRecognitionEngine(
-            model_name=model_name,
-            device=device,
-            det_size=det_size
+        # batch_size <= 1 keeps inference on the calling thread
+        self.batch_size = max(1, batch_size)
+        # API handlers run identify/register and DB calls here, off the event loop
+        self.executor = InferenceExecutor(
+            max_workers=workers,
+            max_pending=max_pending,
+            timeout=request_timeout
         )
         self.similarity_threshold = similarity_threshold
+        # Large JPEG uploads are decoded at reduced scale while their longest
+        # side stays >= decode_min_side (default 4x the detector input); 0
+        # always decodes at full resolution
+        self.decode_min_side = 4 * max(det_size) if decode_min_side is None else decode_min_side
         self.quality_checker = QualityCheck()
-        self.vector_store = VectorStore(dim=512)
-        self.image_db = ImageDB()
+        # data_dir keeps the gallery, index and image DB together elsewhere
+        # (benchmarks, scratch instances); by default they live in the repo
+        store_paths = {}
+        image_db_path = "storage/images.db"
+        if data_dir is not None:
+            os.makedirs(data_dir, exist_ok=True)
+            store_paths = {
+                "index_path": os.path.join(data_dir, "faiss.index"),
+                "embeddings_path": os.path.join(data_dir, "embeddings.pkl"),
+                "gallery_path": os.path.join(data_dir, "gallery.f32"),
+            }
+            image_db_path = os.path.join(data_dir, "images.db")
+        # Faces are stored as their aligned crop plus a thumbnail; the full
+        # uploaded frame is only kept when keep_full_frame is set
+        self.thumbnail_size = thumbnail_size
+        self.keep_full_frame = keep_full_frame
+
+        # The slow parts of startup are independent, so start() builds them
+        # concurrently: model sessions, the FAISS index, the image DB and the
+        # embedding cache's disk tier
+        self.fr_engine = None
+        self.scheduler = None
+        self.vector_store = None
+        self.image_db = None
+        self.embedding_cache = None
+        self.face_clusters = None
+        # Unnamed faces are grouped for labelling at the matching threshold
+        # by default
+        self._cluster_options = {
+            "threshold": similarity_threshold if cluster_threshold is None else cluster_threshold,
+            "k": cluster_neighbors,
+        }
+        self._loaders = {
+            "fr_engine": lambda: FacialRecognitionEngine(
+                model_name=model_name,
+                device=device,
+                det_size=det_size,
+                modules=modules,
+                det_thresh=det_thresh
+            ),
+            "vector_store": lambda: VectorStore(
+                dim=512,
+                **store_paths,
+                dtype=embedding_dtype,
+                backend=index_backend,
+                ann_min_rows=ann_min_rows,
+                nprobe=nprobe,
+                ef_search=ef_search
+            ),
+            "image_db": lambda: ImageDB(db_path=image_db_path, codec=image_codec, quality=image_quality),
+        }
+        # Byte-identical uploads (kiosk retries) reuse their embedding; the
+        # key covers every setting that changes detection or embedding,
+        # reduced-scale decoding included since it changes the pixels
+        if embedding_cache_size > 0:
+            module_set = None if modules is None else tuple(sorted(modules))
+            fingerprint = (f"{model_name}|{tuple(det_size)}|{det_thresh}|{module_set}|"
+                           f"{self.decode_min_side}|{MIN_FACE_SIZE}")
+            self._loaders["embedding_cache"] = lambda: EmbeddingCache(
+                fingerprint=fingerprint,
+                max_items=embedding_cache_size,
+                ttl=embedding_cache_ttl,
+                disk_path=embedding_cache_path
+            )
+        self._scheduler_options = {
+            "max_batch_size": batch_size,
+            "max_wait_ms": batch_wait_ms,
+            "max_queue_size": batch_queue_size,
+        }
+        self._run_warmup = warmup
+        self.load_error = None
+        self.load_seconds = {}
+        self._ready = threading.Event()
+        self._load_thread = None
+        self._start_lock = threading.Lock()
 
+        # The API defers loading to its startup hook so the process answers
+        # /health (and /ready with 503) while models load
+        if not defer_loading:
+            self.start()
         logger.info("Orchestrator initialized (singleton).")
 
         self.__class__._initialized = True
     
-    def quality_check(self, image: Image.Image) -> bool:
-        """Perform basic quality checks on the image."""
+    @property
+    def ready(self) -> bool:
+        """True once every component is loaded and warmed up."""
+        return self._ready.is_set()
+
+    def start(self, wait: bool = True, components: tuple = None):
+        """Load models, gallery, image DB and cache concurrently, then warm up.
+
+        Idempotent. With ``wait=False`` loading continues on a background
+        thread and ``ready`` turns True when it is done; a failure is kept
+        in ``load_error``. With ``wait=True`` a failure is raised.
+        ``components`` loads only some of "fr_engine", "vector_store",
+        "image_db" and "embedding_cache" (offline tools that need either the
+        models or the storage, not both).
+        """
+        with self._start_lock:
+            if self._load_thread is None:
+                self._load_thread = threading.Thread(
+                    target=self._load, args=(components,), name="orchestrator-load", daemon=True
+                )
+                self._load_thread.start()
+        if wait:
+            self._load_thread.join()
+            if self.load_error is not None:
+                raise self.load_error
+
+    def _load(self, components: tuple = None):
+        started = time.perf_counter()
+        loaders = {name: loader for name, loader in self._loaders.items()
+                   if components is None or name in components}
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(loaders)), thread_name_prefix="load") as pool:
+                futures = {name: pool.submit(self._load_component, name, loader)
+                           for name, loader in loaders.items()}
+                for name, future in futures.items():
+                    setattr(self, name, future.result())
+            if self.fr_engine is not None and self._scheduler_options["max_batch_size"] > 1:
+                self.scheduler = BatchScheduler(self.fr_engine, **self._scheduler_options)
+            if self.vector_store is not None and self.image_db is not None:
+                self.face_clusters = FaceClusters(self.vector_store, self.image_db, **self._cluster_options)
+            self._register_gauges()
+            if self._run_warmup:
+                self._warmup()
+        except Exception as e:
+            self.load_error = e
+            logger.error("Orchestrator failed to load: %s", e)
+            return
+        self._ready.set()
+        timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.load_seconds.items())
+        logger.info("Orchestrator ready in %.2fs (%s)", time.perf_counter() - started, timings)
+
+    def _load_component(self, name: str, loader):
+        started = time.perf_counter()
+        component = loader()
+        self.load_seconds[name] = time.perf_counter() - started
+        return component
+
+    def _warmup(self):
+        """Run each model and the index once so the first request is not the slow one."""
+        started = time.perf_counter()
+        if self.fr_engine is not None:
+            self.fr_engine.warmup(self.batch_size)
+        if self.vector_store is not None:
+            self.vector_store.search_batch(np.ones((1, 512), dtype=np.float32), top_k=1,
+                                           threshold=self.similarity_threshold)
+        self.load_seconds["warmup"] = time.perf_counter() - started
+
+    def _register_gauges(self):
+        metrics.gauge("fr_gallery_faces", "Live faces in the gallery", lambda: len(self.vector_store))
+        metrics.gauge("fr_gallery_rows", "Rows in the search index, tombstones included",
+                      lambda: self.vector_store.index.ntotal)
+        metrics.gauge("fr_executor_pending", "Calls running or queued on the inference executor",
+                      lambda: self.executor.pending)
+        metrics.gauge("fr_executor_max_pending", "Admission limit of the inference executor",
+                      lambda: self.executor.max_pending)
+        if self.scheduler is not None:
+            metrics.gauge("fr_scheduler_queue_depth", "Images waiting for a detection batch",
+                          self.scheduler.queue_depth)
+        if self.embedding_cache is not None:
+            metrics.gauge(
+                "fr_embedding_cache", "Embedding cache counters and size",
+                lambda: {(k,): v for k, v in self.embedding_cache.stats().items() if k != "hit_rate"},
+                ["stat"]
+            )
+
+    def open_image(self, contents: bytes) -> EncodedImage:
+        """Wrap an upload for single, reduced-resolution decoding on the worker thread."""
+        return EncodedImage(contents, min_side=self.decode_min_side)
+
+    def quality_check(self, detections: FaceDetections) -> bool:
+        """Perform basic quality checks on an existing detection result."""
         # size of face is at least 160x160
-        if not self.quality_checker.min_face_size(image, min_size=80):
+        with metrics.stage("quality"):
+            passed = self.quality_checker.min_face_size(detections, min_size=MIN_FACE_SIZE)
+        if not passed:
             logger.warning("Face too small")
             return False
         
         
         # face is not fromtal +-20 degrees is acceptable
-        # if not self.quality_checker.is_frontal(image, angle_threshold=20):
+        # if not self.quality_checker.is_frontal(detections, angle_threshold=20):
         #     logger.warning("Face not frontal")
         #     return "Face not frontal"
 
         return True
+
+    def quality_filter(self, detections: FaceDetections) -> list:
+        """Indices of every face that passes the per-face quality gates."""
+        with metrics.stage("quality"):
+            return self.quality_checker.passing_faces(detections, min_size=MIN_FACE_SIZE)
+
+    def _detect_and_embed(self, image: Image.Image, content: bytes = None):
+        """Detect once, gate on quality, then embed the largest face.
+
+        Returns the embedded detections, or None when the quality gate fails.
+        With the upload's ``content``, results are served from and stored in
+        the embedding cache; detections from the cache carry no pixels.
+        """
+        detections = self._cached_detect_and_embed(image, content)
+        if detections is None:
+            FACES.inc(result="rejected")
+        return detections
+
+    def _cached_detect_and_embed(self, image: Image.Image, content: bytes = None):
+        if content is None or self.embedding_cache is None:
+            return self._run_detect_and_embed(image)
+
+        key = self.embedding_cache.key(content)
+        cached = self.embedding_cache.get(key)
+        if cached is REJECTED:
+            return None
+        if cached is not None:
+            return FaceDetections(
+                None,
+                cached.bbox[None, :],
+                None if cached.kps is None else cached.kps[None, :],
+                np.array([cached.det_score], dtype=np.float32),
+                cached.embedding[None, :]
+            )
+
+        detections = self._run_detect_and_embed(image)
+        if detections is None:
+            self.embedding_cache.put(key, REJECTED)
+        else:
+            self.embedding_cache.put(key, CachedFace(
+                np.array(detections.embeddings[0], dtype=np.float32),
+                np.array(detections.bboxes[0], dtype=np.float32),
+                None if detections.kps is None else np.array(detections.kps[0], dtype=np.float32),
+                float(detections.det_scores[0])
+            ))
+        return detections
+
+    def _run_detect_and_embed(self, image: Image.Image):
+        if self.scheduler is not None:
+            detections = self.scheduler.submit(image, max_num=1, accept=self.quality_check).result()
+            if detections.embeddings is None:
+                return None
+            return detections
+
+        detections = self.fr_engine.detect(image, max_num=1)
+        if not self.quality_check(detections):
+            return None
+        return self.fr_engine.embed(detections)
+
+    def _face_images(self, detections: FaceDetections, index: int = 0, image: Image.Image = None) -> dict:
+        """Images stored for a face: aligned crop, thumbnail and optionally the full frame.
+
+        ``image`` is decoded here when ``detections`` came from the embedding
+        cache without pixels.
+        """
+        if detections.image_bgr is None:
+            detections.image_bgr = to_bgr(image)
+            detections.scale = decode_scale(image)
+        image_bgr = detections.image_bgr
+        aligned = self.fr_engine.align(image_bgr, detections.pixel_kps()[index:index + 1])[0]
+        thumb = self._face_crop(image_bgr, detections.bboxes[index] * detections.scale)
+        thumb.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        images = {"crop": Image.fromarray(np.ascontiguousarray(aligned[:, :, ::-1])), "thumb": thumb}
+        if self.keep_full_frame:
+            images["full"] = Image.fromarray(np.ascontiguousarray(image_bgr[:, :, ::-1]))
+        return images
     
     # identify method - just convert face_id to string when storing/retrieving
-    def identify(self, image: Image.Image):
+    def identify(self, image: Image.Image, content: bytes = None):
+        """Match the largest face against the gallery, registering it if unknown.
 
-        quality_passed = self.quality_check(image)
-        if not quality_passed:
+        ``content`` is the raw upload; when given, repeated uploads of the
+        same bytes skip inference via the embedding cache.
+        """
+        detections = self._detect_and_embed(image, content)
+        if detections is None:
             return {"quality_check": "failed", "reason": "Face too small"}
+        # Search and registration are one atomic step, so concurrent
+        # requests showing the same unknown person share one face_id
+        face_id, similarity, is_new = self._match_or_add([detections.embeddings[0]])[0]
+        logger.debug("Identification response: %s, %s", face_id, similarity)
 
-        embedding = self.fr_engine.get_embedding_from_pil(image)
-        response = self.vector_store.search(embedding, top_k=1)
-        
-        if not response:
-            response = [(None, 0.0)]  # No match found
-        logger.info(f"Identification response: {response}")
-        
-        if response[0][1] >= self.similarity_threshold:
-            print(f"Match found with similarity: {response[0][1]}")
-            face_id = str(response[0][0])  # Convert to string
-            face_id, name = self.image_db.retrieve_by_face_id(face_id)
-            logger.info(f"Matched face_id: {face_id} with name: {name}")
-            return {"type" : "matched", "face_id": face_id, "name": name, "similarity": str(response[0][1])}
-        
-        else:
-            face_id = self.vector_store.add_embedding(embedding)
-            face_id = str(face_id)  # Convert to string
-            logger.info(f"New embedding added with index: {face_id}")
-            self.image_db.store_image(image, face_id=face_id)
-            face_id, name = self.image_db.retrieve_by_face_id(face_id)
-            logger.info(f"Registered new face_id: {face_id} with name: {name}")
-        return {"type" : "registered", "face_id": face_id, "name": name, "similarity": "N/A"}  
+        if not is_new:
+            # The face may have been registered a moment ago by another
+            # request that has not stored its images yet
+            name = self.image_db.get_names([face_id]).get(face_id)
+            logger.debug("Matched face_id: %s with name: %s", face_id, name)
+            return {"type" : "matched", "face_id": face_id, "name": name, "similarity": str(similarity)}
+
+        self.image_db.store_image(self._face_images(detections, image=image), face_id=face_id)
+        logger.info("Registered new face_id: %s", face_id)
+        return {"type" : "registered", "face_id": face_id, "name": None, "similarity": "N/A"}
     
     
-    def register(self, image: Image.Image, name: str):
-        if not self.quality_check(image):
+    def register(self, image: Image.Image, name: str, content: bytes = None):
+        detections = self._detect_and_embed(image, content)
+        if detections is None:
             return {"status": "failed", "reason": "Image failed quality checks"}
 
-        embedding = self.fr_engine.get_embedding_from_pil(image)
-        response = self.vector_store.search(embedding, top_k=1)
-        if response and response[0][1] >= self.similarity_threshold:
-            face_id = str(response[0][0])  # Convert to string
-            logger.info(f"Face already registered with similarity: {response[0][1]}")
-            self.image_db.store_image(image, face_id=face_id, name=name)
-            return {"status": "exists", "face_id": face_id, "name": name}
-        # If no match found, register new embedding
-        face_id = self.vector_store.add_embedding(embedding)
-        face_id = str(face_id)  # Convert to string
-        logger.info(f"New embedding added with index: {face_id}")
-        self.image_db.store_image(image, face_id=face_id, name=name)
-        return {"status": "success", "face_id": face_id, "name": name}
+        face_id, similarity, is_new = self._match_or_add([detections.embeddings[0]])[0]
+        if is_new:
+            logger.info("New embedding added with index: %s", face_id)
+        else:
+            logger.info("Face already registered with similarity: %s", similarity)
+        self.image_db.store_image(self._face_images(detections, image=image), face_id=face_id, name=name)
+        return {"status": "success" if is_new else "exists", "face_id": face_id, "name": name}
     
+    def _detect_and_embed_all(self, image: Image.Image, max_faces: int = 0) -> FaceDetections:
+        """Detect every face, keep those passing quality gates, embed them in one call."""
+        if self.scheduler is not None:
+            return self.scheduler.submit(image, max_num=max_faces, accept=self.quality_filter).result()
+
+        detections = self.fr_engine.detect(image, max_num=max_faces)
+        return self.fr_engine.embed(detections.select(self.quality_filter(detections)))
+
+    @staticmethod
+    def _face_crop(image_bgr: np.ndarray, bbox, margin: float = 0.25) -> Image.Image:
+        """Crop a face box, grown by ``margin`` on each side, as an RGB PIL image."""
+        x1, y1, x2, y2 = bbox
+        mx, my = (x2 - x1) * margin, (y2 - y1) * margin
+        h, w = image_bgr.shape[:2]
+        x1, y1 = max(0, int(x1 - mx)), max(0, int(y1 - my))
+        x2, y2 = min(w, int(x2 + mx)), min(h, int(y2 + my))
+        return Image.fromarray(np.ascontiguousarray(image_bgr[y1:y2, x1:x2, ::-1]))
+
+    def identify_faces(self, image: Image.Image, max_faces: int = 0):
+        """Identify every face in the image with one batched search.
+
+        Unknown faces are registered like ``identify`` does, each with its
+        own crop and thumbnail. ``max_faces > 0`` limits
+        the result to the largest faces.
+        """
+        detections = self._detect_and_embed_all(image, max_faces=max_faces)
+        if len(detections) == 0:
+            return {"faces": []}
+
+        faces = []
+        for k, (face_id, similarity, is_new, name) in enumerate(self.resolve_detections(detections)):
+            faces.append({
+                "bbox": [round(float(v), 1) for v in detections.bboxes[k]],
+                "det_score": round(float(detections.det_scores[k]), 4),
+                "type": "registered" if is_new else "matched",
+                "face_id": face_id,
+                "name": name,
+                "similarity": "N/A" if is_new else str(similarity),
+            })
+        logger.info("Identified %s faces in image", len(faces))
+        return {"faces": faces}
+
+    def resolve_detections(self, detections: FaceDetections, register_unknown: bool = True) -> list:
+        """Identify faces that are already detected and embedded, with one batched search.
+
+        With ``register_unknown``, unknown faces are registered like
+        ``identify`` does, each with its own crop and thumbnail; otherwise
+        they get no face_id. Returns ``(face_id, similarity, is_new, name)``
+        per face, in order.
+        """
+        if register_unknown:
+            resolved = self._match_or_add(list(detections.embeddings))
+            self.image_db.store_images([
+                (self._face_images(detections, k), face_id, None)
+                for k, (face_id, _, is_new) in enumerate(resolved) if is_new
+            ])
+        else:
+            results = self.vector_store.search_batch(
+                detections.embeddings, top_k=1, threshold=self.similarity_threshold
+            )
+            resolved = [(str(r[0][0]), r[0][1], False) if r else (None, None, False) for r in results]
+        names = self.image_db.get_names({face_id for face_id, _, _ in resolved if face_id is not None})
+        return [(face_id, similarity, is_new, names.get(face_id)) for face_id, similarity, is_new in resolved]
+
+    def _embed_images(self, images: list) -> list:
+        """Embed the largest face of each image using batched engine calls.
+
+        Returns one entry per image, in order: the embedded detections of
+        that face, None when the image failed quality checks, or the exception raised for it. Entries
+        of ``images`` that are already exceptions (failed uploads) pass through.
+        """
+        results = [None] * len(images)
+        decoded = []
+        for i, image in enumerate(images):
+            if isinstance(image, Exception):
+                results[i] = image
+                continue
+            try:
+                decoded.append((i, decode(image)))
+            except Exception as e:
+                results[i] = e
+
+        for start in range(0, len(decoded), self.batch_size):
+            chunk = decoded[start:start + self.batch_size]
+            try:
+                batch = self.fr_engine.detect_batch([img for _, img in chunk], max_num=1)
+                accepted = [(i, det) for (i, _), det in zip(chunk, batch) if self.quality_check(det)]
+                FACES.inc(len(chunk) - len(accepted), result="rejected")
+                self.fr_engine.embed_batch([det for _, det in accepted])
+            except Exception as e:
+                for i, _ in chunk:
+                    results[i] = e
+                continue
+            for i, det in accepted:
+                results[i] = det
+        return results
+
+    def _match_or_add(self, embeddings: list) -> list:
+        """Resolve embeddings against the gallery, registering unknown faces.
+
+        Atomic with respect to concurrent callers (see
+        ``VectorStore.match_or_add``): the same unknown face presented by
+        parallel requests gets one face_id. An unmatched embedding that
+        matches an earlier one from the same batch reuses its new face_id,
+        as sequential calls would. Returns ``(face_id, similarity, is_new)``
+        per embedding.
+        """
+        resolved = self.vector_store.match_or_add(np.vstack(embeddings), threshold=self.similarity_threshold)
+        registered = sum(1 for _, _, is_new in resolved if is_new)
+        FACES.inc(len(resolved) - registered, result="matched")
+        FACES.inc(registered, result="registered")
+        return [(str(face_id), similarity, is_new) for face_id, similarity, is_new in resolved]
+
+    def identify_batch(self, images: list) -> list:
+        """Identify many images at once; returns one response per image, in order."""
+        detected = self._embed_images(images)
+        responses = [None] * len(images)
+        valid = []
+        for i, detections in enumerate(detected):
+            if detections is None:
+                responses[i] = {"quality_check": "failed", "reason": "Face too small"}
+            elif isinstance(detections, Exception):
+                responses[i] = {"error": f"Error processing image: {str(detections)}"}
+            else:
+                valid.append(i)
+        if not valid:
+            return responses
+
+        resolved = self._match_or_add([detected[i].embeddings[0] for i in valid])
+        self.image_db.store_images([
+            (self._face_images(detected[i]), face_id, None)
+            for i, (face_id, _, is_new) in zip(valid, resolved) if is_new
+        ])
+        names = self.image_db.get_names({face_id for face_id, _, _ in resolved})
+
+        for i, (face_id, similarity, is_new) in zip(valid, resolved):
+            if is_new:
+                responses[i] = {"type": "registered", "face_id": face_id, "name": names.get(face_id), "similarity": "N/A"}
+            else:
+                responses[i] = {"type": "matched", "face_id": face_id, "name": names.get(face_id), "similarity": str(similarity)}
+        logger.info("Batch identified %s/%s images", len(valid), len(images))
+        return responses
+
+    def register_batch(self, images: list, names: list) -> list:
+        """Register many images at once; ``names`` is parallel to ``images``."""
+        detected = self._embed_images(images)
+        responses = [None] * len(images)
+        valid = []
+        for i, detections in enumerate(detected):
+            if detections is None:
+                responses[i] = {"status": "failed", "reason": "Image failed quality checks"}
+            elif isinstance(detections, Exception):
+                responses[i] = {"status": "failed", "reason": f"Error processing image: {str(detections)}"}
+            else:
+                valid.append(i)
+        if not valid:
+            return responses
+
+        resolved = self._match_or_add([detected[i].embeddings[0] for i in valid])
+        self.image_db.store_images([
+            (self._face_images(detected[i]), face_id, names[i]) for i, (face_id, _, _) in zip(valid, resolved)
+        ])
+
+        for i, (face_id, _, is_new) in zip(valid, resolved):
+            responses[i] = {"status": "success" if is_new else "exists", "face_id": face_id, "name": names[i]}
+        logger.info("Batch registered %s/%s images", len(valid), len(images))
+        return responses
+
+    def embed_faces(self, images: list) -> list:
+        """Embed the largest face of each image without touching the gallery.
+
+        Returns one entry per image, in order: ``(embedding, face images by
+        kind)``, None when the image failed quality checks, or the exception
+        raised for it. Needs only the models, so enrollment workers can run
+        it while another process owns the gallery.
+        """
+        results = []
+        for detections in self._embed_images(images):
+            if detections is None or isinstance(detections, Exception):
+                results.append(detections)
+                continue
+            try:
+                embedding = np.asarray(detections.embeddings[0], dtype=np.float32)
+                results.append((embedding, self._face_images(detections)))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def enroll(self, faces: list) -> list:
+        """Resolve and store ``(embedding, images, name)`` faces from ``embed_faces``.
+
+        The faces are resolved in order as one gallery append and stored in
+        one transaction. Named faces are stored as ``register_batch`` stores
+        them and unnamed ones as ``identify_batch`` does, except that an
+        unnamed match with no stored images gets these: it was registered by
+        an enrollment interrupted before storing them. Images may be
+        encoded bytes. The gallery is flushed before returning. Returns
+        ``(face_id, is_new)`` per face.
+        """
+        if not faces:
+            return []
+        resolved = self._match_or_add([embedding for embedding, _, _ in faces])
+        stored = set(self.image_db.get_names(
+            {face_id for (_, _, name), (face_id, _, is_new) in zip(faces, resolved) if name is None and not is_new}
+        ))
+        records = []
+        for (_, images, name), (face_id, _, is_new) in zip(faces, resolved):
+            if is_new or name is not None or face_id not in stored:
+                records.append((images, face_id, name))
+                stored.add(face_id)
+        self.image_db.store_images(records)
+        self.vector_store.flush()
+        logger.info("Enrolled %s faces, %s new", len(faces), sum(1 for _, _, is_new in resolved if is_new))
+        return [(face_id, is_new) for face_id, _, is_new in resolved]
+
+    def delete_faces(self, face_ids: list) -> list:
+        """Delete faces from the gallery and their stored images.
+
+        Returns the face_ids that were in the gallery. Deletions take effect
+        for searches at once; space is reclaimed by background compaction.
+        """
+        face_ids = [str(face_id) for face_id in face_ids]
+        deleted = [str(face_id) for face_id in self.vector_store.delete([int(f) for f in face_ids])]
+        self.image_db.delete_faces(face_ids)
+        logger.info("Deleted face_ids: %s", deleted)
+        return deleted
+
+    def merge_faces(self, source_id: str, target_id: str):
+        """Merge two face_ids that belong to the same person into ``target_id``.
+
+        Returns None if either face_id is unknown.
+        """
+        source_id, target_id = str(source_id), str(target_id)
+        if not (self.vector_store.contains(int(source_id)) and self.vector_store.contains(int(target_id))):
+            return None
+        moved = self.vector_store.merge(int(source_id), int(target_id))
+        self.image_db.merge_faces(source_id, target_id)
+        name = self.image_db.get_names([target_id]).get(target_id)
+        logger.info("Merged face_id: %s into %s (%s embedding(s))", source_id, target_id, moved)
+        return {"status": "success", "face_id": target_id, "merged_face_id": source_id, "name": name}
+
+    def reembed(self, face_id: str, image: Image.Image):
+        """Replace a face's embedding with one computed from ``image``.
+
+        Returns None if the face_id is unknown. The face_id and name stay
+        the same; the stored images are replaced with the new ones.
+        """
+        face_id = str(face_id)
+        if not self.vector_store.contains(int(face_id)):
+            return None
+        detections = self._detect_and_embed(image)
+        if detections is None:
+            return {"status": "failed", "reason": "Image failed quality checks"}
+
+        self.vector_store.replace_embedding(int(face_id), detections.embeddings[0])
+        name = self.image_db.get_names([face_id]).get(face_id)
+        self.image_db.store_image(self._face_images(detections), face_id=face_id, name=name)
+        logger.info("Re-embedded face_id: %s", face_id)
+        return {"status": "success", "face_id": face_id, "name": name}
+
     def register_with_id(self, id: str, name: str):
         face_id = str(id)
         self.image_db.update_name(face_id, name)
-        logger.info(f"Updated name to: {name} for face_id: {face_id}")
+        logger.info("Updated name to: %s for face_id: %s", name, face_id)
         return {"status": "success", "face_id": face_id, "name": name}
     
     def get_unnamed_faces(self):
         unnamed_faces = self.image_db.get_unnamed_faces()
-        logger.info(f"Retrieved unnamed faces: {unnamed_faces}")
+        logger.debug("Retrieved unnamed faces: %s", unnamed_faces)
         return unnamed_faces
+
+    def get_face_clusters(self, offset: int = 0, limit: int = 20, min_size: int = 2, refresh: bool = False):
+        """A page of the clusters of unnamed faces, largest first.
+
+        Returns None while the first clustering run is still going. The
+        last snapshot is served while a newer one is computed.
+        """
+        clusters = self.face_clusters
+        snapshot = clusters.snapshot(refresh=refresh)
+        if snapshot is None:
+            if clusters.error is not None and not clusters.running:
+                raise RuntimeError(f"Clustering failed: {clusters.error}")
+            return None
+        page, total = clusters.page(snapshot, offset=offset, limit=limit, min_size=min_size)
+        return {
+            "clusters": [{"cluster_id": c.cluster_id, "size": len(c.face_ids), "face_ids": c.face_ids} for c in page],
+            "total": total,
+            "faces": snapshot.faces,
+            "computed_at": snapshot.computed_at,
+            "stale": clusters.running or clusters.stale(snapshot),
+        }
+
+    def name_face_cluster(self, cluster_id: str, name: str, exclude=()):
+        named = self.face_clusters.name(cluster_id, name, exclude=exclude)
+        if named is None:
+            return None
+        logger.info("Named %s faces of cluster %s as %s", len(named), cluster_id, name)
+        return {"status": "success", "cluster_id": cluster_id, "name": name, "face_ids": named}
     
     
@@ -1,51 +1,64 @@
-import numpy as np
-from insightface.app import FaceAnalysis
-from PIL import Image
+from typing import List, Optional
+from face_engine.engine import FaceDetections
+
 
 class QualityCheck:
-    def __init__(self):
-        self.app = FaceAnalysis(
-            name="antelopev2",
-            root="./insightface_models",
-            providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
-        )
-        self.app.prepare(ctx_id=0, det_size=(320, 320))
+    """Quality gates evaluated on an existing detection result.
+
+    The checks never run a model themselves; they read the boxes and
+    keypoints produced by ``FacialRecognitionEngine.detect``.
+    """
 
-    def _get_largest_face(self, image: Image.Image):
-        faces = self.app.get(np.asarray(image.convert("RGB")))
-        if not faces:
+    def _get_face(self, detections: FaceDetections, index: Optional[int] = None):
+        """Return (bbox, kps) of face ``index``, or of the largest face if None."""
+        idx = detections.largest_index() if index is None else index
+        if idx is None or idx >= len(detections):
             return None
-        return max(
-            faces,
-            key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1])
-        )
+        kps = None if detections.kps is None else detections.kps[idx]
+        return detections.bboxes[idx], kps
+
+    def passing_faces(
+        self,
+        detections: FaceDetections,
+        min_size: int = 120,
+        angle_threshold: Optional[float] = None
+    ) -> List[int]:
+        """Indices of every face that passes the size (and optional frontal) gate."""
+        return [
+            i for i in range(len(detections))
+            if self.min_face_size(detections, min_size, index=i)
+            and (angle_threshold is None or self.is_frontal(detections, angle_threshold, index=i))
+        ]
 
     # ----------------------------
     # Face size check
     # ----------------------------
-    def min_face_size(self, image: Image.Image, min_size: int = 120) -> bool:
-        face = self._get_largest_face(image)
+    def min_face_size(self, detections: FaceDetections, min_size: int = 120, index: Optional[int] = None) -> bool:
+        face = self._get_face(detections, index)
         if face is None:
             return False
+        bbox, _ = face
 
-        w = face.bbox[2] - face.bbox[0]
-        h = face.bbox[3] - face.bbox[1]
+        w = bbox[2] - bbox[0]
+        h = bbox[3] - bbox[1]
 
         return w >= min_size and h >= min_size
 
     # ----------------------------
     # Frontal check (≈ ±50°)
     # ----------------------------
-    def is_frontal(self, image: Image.Image, angle_threshold: float = 50) -> bool:
-        face = self._get_largest_face(image)
+    def is_frontal(self, detections: FaceDetections, angle_threshold: float = 50, index: Optional[int] = None) -> bool:
+        face = self._get_face(detections, index)
         if face is None:
             return False
 
-        kps = face.kps
+        bbox, kps = face
+        if kps is None:
+            return False
         le, re, nose, lm, rm = kps
 
-        w = face.bbox[2] - face.bbox[0]
-        h = face.bbox[3] - face.bbox[1]
+        w = bbox[2] - bbox[0]
+        h = bbox[3] - bbox[1]
 
         # ---- Roll (eye alignment) ----
         eye_dx = re[0] - le[0]
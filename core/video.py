@@ -0,0 +1,294 @@
+"""Face recognition over video files, camera streams and frame iterables.
+
+Usage:
+    python -m core.video footage.mp4 --detect-every 5
+    python -m core.video 0 --register-unknown        # camera index 0
+
+Detection runs every ``detect_every`` frames; in between, tracks follow
+their last two detections at constant velocity. A track is embedded when it
+starts and again only when its face quality improves, so a person standing
+in view costs one recognition call instead of one per frame.
+"""
+import argparse
+import json
+import time
+from typing import Iterable, Iterator, List, Optional, Union
+
+import cv2
+import numpy as np
+
+from face_engine.engine import to_bgr
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Intersection over union of ``box`` with each row of ``boxes``."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-6)
+
+
+def read_frames(source: Union[str, int, Iterable]) -> Iterator:
+    """Yield BGR frames from a video path, a camera index or an iterable of frames."""
+    if not isinstance(source, (str, int)):
+        for frame in source:
+            yield to_bgr(frame)
+        return
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video source: {source}")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+class Track:
+    """A face followed across frames, with the identity of its best embedding."""
+
+    def __init__(self, track_id: int, bbox: np.ndarray, frame_index: int):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.detected_bbox = bbox
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.last_detected = frame_index
+        self.first_seen = frame_index
+        self.missed = 0
+        self.quality = 0.0
+        # Set by the first embedding, matched or not; face_id None then
+        # means an unknown face, not one still to be identified
+        self.resolved = False
+        self.face_id = None
+        self.name = None
+        self.similarity = None
+
+    def predict(self, frame_index: int):
+        """Move the box to ``frame_index`` at the velocity of the last two detections."""
+        self.bbox = self.detected_bbox + self.velocity * (frame_index - self.last_detected)
+
+    def update(self, bbox: np.ndarray, frame_index: int):
+        steps = max(1, frame_index - self.last_detected)
+        self.velocity = (bbox - self.detected_bbox) / steps
+        self.bbox = self.detected_bbox = bbox
+        self.last_detected = frame_index
+        self.missed = 0
+
+
+class TrackEvent:
+    """Identity event for a track: "identified" when its identity is first
+    resolved or changes, "lost" when the track ends."""
+
+    __slots__ = ("type", "track_id", "frame_index", "timestamp", "bbox", "face_id", "name", "similarity")
+
+    def __init__(self, type: str, track: Track, frame_index: int, timestamp: float):
+        self.type = type
+        self.track_id = track.track_id
+        self.frame_index = frame_index
+        self.timestamp = timestamp
+        self.bbox = [round(float(v), 1) for v in track.bbox]
+        self.face_id = track.face_id
+        self.name = track.name
+        self.similarity = track.similarity
+
+    def to_dict(self) -> dict:
+        return {
+            "type": self.type,
+            "track_id": self.track_id,
+            "frame_index": self.frame_index,
+            "timestamp": round(self.timestamp, 3),
+            "bbox": self.bbox,
+            "face_id": self.face_id,
+            "name": self.name,
+            "similarity": "N/A" if self.similarity is None else str(self.similarity),
+        }
+
+
+class VideoPipeline:
+    """Detect every N frames, track in between, embed only when it pays off.
+
+    ``process`` yields TrackEvents. With ``register_unknown`` faces that
+    match nobody are added to the gallery like ``Orchestrator.identify``
+    does; otherwise they are reported with face_id None. ``stats()``
+    reports throughput in frames per second.
+    """
+
+    def __init__(
+        self,
+        orchestrator,
+        detect_every: int = 5,
+        iou_threshold: float = 0.3,
+        max_missed: int = 2,
+        quality_gain: float = 1.25,
+        register_unknown: bool = False,
+        fps: Optional[float] = None
+    ):
+        self.orchestrator = orchestrator
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        # Detection rounds a track may go unmatched before it is lost
+        self.max_missed = max_missed
+        # Re-embed a track once its quality exceeds the embedded one by this factor
+        self.quality_gain = quality_gain
+        self.register_unknown = register_unknown
+        self.fps = fps
+        self.tracks: List[Track] = []
+        self._next_track_id = 0
+        self.frames = 0
+        self.detect_frames = 0
+        self.embeddings = 0
+        self.elapsed = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "detect_frames": self.detect_frames,
+            "embeddings": self.embeddings,
+            "active_tracks": len(self.tracks),
+            "fps": self.frames / self.elapsed if self.elapsed else 0.0,
+        }
+
+    def process(self, source: Union[str, int, Iterable], log_every: float = 10.0) -> Iterator[TrackEvent]:
+        last_log = time.perf_counter()
+        frame_index = -1
+        for frame_index, frame in enumerate(read_frames(source)):
+            yield from self.process_frame(frame, frame_index)
+            now = time.perf_counter()
+            if log_every and now - last_log >= log_every:
+                last_log = now
+                logger.info("Video pipeline: %s", self.stats())
+
+        for track in self.tracks:
+            yield TrackEvent("lost", track, frame_index, self._timestamp(frame_index))
+        self.tracks = []
+        logger.info("Video pipeline finished: %s", self.stats())
+
+    def _timestamp(self, frame_index: int) -> float:
+        return frame_index / self.fps if self.fps else time.time()
+
+    def process_frame(self, frame, frame_index: int) -> List[TrackEvent]:
+        """Advance the tracks by one frame: a BGR array, PIL image or EncodedImage."""
+        started = time.perf_counter()
+        try:
+            return self._process_frame(frame, frame_index)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+    def _process_frame(self, frame, frame_index: int) -> List[TrackEvent]:
+        self.frames += 1
+        for track in self.tracks:
+            track.predict(frame_index)
+        if frame_index % self.detect_every:
+            return []
+
+        self.detect_frames += 1
+        timestamp = self._timestamp(frame_index)
+        detections = self.orchestrator.fr_engine.detect(frame)
+        passing = set(self.orchestrator.quality_filter(detections))
+        matched = self._associate(detections, frame_index)
+
+        events = []
+        kept = []
+        for track in self.tracks:
+            if track.last_detected != frame_index:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    events.append(TrackEvent("lost", track, frame_index, timestamp))
+                    continue
+            kept.append(track)
+        self.tracks = kept
+
+        # Embed new tracks and tracks whose face got clearly better
+        to_embed = []
+        for det_index, track in matched:
+            if det_index not in passing:
+                continue
+            quality = self._quality(detections, det_index)
+            if not track.resolved or quality >= track.quality * self.quality_gain:
+                to_embed.append((det_index, track, quality))
+        if to_embed:
+            events.extend(self._identify(detections, to_embed, frame_index, timestamp))
+        return events
+
+    @staticmethod
+    def _quality(detections, index: int) -> float:
+        x1, y1, x2, y2 = detections.bboxes[index]
+        return float((x2 - x1) * (y2 - y1) * detections.det_scores[index])
+
+    def _associate(self, detections, frame_index: int) -> list:
+        """Greedily match detections to tracks by IoU; unmatched detections start tracks."""
+        matched = []
+        free = list(range(len(self.tracks)))
+        order = np.argsort(-detections.det_scores) if len(detections) else []
+        for det_index in order:
+            det_index = int(det_index)
+            bbox = detections.bboxes[det_index].astype(np.float32)
+            track = None
+            if free:
+                overlaps = iou(bbox, np.array([self.tracks[t].bbox for t in free]))
+                best = int(np.argmax(overlaps))
+                if overlaps[best] >= self.iou_threshold:
+                    track = self.tracks[free.pop(best)]
+                    track.update(bbox, frame_index)
+            if track is None:
+                track = Track(self._next_track_id, bbox, frame_index)
+                self._next_track_id += 1
+                self.tracks.append(track)
+            matched.append((det_index, track))
+        return matched
+
+    def _identify(self, detections, to_embed: list, frame_index: int, timestamp: float) -> List[TrackEvent]:
+        orchestrator = self.orchestrator
+        selected = orchestrator.fr_engine.embed(detections.select([d for d, _, _ in to_embed]))
+        self.embeddings += len(to_embed)
+
+        resolved = orchestrator.resolve_detections(selected, register_unknown=self.register_unknown)
+
+        events = []
+        for (_, track, quality), (face_id, similarity, _, name) in zip(to_embed, resolved):
+            track.quality = quality
+            changed = not track.resolved or face_id != track.face_id
+            track.resolved = True
+            track.face_id, track.name = face_id, name
+            track.similarity = None if similarity is None else round(float(similarity), 4)
+            if changed:
+                events.append(TrackEvent("identified", track, frame_index, timestamp))
+        return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Video file, stream URL or camera index")
+    parser.add_argument("--detect-every", type=int, default=5)
+    parser.add_argument("--register-unknown", action="store_true")
+    parser.add_argument("--max-frames", type=int, default=0, help="Stop after this many frames (0: no limit)")
+    args = parser.parse_args()
+
+    from core.orchestrator import Orchestrator
+
+    orchestrator = Orchestrator()
+    pipeline = VideoPipeline(orchestrator, detect_every=args.detect_every, register_unknown=args.register_unknown)
+    source = read_frames(args.source)
+    if args.max_frames:
+        source = (frame for _, frame in zip(range(args.max_frames), source))
+    for event in pipeline.process(source):
+        print(json.dumps(event.to_dict()))
+    stats = pipeline.stats()
+    print(f"{stats['frames']} frames, {stats['detect_frames']} detected, "
+          f"{stats['embeddings']} embeddings, {stats['fps']:.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
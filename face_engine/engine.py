@@ -1,11 +1,18 @@
+import glob
+import io
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence
 from insightface.app import FaceAnalysis
+from insightface.model_zoo import model_zoo
+from insightface.utils import face_align, ensure_available
+from insightface.model_zoo.scrfd import distance2bbox, distance2kps
 import onnxruntime as ort
 import os
-import torch
 import numpy as np
 import cv2
 from PIL import Image
+from utils import metrics
 import warnings
 import sys
 
@@ -13,16 +20,186 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 os.makedirs('./trt_engine_cache', exist_ok=True)
 ort.set_default_logger_severity(3)
 
+# InsightFace task names. Only detection and recognition feed the
+# identify/register path; landmark_2d_106, landmark_3d_68 and genderage are
+# opt-in because FaceAnalysis.get would otherwise run them for every face.
+DEFAULT_MODULES = ("detection", "recognition")
+
 def pil_to_bgr(image: Image.Image) -> np.ndarray:
     if image.mode != "RGB":
         image = image.convert("RGB")
     img = np.asarray(image)
     return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
 
+# cv2.imdecode flags for libjpeg DCT-domain downscaling, by reduction factor
+_REDUCED_DECODE = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+class EncodedImage:
+    """An upload kept encoded until it is needed, then decoded once straight to BGR.
+
+    Only the header is parsed on construction, so invalid uploads fail
+    early and cheaply. JPEGs whose longest side is at least twice
+    ``min_side`` are decoded at 1/2, 1/4 or 1/8 scale, never below
+    ``min_side``; ``scale`` is decoded pixels per original pixel.
+    EXIF orientation is ignored, as with ``Image.open``.
+    """
+
+    def __init__(self, data: bytes, min_side: int = 0):
+        header = Image.open(io.BytesIO(data))
+        self.data = data
+        self.size = header.size
+        self.format = header.format
+        self.min_side = min_side
+        self.scale = 1.0
+        self._bgr = None
+
+    def reduction(self) -> int:
+        if self.format != "JPEG" or not self.min_side:
+            return 1
+        longest = max(self.size)
+        factor = 1
+        while factor < 8 and longest // (factor * 2) >= self.min_side:
+            factor *= 2
+        return factor
+
+    def decode(self) -> np.ndarray:
+        if self._bgr is None:
+            flags = _REDUCED_DECODE[self.reduction()] | cv2.IMREAD_IGNORE_ORIENTATION
+            with metrics.stage("decode"):
+                img = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), flags)
+                if img is None:
+                    # Formats PIL reads but OpenCV does not (GIF, ...)
+                    img = pil_to_bgr(Image.open(io.BytesIO(self.data)))
+            self.scale = img.shape[1] / self.size[0]
+            self._bgr = img
+        return self._bgr
+
+def to_bgr(image) -> np.ndarray:
+    """Accept a PIL image, an EncodedImage or an already decoded BGR array."""
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, EncodedImage):
+        return image.decode()
+    with metrics.stage("decode"):
+        return pil_to_bgr(image)
+
+def decode(image):
+    """Decode ``image`` once ahead of detection.
+
+    Returns a BGR array, or the EncodedImage itself (now decoded) so its
+    ``scale`` stays available to ``FacialRecognitionEngine.detect``.
+    """
+    if isinstance(image, EncodedImage):
+        image.decode()
+        return image
+    return to_bgr(image)
+
+def decode_scale(image) -> float:
+    """Decoded pixels per original pixel of an image passed to ``to_bgr``."""
+    return image.scale if isinstance(image, EncodedImage) else 1.0
+
+class FaceDetections:
+    """Detect-once result for a single image.
+
+    All arrays are indexed by face: ``bboxes`` is (N, 4) as x1, y1, x2, y2,
+    ``kps`` is (N, 5, 2), ``det_scores`` is (N,) and ``embeddings`` is
+    (N, 512) once :meth:`FacialRecognitionEngine.embed` has run. The BGR
+    image is kept so embedding can reuse the decoded pixels.
+
+    Boxes and keypoints are in original image coordinates. ``image_bgr``
+    may have been decoded at reduced resolution; ``scale`` is its pixels
+    per original pixel.
+    """
+
+    def __init__(
+        self,
+        image_bgr: np.ndarray,
+        bboxes: np.ndarray,
+        kps: Optional[np.ndarray],
+        det_scores: np.ndarray,
+        embeddings: Optional[np.ndarray] = None,
+        scale: float = 1.0,
+    ):
+        self.image_bgr = image_bgr
+        self.bboxes = bboxes
+        self.kps = kps
+        self.det_scores = det_scores
+        self.embeddings = embeddings
+        self.scale = scale
+
+    def __len__(self) -> int:
+        return int(self.det_scores.shape[0])
+
+    def areas(self) -> np.ndarray:
+        return (self.bboxes[:, 2] - self.bboxes[:, 0]) * (self.bboxes[:, 3] - self.bboxes[:, 1])
+
+    def largest_index(self) -> Optional[int]:
+        if len(self) == 0:
+            return None
+        return int(np.argmax(self.areas()))
+
+    def select(self, indices: Sequence[int]) -> "FaceDetections":
+        """Return a new result holding only the faces at ``indices``."""
+        indices = np.asarray(indices, dtype=np.int64)
+        return FaceDetections(
+            self.image_bgr,
+            self.bboxes[indices],
+            None if self.kps is None else self.kps[indices],
+            self.det_scores[indices],
+            None if self.embeddings is None else self.embeddings[indices],
+            self.scale,
+        )
+
+    def pixel_kps(self) -> Optional[np.ndarray]:
+        """Keypoints in ``image_bgr`` pixel coordinates."""
+        if self.kps is None or self.scale == 1.0:
+            return self.kps
+        return self.kps * self.scale
+
+    def to_original(self, scale: float) -> "FaceDetections":
+        """Map boxes and keypoints detected on ``image_bgr`` back to original coordinates."""
+        self.scale = scale
+        if scale != 1.0:
+            self.bboxes = self.bboxes / scale
+            if self.kps is not None:
+                self.kps = self.kps / scale
+        return self
+
 class DummyFile:
     def write(self, x): pass
     def flush(self): pass
 
+class ParallelFaceAnalysis(FaceAnalysis):
+    """FaceAnalysis that creates the ONNX sessions of a model pack concurrently.
+
+    Session creation dominates startup and onnxruntime releases the GIL
+    while building a session, so the pack loads in roughly the time of its
+    largest model. Models are picked exactly as FaceAnalysis picks them.
+    """
+
+    def __init__(self, name, root, allowed_modules=None, **kwargs):
+        ort.set_default_logger_severity(3)
+        self.models = {}
+        self.model_dir = ensure_available("models", name, root=root)
+        onnx_files = sorted(glob.glob(os.path.join(self.model_dir, "*.onnx")))
+        with ThreadPoolExecutor(max_workers=max(1, len(onnx_files))) as pool:
+            loaded = list(pool.map(lambda f: model_zoo.get_model(f, **kwargs), onnx_files))
+        # In file order, the first model of each allowed task wins
+        for model in loaded:
+            if model is None:
+                continue
+            if allowed_modules is not None and model.taskname not in allowed_modules:
+                continue
+            self.models.setdefault(model.taskname, model)
+        if "detection" not in self.models:
+            raise RuntimeError(f"No detection model in {self.model_dir}")
+        self.det_model = self.models["detection"]
+
 class FacialRecognitionEngine:
     _instance = None
     _lock = threading.Lock()
@@ -39,7 +216,9 @@ class FacialRecognitionEngine:
         self,
         device=None,
         det_size=(320, 320),
-        model_name="antelopev2"
+        model_name="antelopev2",
+        modules=DEFAULT_MODULES,
+        det_thresh=0.3,
     ):
         # Prevent re-initialization
         if self.__class__._initialized:
@@ -59,53 +238,276 @@ class FacialRecognitionEngine:
             "trt_context_memory_sharing_enable": True,
         }
 
-        providers = [
-            # ("TensorrtExecutionProvider", trt_options),
-            ("CUDAExecutionProvider", {}),
-            ("CPUExecutionProvider", {}),
-        ]
-
         self.device = device if device is not None else (0 if self._cuda_available() else -1)
+
+        providers = [("CPUExecutionProvider", {})]
+        if self.device >= 0:
+            providers.insert(0, ("CUDAExecutionProvider", {"device_id": self.device}))
+            # providers.insert(0, ("TensorrtExecutionProvider", trt_options))
         self.det_size = det_size
+        # None keeps every module of the model pack, as FaceAnalysis does
+        self.modules = None if modules is None else tuple(modules)
 
         print(
             f"Using device: {'GPU' if self.device >= 0 else 'CPU'} "
-            f"(ctx_id={self.device}), det_size={det_size}, model={model_name}"
+            f"(ctx_id={self.device}), det_size={det_size}, model={model_name}, "
+            f"modules={self.modules}"
         )
 
-        self.app = FaceAnalysis(
+        # Modules outside allowed_modules are dropped right after their task
+        # name is read, so their sessions never stay resident.
+        self.app = ParallelFaceAnalysis(
             name=model_name,
             root="./insightface_models",
+            allowed_modules=list(self.modules) if self.modules is not None else None,
             providers=providers,
         )
 
+        # Sessions already run on the right providers; ctx_id < 0 would make
+        # every model rebuild its session for CPU
         self.app.prepare(
-            ctx_id=self.device,
+            ctx_id=max(self.device, 0),
             det_size=det_size,
-            det_thresh=0.3,
+            det_thresh=det_thresh,
         )
 
         sys.stdout = sys.__stdout__
 
     def _cuda_available(self) -> bool:
-        try:
-            return torch.cuda.is_available()
-        except Exception:
-            return False
+        # onnxruntime runs the models, so ask it rather than importing torch
+        return "CUDAExecutionProvider" in ort.get_available_providers()
 
-    def get_embedding_from_pil(self, img: Image.Image) -> np.ndarray:
-        img_array = np.array(img)
+    def warmup(self, batch_size: int = 1):
+        """Run detection and recognition once per input shape the service uses.
+
+        The first run of a session allocates its buffers (and on GPU picks
+        kernels), so doing it here keeps that cost off the first request.
+        """
+        blank = np.zeros((self.det_size[1], self.det_size[0], 3), dtype=np.uint8)
+        self.detect(blank)
+        if batch_size > 1 and self.supports_batched_detection:
+            self.detect_batch([blank] * batch_size)
+        if "recognition" in self.app.models:
+            size = self.rec_model.input_size[0]
+            crop = np.zeros((size, size, 3), dtype=np.uint8)
+            self.embed_aligned([crop])
+            if batch_size > 1:
+                self.embed_aligned([crop] * batch_size)
+
+    def detect(self, img: Image.Image, max_num: int = 0) -> FaceDetections:
+        """Run face detection once and return boxes, keypoints and scores.
 
-        if img_array.shape[-1] == 3:
-            img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        else:
-            img_bgr = img_array
+        With ``max_num > 0`` only the ``max_num`` largest faces are kept.
+        """
+        img_bgr = to_bgr(img)
+        with metrics.stage("detect"):
+            bboxes, kpss = self.app.det_model.detect(img_bgr, max_num=max_num, metric="max")
+        return FaceDetections(
+            img_bgr,
+            bboxes[:, 0:4],
+            kpss,
+            bboxes[:, 4],
+        ).to_original(decode_scale(img))
 
-        faces = self.app.get(img_bgr)
+    @property
+    def supports_batched_detection(self) -> bool:
+        det_model = self.app.det_model
+        return (
+            getattr(det_model, "batched", False)
+            and det_model.input_size is not None
+            and det_model.input_shape[0] != 1
+        )
+
+    def detect_batch(self, images: Sequence, max_num: int = 0) -> list:
+        """Detect faces in several images with a single detector call.
+
+        Each image is letterboxed onto the detector input exactly as
+        ``SCRFD.detect`` does, stacked into one blob and decoded per image.
+        Detector exports with a fixed batch of 1 fall back to one call per image.
+        """
+        imgs_bgr = [to_bgr(img) for img in images]
+        if len(imgs_bgr) <= 1 or not self.supports_batched_detection:
+            return [self.detect(img, max_num=max_num) for img in images]
+        with metrics.stage("detect"):
+            return self._detect_stacked(images, imgs_bgr, max_num)
+
+    def _detect_stacked(self, images: Sequence, imgs_bgr: list, max_num: int) -> list:
+
+        det_model = self.app.det_model
+        input_w, input_h = det_model.input_size
+        model_ratio = float(input_h) / input_w
+
+        det_imgs, det_scales = [], []
+        for img in imgs_bgr:
+            im_ratio = float(img.shape[0]) / img.shape[1]
+            if im_ratio > model_ratio:
+                new_height = input_h
+                new_width = int(new_height / im_ratio)
+            else:
+                new_width = input_w
+                new_height = int(new_width * im_ratio)
+            det_img = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+            det_img[:new_height, :new_width, :] = cv2.resize(img, (new_width, new_height))
+            det_imgs.append(det_img)
+            det_scales.append(float(new_height) / img.shape[0])
+
+        mean = det_model.input_mean
+        blob = cv2.dnn.blobFromImages(
+            det_imgs, 1.0 / det_model.input_std, (input_w, input_h), (mean, mean, mean), swapRB=True
+        )
+        net_outs = det_model.session.run(det_model.output_names, {det_model.input_name: blob})
+
+        return [
+            self._decode_detections(net_outs, b, img, det_scales[b], max_num).to_original(decode_scale(images[b]))
+            for b, img in enumerate(imgs_bgr)
+        ]
+
+    def _decode_detections(self, net_outs, b, img_bgr, det_scale, max_num) -> FaceDetections:
+        """Decode batch element ``b`` of raw SCRFD outputs (mirrors SCRFD.forward/detect)."""
+        det_model = self.app.det_model
+        input_w, input_h = det_model.input_size
+        fmc = det_model.fmc
+        threshold = det_model.det_thresh
+
+        scores_list, bboxes_list, kpss_list = [], [], []
+        for idx, stride in enumerate(det_model._feat_stride_fpn):
+            scores = net_outs[idx][b]
+            bbox_preds = net_outs[idx + fmc][b] * stride
+            anchor_centers = self._anchor_centers(input_h // stride, input_w // stride, stride)
+
+            pos_inds = np.where(scores >= threshold)[0]
+            scores_list.append(scores[pos_inds])
+            bboxes_list.append(distance2bbox(anchor_centers, bbox_preds)[pos_inds])
+            if det_model.use_kps:
+                kps_preds = net_outs[idx + fmc * 2][b] * stride
+                kpss = distance2kps(anchor_centers, kps_preds)
+                kpss_list.append(kpss.reshape((kpss.shape[0], -1, 2))[pos_inds])
+
+        scores = np.vstack(scores_list)
+        order = scores.ravel().argsort()[::-1]
+        bboxes = np.vstack(bboxes_list) / det_scale
+        pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)[order, :]
+        keep = det_model.nms(pre_det)
+        det = pre_det[keep, :]
+        kpss = None
+        if det_model.use_kps:
+            kpss = (np.vstack(kpss_list) / det_scale)[order, :, :][keep, :, :]
+
+        if max_num > 0 and det.shape[0] > max_num:
+            area = (det[:, 2] - det[:, 0]) * (det[:, 3] - det[:, 1])
+            bindex = np.argsort(area)[::-1][0:max_num]
+            det = det[bindex, :]
+            if kpss is not None:
+                kpss = kpss[bindex, :]
+
+        return FaceDetections(img_bgr, det[:, 0:4], kpss, det[:, 4])
+
+    def _anchor_centers(self, height: int, width: int, stride: int) -> np.ndarray:
+        det_model = self.app.det_model
+        key = (height, width, stride)
+        anchor_centers = det_model.center_cache.get(key)
+        if anchor_centers is None:
+            anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+            anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+            if det_model._num_anchors > 1:
+                anchor_centers = np.stack([anchor_centers] * det_model._num_anchors, axis=1).reshape((-1, 2))
+            if len(det_model.center_cache) < 100:
+                det_model.center_cache[key] = anchor_centers
+        return anchor_centers
+
+    @property
+    def rec_model(self):
+        try:
+            return self.app.models["recognition"]
+        except KeyError:
+            raise RuntimeError("Recognition module is not loaded; add 'recognition' to modules") from None
+
+    def embed_aligned(self, faces) -> np.ndarray:
+        """Embed face crops that are already aligned, skipping detection.
+
+        ``faces`` is one BGR crop or a list of them at the recognition input
+        size (112x112 for antelopev2). Returns an (N, 512) array.
+        """
+        rec_model = self.rec_model
+        if not isinstance(faces, list):
+            faces = [faces]
         if not faces:
+            return np.empty((0, rec_model.output_shape[-1]), dtype=np.float32)
+
+        # Models exported with a fixed batch of 1 cannot take a stacked blob
+        with metrics.stage("embed"):
+            if rec_model.input_shape[0] == 1:
+                return np.vstack([rec_model.get_feat(face) for face in faces])
+            return rec_model.get_feat(faces)
+
+    def align(self, img_bgr: np.ndarray, kps: np.ndarray) -> list:
+        """Warp each face's five keypoints onto the ArcFace template."""
+        size = self.rec_model.input_size[0]
+        with metrics.stage("align"):
+            return [face_align.norm_crop(img_bgr, landmark=k, image_size=size) for k in kps]
+
+    def embed(self, detections: FaceDetections) -> FaceDetections:
+        """Fill ``detections.embeddings`` using the already detected keypoints."""
+        if len(detections) == 0:
+            detections.embeddings = self.embed_aligned([])
+            return detections
+
+        detections.embeddings = self.embed_aligned(self.align(detections.image_bgr, detections.pixel_kps()))
+        return detections
+
+    def embed_batch(self, batch: Sequence[FaceDetections]) -> Sequence[FaceDetections]:
+        """Embed the faces of several images with one recognition call."""
+        crops, counts = [], []
+        for detections in batch:
+            aligned = self.align(detections.image_bgr, detections.pixel_kps()) if len(detections) else []
+            crops.extend(aligned)
+            counts.append(len(aligned))
+
+        embeddings = self.embed_aligned(crops)
+        offset = 0
+        for detections, count in zip(batch, counts):
+            detections.embeddings = embeddings[offset:offset + count]
+            offset += count
+        return batch
+
+    def embed_landmarks(self, img: Image.Image, kps: np.ndarray, bboxes: Optional[np.ndarray] = None) -> FaceDetections:
+        """Embed faces whose keypoints are already known, skipping detection.
+
+        ``kps`` is (N, 5, 2) or (5, 2) in image coordinates. When ``bboxes``
+        is omitted the keypoint extents are used so quality checks still work.
+        """
+        kps = np.asarray(kps, dtype=np.float32).reshape(-1, 5, 2)
+        if bboxes is None:
+            bboxes = np.concatenate([kps.min(axis=1), kps.max(axis=1)], axis=1)
+        img_bgr = to_bgr(img)
+        detections = FaceDetections(
+            img_bgr,
+            np.asarray(bboxes, dtype=np.float32).reshape(-1, 4),
+            kps,
+            np.ones(kps.shape[0], dtype=np.float32),
+            scale=decode_scale(img),
+        )
+        return self.embed(detections)
+
+    def analyze(self, img: Image.Image, max_num: int = 0) -> FaceDetections:
+        """Detect and embed in one pass."""
+        return self.embed(self.detect(img, max_num=max_num))
+
+    def get_faces(self, img: Image.Image, max_num: int = 0):
+        """Full InsightFace pipeline over the loaded modules.
+
+        Use this when attributes such as landmarks or gender/age are needed;
+        they are only produced if those modules were enabled.
+        """
+        return self.app.get(to_bgr(img), max_num=max_num)
+
+    def get_embedding_from_pil(self, img: Image.Image) -> np.ndarray:
+        """Embedding of the largest face in the image."""
+        detections = self.detect(img, max_num=1)
+        if len(detections) == 0:
             raise ValueError("No face detected in image")
 
-        return faces[0].embedding
+        return self.embed(detections).embeddings[0]
     
     # def cosine_similarity(self, emb1: np.ndarray, emb2: np.ndarray) -> float:
     #     """Returns cosine similarity between two embeddings.
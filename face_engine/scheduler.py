@@ -0,0 +1,207 @@
+import contextvars
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from face_engine.engine import FacialRecognitionEngine, FaceDetections, decode
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SchedulerQueueFull(RuntimeError):
+    """Raised by ``submit`` when the pending queue is at ``max_queue_size``."""
+
+
+# When set to a list, ``submit`` appends each future it returns, so a caller
+# that gives up (InferenceExecutor on timeout) can cancel work still queued
+submitted_futures = contextvars.ContextVar("submitted_futures", default=None)
+
+
+class _Request:
+    __slots__ = ("image", "max_num", "accept", "future", "timings")
+
+    def __init__(self, image, max_num: int, accept: Optional[Callable], future: Future):
+        self.image = image
+        self.max_num = max_num
+        self.accept = accept
+        self.future = future
+        # Where the submitting request collects its stage timings
+        self.timings = metrics.current_timings()
+
+
+class BatchScheduler:
+    """Dynamic micro-batching in front of a FacialRecognitionEngine.
+
+    Callers ``submit`` an image and get a ``Future``. A single worker thread
+    takes the first pending request, then keeps collecting until either
+    ``max_batch_size`` requests are gathered or ``max_wait_ms`` has passed,
+    and runs detection and recognition for the whole batch as batched ONNX
+    calls. Each future resolves to that caller's ``FaceDetections``.
+
+    Larger ``max_wait_ms`` / ``max_batch_size`` trade p50 latency for
+    throughput; ``stats()`` reports the batch sizes actually achieved.
+    """
+
+    def __init__(
+        self,
+        engine: FacialRecognitionEngine,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 2.0,
+        max_queue_size: int = 256,
+    ):
+        self.engine = engine
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._closed = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="face-batch-scheduler", daemon=True)
+        self._worker.start()
+        logger.info(
+            "BatchScheduler started: max_batch_size=%s, max_wait_ms=%s, max_queue_size=%s",
+            self.max_batch_size, max_wait_ms, max_queue_size
+        )
+
+    def submit(self, image, max_num: int = 0, accept: Optional[Callable[[FaceDetections], object]] = None) -> Future:
+        """Queue an image for detection and embedding.
+
+        ``accept`` runs on the detections before embedding; when it returns
+        False the future resolves with ``embeddings`` left as None, so images
+        that fail quality gates never reach the recognition model. It may
+        instead return a list of face indices, in which case the result
+        holds only those faces.
+        """
+        if self._closed.is_set():
+            raise RuntimeError("BatchScheduler is closed")
+        future = Future()
+        try:
+            self._queue.put_nowait(_Request(image, max_num, accept, future))
+        except queue.Full:
+            raise SchedulerQueueFull(f"Inference queue is full ({self._queue.maxsize} pending)") from None
+        if self._closed.is_set():
+            # Closed while queueing: close() may already have drained
+            self._fail_pending()
+        scope = submitted_futures.get()
+        if scope is not None:
+            scope.append(future)
+        return future
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+        batches = sum(histogram.values())
+        requests = sum(size * count for size, count in histogram.items())
+        return {
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "queue_depth": self.queue_depth(),
+        }
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop after the batch in progress; requests still queued fail at once."""
+        self._closed.set()
+        self._worker.join(timeout)
+        self._fail_pending()
+
+    def _fail_pending(self):
+        while True:
+            try:
+                req = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            # Cancelled ones have no caller left to tell
+            if req.future.set_running_or_notify_cancel():
+                req.future.set_exception(RuntimeError("BatchScheduler is closed"))
+
+    def _collect(self) -> list:
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._closed.is_set():
+            batch = self._collect()
+            # Skip requests whose callers gave up while they were queued
+            batch = [req for req in batch if req.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+            try:
+                # Batched stages count toward every request in the batch
+                with metrics.attribute_to([req.timings for req in batch]):
+                    self._process(batch)
+            except Exception as e:
+                logger.error("Batch of %s failed: %s", len(batch), e)
+                for req in batch:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+
+    def _process(self, batch: list):
+        # Decode per request so one bad upload fails only its own future
+        ready = []
+        for req in batch:
+            try:
+                with metrics.attribute_to([req.timings]):
+                    req.image = decode(req.image)
+                ready.append(req)
+            except Exception as e:
+                req.future.set_exception(e)
+
+        # Detection is batched per max_num so each request keeps its own cap
+        by_max_num = {}
+        for req in ready:
+            by_max_num.setdefault(req.max_num, []).append(req)
+
+        results = {}
+        for max_num, reqs in by_max_num.items():
+            detections = self.engine.detect_batch([req.image for req in reqs], max_num=max_num)
+            for req, det in zip(reqs, detections):
+                results[id(req)] = det
+
+        to_embed = []
+        for req in ready:
+            det = results[id(req)]
+            try:
+                verdict = True if req.accept is None else req.accept(det)
+            except Exception as e:
+                req.future.set_exception(e)
+                continue
+            if isinstance(verdict, (list, tuple)):
+                # A list of face indices: embed only those faces
+                det = det.select(verdict)
+                results[id(req)] = det
+                to_embed.append(det)
+            elif verdict:
+                to_embed.append(det)
+
+        self.engine.embed_batch(to_embed)
+
+        for req in ready:
+            if not req.future.done():
+                req.future.set_result(results[id(req)])
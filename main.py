@@ -1,14 +1,40 @@
+import argparse
+import os
+import time
+from contextlib import asynccontextmanager
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from api.face_router import router as face_router
 from api.name_router import router as name_router
 from api.image_router import router as image_router
+from api.stream_router import router as stream_router
+from core.orchestrator import Orchestrator
+from utils import metrics
+from utils.logger import configure_logging, dropped_records
+
+# Route uvicorn's own loggers (access log included) through the logging queue
+configure_logging(extra_loggers=("uvicorn",))
+
+orchestrator = Orchestrator()
+
+# Answered while the models are still loading
+PROBE_PATHS = {"/", "/health", "/ready", "/metrics", "/docs", "/redoc", "/openapi.json"}
+STARTING_RETRY_AFTER = 5
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The routers create the orchestrator without loading it; load in the
+    # background so the server is up (and /health answers) in the meantime
+    orchestrator.start(wait=False)
+    yield
 
 app = FastAPI(
     title="Facial Recognition API",
     description="API for facial recognition tasks including detection, verification, and identification.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 # CORS middleware configuration
 app.add_middleware(
@@ -18,6 +44,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+metrics.gauge("fr_log_dropped_records", "Log records dropped because the logging queue was full",
+              dropped_records)
+HTTP_SECONDS = metrics.histogram(
+    "fr_http_request_seconds", "HTTP request latency", ["method", "endpoint", "status"]
+)
+
+# Times every request; clients sending X-Server-Timing get the per-stage
+# breakdown back in a Server-Timing header
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    started = time.perf_counter()
+    with metrics.collect_timings() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    # Labelled by endpoint name rather than URL so path parameters do not
+    # create a series per face id
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        endpoint=route.name if route is not None else "unmatched",
+        status=response.status_code
+    )
+    if "x-server-timing" in request.headers:
+        response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed)
+    return response
+
+# Until the orchestrator is ready, every endpoint but the probes is refused
+@app.middleware("http")
+async def readiness_gate(request: Request, call_next):
+    if orchestrator.ready or request.url.path in PROBE_PATHS:
+        return await call_next(request)
+    if orchestrator.load_error is not None:
+        return JSONResponse(status_code=503, content={"detail": "Service failed to start"})
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service is starting"},
+        headers={"Retry-After": str(STARTING_RETRY_AFTER)}
+    )
+
 # Routers
 app.include_router(
     face_router,
@@ -36,6 +102,12 @@ app.include_router(
     tags=["name"]
 )
 
+app.include_router(
+    stream_router,
+    prefix="/stream",
+    tags=["stream"]
+)
+
 # Basic root endpoints
 @app.get("/")
 async def read_root():
@@ -43,8 +115,73 @@ async def read_root():
 
 @app.get("/health")
 async def health_check():
+    """Liveness: fails only if startup failed, so a restart can fix it."""
+    if orchestrator.load_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": str(orchestrator.load_error)})
     return {"status": "OK"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once models, gallery and image DB are loaded and warmed up."""
+    if orchestrator.ready:
+        return {
+            "status": "ready",
+            "load_seconds": {name: round(seconds, 3) for name, seconds in orchestrator.load_seconds.items()}
+        }
+    if orchestrator.load_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": str(orchestrator.load_error)})
+    return JSONResponse(
+        status_code=503,
+        content={"status": "loading"},
+        headers={"Retry-After": str(STARTING_RETRY_AFTER)}
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text-format metrics: stage latencies, HTTP latencies,
+    match/register counts, gallery size and queue depths."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the Facial Recognition API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes. Workers share the embedding gallery file "
+             "(vector_db/gallery.f32) and SQLite DB, so registrations made by "
+             "one worker are visible to the others on their next search."
+    )
+    parser.add_argument("--log-level", help="Application log level (default INFO)")
+    parser.add_argument(
+        "--log-levels",
+        help='Per-module log levels, e.g. "vector_db.store=DEBUG,storage.db=WARNING"'
+    )
+    parser.add_argument("--log-json", action="store_true", help="Write logs as one JSON object per line")
+    parser.add_argument(
+        "--log-rate",
+        type=float,
+        help="INFO/DEBUG lines per second allowed from one call site (default 20, 0 for no limit)"
+    )
+    args = parser.parse_args()
+
+    # Passed through the environment so worker processes configure the same way
+    for variable, value in (
+        ("FR_LOG_LEVEL", args.log_level),
+        ("FR_LOG_LEVELS", args.log_levels),
+        ("FR_LOG_JSON", "1" if args.log_json else None),
+        ("FR_LOG_RATE", None if args.log_rate is None else str(args.log_rate)),
+    ):
+        if value is not None:
+            os.environ[variable] = value
+    configure_logging(extra_loggers=("uvicorn",))
+
+    # log_config=None leaves uvicorn's loggers as configured above
+    if args.workers > 1:
+        # uvicorn needs an import string to spawn worker processes
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_config=None)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, log_config=None)
\ No newline at end of file
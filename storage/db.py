@@ -1,24 +1,102 @@
 from io import BytesIO
+import hashlib
+import queue
 import sqlite3
-from typing import Dict, Optional
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from PIL import Image
 import os
+from utils import metrics
 from utils.logger import get_logger
 
-logger = get_logger()
+logger = get_logger(__name__)
+
+# Image kinds stored per face, in the order get_image_by_face_id prefers them
+IMAGE_KINDS = ("full", "thumb", "crop")
+CODECS = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+def encode_image(image: Image.Image, codec: str = "JPEG", quality: int = 90) -> bytes:
+    """Encode ``image`` as ``codec``; ``quality`` applies to lossy codecs."""
+    if codec == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    with BytesIO() as output:
+        if codec == "PNG":
+            image.save(output, format="PNG")
+        else:
+            image.save(output, format=codec, quality=quality)
+        return output.getvalue()
+
+def content_hash(data: bytes) -> str:
+    """Hex digest identifying encoded image bytes, stored alongside them."""
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
 
 class ImageDB:
-    def __init__(self, db_path: str = "storage/images.db"):
+    """SQLite store for face metadata and images, safe to share across threads.
+
+    The database runs in WAL mode so readers never wait for the writer.
+    Each thread reads through its own connection. All writes go through
+    one writer thread that commits whatever is queued as a single
+    transaction, so concurrent registrations share commits instead of
+    contending for the write lock; each write still succeeds or fails on
+    its own. Metadata queries are answered from covering indexes and
+    never touch image pages.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "storage/images.db",
+        codec: str = "JPEG",
+        quality: int = 90,
+        max_write_batch: int = 256,
+        busy_timeout: float = 10.0
+    ):
+        # Relative paths are relative to the project root, not the cwd
         base_dir = os.path.dirname(os.path.realpath(__file__))
         project_root = os.path.abspath(os.path.join(base_dir, ".."))
-        db_path = os.path.join(project_root, "storage", "images.db")
+        self.db_path = os.path.join(project_root, db_path)
 
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        codec = codec.upper()
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported image codec {codec!r}; expected one of {list(CODECS)}")
+        # Codec and quality for newly stored images; PNG ignores quality
+        self.codec = codec
+        self.quality = quality
+        self.max_write_batch = max_write_batch
+        self.busy_timeout = busy_timeout
+
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writes = queue.Queue()
         self._create_table()
 
+        self._writer = threading.Thread(target=self._run_writer, name="image-db-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode: the writer thread issues its own BEGIN/COMMIT
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only syncs at checkpoints and stays corruption-safe
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """This thread's read connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
     def _create_table(self):
-        with self.conn:
-            self.conn.execute("""
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            conn.execute("""
                 CREATE TABLE IF NOT EXISTS images (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     face_id TEXT UNIQUE NOT NULL,
@@ -26,94 +104,416 @@ class ImageDB:
                     data BLOB NOT NULL
                 )
             """)
+            # Encoded images live apart from the metadata rows, one per kind
+            # (aligned crop, thumbnail, optional full frame). images.data is
+            # left empty for new rows and only holds legacy full-frame PNGs.
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS face_images (
+                    face_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (face_id, kind)
+                )
+            """)
+            # Content hash of data, so conditional reads never load the image.
+            # Rows written before the column existed have NULL and are hashed
+            # when read.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(face_images)")}
+            if "etag" not in columns:
+                conn.execute("ALTER TABLE face_images ADD COLUMN etag TEXT")
+            # Covering indexes: lookups by face_id or name and the unnamed
+            # listing are answered without reading table rows
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_face_id_name ON images (face_id, name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_name ON images (name, face_id)")
+            # Covers hash lookups; etag sits after the blob in the row itself
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_face_images_etag ON face_images (face_id, kind, format, etag)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _write(self, fn: Callable[[sqlite3.Connection], object]):
+        """Run ``fn(conn)`` inside the writer thread's next transaction and return its result."""
+        if not self._writer.is_alive():
+            raise RuntimeError("ImageDB is closed")
+        future = Future()
+        self._writes.put((fn, future))
+        return future.result()
+
+    def _run_writer(self):
+        conn = self._connect()
+        while True:
+            item = self._writes.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_write_batch:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Finish this batch, then stop
+                    self._writes.put(None)
+                    break
+                batch.append(item)
+            self._commit(conn, batch)
+
+    def _commit(self, conn: sqlite3.Connection, batch: list):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                # A savepoint per write so one failure does not undo the others
+                conn.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((future, fn(conn), None))
+                    conn.execute("RELEASE write")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    outcomes.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error("Write transaction of %s write(s) failed: %s", len(batch), e)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
 
     def store_image(
         self,
-        image: Image.Image,
+        image: Union[Image.Image, Dict[str, Image.Image]],
         face_id,
         name: Optional[str] = None
     ):
-        face_id = str(face_id)
-        with BytesIO() as output:
-            image.save(output, format="PNG")
-            img_bytes = output.getvalue()
+        self.store_images([(image, face_id, name)])
+
+    def encode(self, image: Image.Image, codec: Optional[str] = None) -> bytes:
+        """Encode ``image`` with ``codec`` (default: the configured one) at the configured quality."""
+        return encode_image(image, codec or self.codec, self.quality)
+
+    @metrics.timed("db.store_images")
+    def store_images(self, records: List[Tuple[Union[Image.Image, Dict[str, Image.Image]], object, Optional[str]]]):
+        """Store several (images, face_id, name) records in one transaction.
+
+        ``images`` maps kinds from IMAGE_KINDS to PIL images, or to bytes
+        already encoded with the configured codec; a bare image is stored as
+        the full frame. Images replace any stored for the face. When a
+        face_id appears more than once the last record wins, as with
+        separate calls.
+        """
+        if not records:
+            return
+        latest = {}
+        for images, face_id, name in records:
+            latest.pop(str(face_id), None)
+            latest[str(face_id)] = (images, name)
+        rows, blobs = [], []
+        for face_id, (images, name) in latest.items():
+            if isinstance(images, Image.Image):
+                images = {"full": images}
+            rows.append((face_id, name))
+            for kind, image in images.items():
+                data = image if isinstance(image, bytes) else self.encode(image)
+                blobs.append((face_id, kind, self.codec, data, content_hash(data)))
+
+        def write(conn):
+            conn.executemany("""
+                INSERT INTO images (face_id, name, data) VALUES (?, ?, X'')
+                ON CONFLICT (face_id) DO UPDATE SET name=excluded.name, data=X''
+            """, rows)
+            conn.executemany("DELETE FROM face_images WHERE face_id=?", [(row[0],) for row in rows])
+            conn.executemany("""
+                INSERT INTO face_images (face_id, kind, format, data, etag)
+                VALUES (?, ?, ?, ?, ?)
+            """, blobs)
+
+        # Images are encoded on the calling thread; only SQL runs in the writer
+        self._write(write)
+        logger.debug("Image(s) stored in DB with face_id(s): %s", [row[0] for row in rows])
 
-        with self.conn:
-            self.conn.execute("""
-                INSERT OR REPLACE INTO images (face_id, name, data)
-                VALUES (?, ?, ?)
-            """, (face_id, name, img_bytes))
-        logger.info(f"Image stored in DB with face_id: {face_id}")
+    @metrics.timed("db.get_names")
+    def get_names(self, face_ids) -> Dict[str, Optional[str]]:
+        """Map each stored face_id to its name without reading image data."""
+        face_ids = [str(face_id) for face_id in face_ids]
+        names = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(face_ids), 500):
+            chunk = face_ids[start:start + 500]
+            cur = self.conn.execute(
+                f"SELECT face_id, name FROM images INDEXED BY idx_images_face_id_name WHERE face_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            names.update(cur.fetchall())
+        return names
 
-    def retrieve_by_face_id(self, face_id) -> Optional[Dict]:
+    @metrics.timed("db.retrieve_by_face_id")
+    def retrieve_by_face_id(self, face_id) -> Optional[Tuple[str, Optional[str]]]:
+        """Return (face_id, name) for a stored face, or None."""
         face_id = str(face_id)
-        logger.info(f"Attempting to retrieve face_id: {face_id}")
         cur = self.conn.execute(
-            "SELECT data, name FROM images WHERE face_id=?",
+            "SELECT face_id, name FROM images INDEXED BY idx_images_face_id_name WHERE face_id=?",
             (face_id,)
         )
         row = cur.fetchone()
 
         if not row:
-            logger.info(f"No image found for face_id: {face_id}")
+            logger.debug("No face found for face_id: %s", face_id)
             return None
+        logger.debug("Face found for face_id: %s, name: %s", face_id, row[1])
+        return row
 
-        img_bytes, name = row
-        logger.info(
-            f"Image found for face_id: {face_id}, "
-            f"data size: {len(img_bytes)} bytes, "
-            f"name: {name}"
+    @metrics.timed("db.get_face_ids_by_name")
+    def get_face_ids_by_name(self, name: str) -> List[str]:
+        """All face_ids registered under ``name``."""
+        cur = self.conn.execute(
+            "SELECT face_id FROM images WHERE name=?",
+            (name,)
         )
-
-
-        return face_id, name
+        return [row[0] for row in cur.fetchall()]
     
     def save_image_to_path(self, face_id, output_path: str):
         face_id = str(face_id)
-        logger.info(f"Saving image for face_id: {face_id} to {output_path}")
-        image = self.retrieve_by_face_id(face_id)
+        logger.info("Saving image for face_id: %s to %s", face_id, output_path)
+        image = self.get_image_by_face_id(face_id)
         if image is not None:  # Explicit None check instead of falsy check
             try:
                 image.save(output_path)
-                logger.info(f"Image successfully saved to {output_path}")
+                logger.info("Image successfully saved to %s", output_path)
             except Exception as e:
-                logger.error(f"Error saving image to {output_path}: {e}")
+                logger.error("Error saving image to %s: %s", output_path, e)
         else:
-            logger.info(f"No image retrieved for face_id: {face_id}, cannot save")
+            logger.info("No image retrieved for face_id: %s, cannot save", face_id)
+    @metrics.timed("db.get_unnamed_faces")
     def get_unnamed_faces(self):
         cur = self.conn.execute(
-            "SELECT id, face_id, name FROM images WHERE name IS NULL OR name = ''"
+            "SELECT face_id, name FROM images WHERE name IS NULL OR name = '' ORDER BY id"
         )
         rows = cur.fetchall()
-        unnamed_faces = [{"face_id": row[1], "name": row[2]} for row in rows]
-        logger.info(f"Retrieved {len(unnamed_faces)} unnamed faces")
+        unnamed_faces = [{"face_id": row[0], "name": row[1]} for row in rows]
+        logger.debug("Retrieved %s unnamed faces", len(unnamed_faces))
         return unnamed_faces
     
-    def get_image_by_face_id(self, face_id) -> Optional[Image.Image]:
+    @metrics.timed("db.get_unnamed_face_ids")
+    def get_unnamed_face_ids(self) -> set:
+        """The face_ids without a name, answered from the name index."""
+        cur = self.conn.execute("SELECT face_id FROM images WHERE name IS NULL OR name = ''")
+        return {row[0] for row in cur.fetchall()}
+
+    def last_row_id(self) -> int:
+        """Row id of the newest face; faces stored later get higher ones."""
+        return self.conn.execute("SELECT max(id) FROM images").fetchone()[0] or 0
+
+    @metrics.timed("db.has_unnamed_after")
+    def has_unnamed_after(self, row_id: int) -> bool:
+        """Whether any face stored after row ``row_id`` is unnamed."""
+        # A rowid range scan reads only the newer rows, not every unnamed one
+        cur = self.conn.execute(
+            "SELECT 1 FROM images NOT INDEXED WHERE id > ? AND (name IS NULL OR name = '') LIMIT 1",
+            (row_id,)
+        )
+        return cur.fetchone() is not None
+
+    @metrics.timed("db.get_image_bytes")
+    def get_image_bytes(self, face_id, kind: Optional[str] = None) -> Optional[Tuple[bytes, str]]:
+        """Return a stored image of the face as its encoded (bytes, format).
+
+        ``kind`` picks one of IMAGE_KINDS; by default the first stored one
+        in that order is returned, falling back to a legacy full-frame PNG.
+        """
         face_id = str(face_id)
+        # Pick the kind from the primary key index, then read just that image
         cur = self.conn.execute(
-            "SELECT data FROM images WHERE face_id=?",
+            "SELECT kind FROM face_images WHERE face_id=?",
             (face_id,)
         )
-        row = cur.fetchone()
+        stored = {row[0] for row in cur.fetchall()}
+        for candidate in ([kind] if kind else IMAGE_KINDS):
+            if candidate in stored:
+                cur = self.conn.execute(
+                    "SELECT data, format FROM face_images WHERE face_id=? AND kind=?",
+                    (face_id, candidate)
+                )
+                row = cur.fetchone()
+                if row:
+                    logger.debug("Image (%s) retrieved for face_id: %s", candidate, face_id)
+                    return row
 
-        if not row:
-            logger.info(f"No image found for face_id: {face_id}")
-            return None
+        if kind in (None, "full"):
+            cur = self.conn.execute(
+                "SELECT data FROM images WHERE face_id=? AND length(data) > 0",
+                (face_id,)
+            )
+            row = cur.fetchone()
+            if row:
+                logger.debug("Legacy image retrieved for face_id: %s", face_id)
+                return row[0], "PNG"
 
-        img_bytes = row[0]
-        image = Image.open(BytesIO(img_bytes))
-        logger.info(f"Image retrieved for face_id: {face_id}")
-        return image
-    
-    def update_name(self, face_id, name: str):
+        logger.debug("No image found for face_id: %s", face_id)
+        return None
+
+    @metrics.timed("db.get_image_etag")
+    def get_image_etag(self, face_id, kind: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """Return the content hash and format of the image get_image_bytes would return.
+
+        Answered from an index without reading the image, except for images
+        stored before hashes were recorded.
+        """
         face_id = str(face_id)
-        with self.conn:
-            self.conn.execute(
-                "UPDATE images SET name=? WHERE face_id=?",
-                (name, face_id)
+        cur = self.conn.execute(
+            "SELECT kind, format, etag FROM face_images INDEXED BY idx_face_images_etag WHERE face_id=?",
+            (face_id,)
+        )
+        stored = {row[0]: row[1:] for row in cur.fetchall()}
+        for candidate in ([kind] if kind else IMAGE_KINDS):
+            if candidate in stored:
+                fmt, etag = stored[candidate]
+                if etag is None:
+                    cur = self.conn.execute(
+                        "SELECT data FROM face_images WHERE face_id=? AND kind=?",
+                        (face_id, candidate)
+                    )
+                    row = cur.fetchone()
+                    if row is None:
+                        return None
+                    etag = content_hash(row[0])
+                return etag, fmt
+
+        if kind in (None, "full"):
+            cur = self.conn.execute(
+                "SELECT data FROM images WHERE face_id=? AND length(data) > 0",
+                (face_id,)
             )
-        logger.info(f"Updated name for face_id: {face_id} to {name}")
+            row = cur.fetchone()
+            if row:
+                return content_hash(row[0]), "PNG"
+        return None
+
+    def get_image_by_face_id(self, face_id, kind: Optional[str] = None) -> Optional[Image.Image]:
+        """Return a stored image of the face as a PIL Image (see get_image_bytes)."""
+        stored = self.get_image_bytes(face_id, kind)
+        if stored is None:
+            return None
+        return Image.open(BytesIO(stored[0]))
+
+    @metrics.timed("db.get_thumbnail_bytes")
+    def get_thumbnail_bytes(self, face_ids) -> Dict[str, Tuple[bytes, str]]:
+        """Map face_ids to their smallest stored image as (bytes, format).
+
+        Prefers the thumbnail, then the aligned crop, then the full frame.
+        Face_ids with no stored image are left out.
+        """
+        face_ids = list(dict.fromkeys(str(face_id) for face_id in face_ids))
+        found = {}
+        for kind in ("thumb", "crop", "full"):
+            missing = [face_id for face_id in face_ids if face_id not in found]
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                cur = self.conn.execute(
+                    f"SELECT face_id, data, format FROM face_images "
+                    f"WHERE kind=? AND face_id IN ({','.join('?' * len(chunk))})",
+                    [kind] + chunk
+                )
+                found.update((face_id, (data, fmt)) for face_id, data, fmt in cur.fetchall())
+
+        missing = [face_id for face_id in face_ids if face_id not in found]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            cur = self.conn.execute(
+                f"SELECT face_id, data FROM images "
+                f"WHERE length(data) > 0 AND face_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            found.update((face_id, (data, "PNG")) for face_id, data in cur.fetchall())
+        logger.debug("Retrieved %s of %s thumbnails", len(found), len(face_ids))
+        return found
+
+    @metrics.timed("db.update_name")
+    def update_name(self, face_id, name: str) -> bool:
+        face_id = str(face_id)
+        updated = self._write(lambda conn: conn.execute(
+            "UPDATE images SET name=? WHERE face_id=?",
+            (name, face_id)
+        ).rowcount)
+        logger.info("Updated name for face_id: %s to %s", face_id, name)
+        return updated > 0
+
+    @metrics.timed("db.update_names")
+    def update_names(self, face_ids, name: str, only_unnamed: bool = False) -> list:
+        """Give several faces the same name in one transaction; returns the face_ids updated.
+
+        With ``only_unnamed``, faces that already have a name keep it.
+        """
+        face_ids = list(dict.fromkeys(str(face_id) for face_id in face_ids))
+        if not face_ids:
+            return []
+        condition = " AND (name IS NULL OR name = '')" if only_unnamed else ""
+
+        def write(conn):
+            updated = []
+            for face_id in face_ids:
+                if conn.execute(f"UPDATE images SET name=? WHERE face_id=?{condition}", (name, face_id)).rowcount:
+                    updated.append(face_id)
+            return updated
+
+        updated = self._write(write)
+        logger.info("Updated name for %s face_id(s) to %s", len(updated), name)
+        return updated
+
+    @metrics.timed("db.delete_faces")
+    def delete_faces(self, face_ids) -> int:
+        """Delete the rows of several face_ids in one transaction; returns rows deleted."""
+        rows = [(str(face_id),) for face_id in face_ids]
+        if not rows:
+            return 0
+        def write(conn):
+            conn.executemany("DELETE FROM face_images WHERE face_id=?", rows)
+            return conn.executemany("DELETE FROM images WHERE face_id=?", rows).rowcount
+
+        deleted = self._write(write)
+        logger.info("Deleted %s image row(s) for face_id(s): %s", deleted, [row[0] for row in rows])
+        return deleted
+
+    @metrics.timed("db.merge_faces")
+    def merge_faces(self, source_id, target_id):
+        """Fold the source face's row into the target's.
+
+        The target keeps its own images and takes the source's name if it has
+        none. If the target has no row, the source's row and images move to it.
+        """
+        source_id, target_id = str(source_id), str(target_id)
+
+        def write(conn):
+            conn.execute("""
+                UPDATE face_images SET face_id=?
+                WHERE face_id=? AND NOT EXISTS (SELECT 1 FROM images WHERE face_id=?)
+            """, (target_id, source_id, target_id))
+            conn.execute("""
+                UPDATE images SET face_id=?
+                WHERE face_id=? AND NOT EXISTS (SELECT 1 FROM images WHERE face_id=?)
+            """, (target_id, source_id, target_id))
+            conn.execute("DELETE FROM face_images WHERE face_id=?", (source_id,))
+            conn.execute("""
+                UPDATE images SET name=(SELECT name FROM images WHERE face_id=?)
+                WHERE face_id=? AND (name IS NULL OR name = '')
+            """, (source_id, target_id))
+            conn.execute("DELETE FROM images WHERE face_id=?", (source_id,))
+
+        self._write(write)
+        logger.info("Merged face_id: %s into face_id: %s", source_id, target_id)
 
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        self._writes.put(None)
+        self._writer.join()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
\ No newline at end of file
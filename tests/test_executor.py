@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from core.executor import InferenceExecutor
+from face_engine.engine import FaceDetections
+from face_engine.scheduler import BatchScheduler
+
+
+class BlockingEngine:
+    """Records the images it detects; the first batch waits for ``release``."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.detected = []
+
+    def detect_batch(self, images, max_num=0):
+        self.started.set()
+        self.release.wait(5)
+        self.detected.extend(images)
+        return [
+            FaceDetections(image, np.zeros((0, 4), np.float32), None, np.zeros(0, np.float32))
+            for image in images
+        ]
+
+    def embed_batch(self, detections):
+        return detections
+
+
+def test_timed_out_request_never_reaches_detection():
+    engine = BlockingEngine()
+    scheduler = BatchScheduler(engine, max_batch_size=1, max_wait_ms=0)
+    executor = InferenceExecutor(max_workers=2, max_pending=4)
+    busy = np.zeros((8, 8, 3), dtype=np.uint8)
+    abandoned = np.ones((8, 8, 3), dtype=np.uint8)
+    try:
+        # Occupy the scheduler so the next image stays queued
+        first = scheduler.submit(busy)
+        assert engine.started.wait(5)
+
+        def identify():
+            return scheduler.submit(abandoned).result()
+
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(executor.run(identify, timeout=0.1))
+
+        engine.release.set()
+        first.result(5)
+        # Give the scheduler time to pick up (and skip) the cancelled image
+        time.sleep(0.3)
+        assert len(engine.detected) == 1
+        assert engine.detected[0] is not abandoned and not engine.detected[0].any()
+    finally:
+        engine.release.set()
+        scheduler.close()
+        executor.shutdown()
+
+
+def test_close_fails_queued_requests():
+    engine = BlockingEngine()
+    scheduler = BatchScheduler(engine, max_batch_size=1, max_wait_ms=0)
+    try:
+        first = scheduler.submit(np.zeros((8, 8, 3), dtype=np.uint8))
+        assert engine.started.wait(5)
+        queued = scheduler.submit(np.ones((8, 8, 3), dtype=np.uint8))
+
+        closing = threading.Thread(target=scheduler.close)
+        closing.start()
+        # Release the running batch only once the worker will stop after it
+        assert scheduler._closed.wait(5)
+        engine.release.set()
+        closing.join(5)
+
+        first.result(5)
+        with pytest.raises(RuntimeError, match="closed"):
+            queued.result(1)
+    finally:
+        engine.release.set()
+        scheduler.close()
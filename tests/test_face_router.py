@@ -0,0 +1,79 @@
+import io
+import zipfile
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from api import face_router
+from core.executor import InferenceExecutor
+
+
+class StubOrchestrator:
+    """Answers each batch image with its decoded size."""
+
+    batch_size = 8
+
+    def __init__(self):
+        self.executor = InferenceExecutor(max_workers=1, max_pending=4)
+
+    def open_image(self, data):
+        return Image.open(io.BytesIO(data))
+
+    def identify_batch(self, images):
+        return [{"error": str(image)} if isinstance(image, Exception) else {"size": list(image.size)}
+                for image in images]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    orchestrator = StubOrchestrator()
+    monkeypatch.setattr(face_router, "orchestrator", orchestrator)
+    app = FastAPI()
+    app.include_router(face_router.router, prefix="/face")
+    yield TestClient(app)
+    orchestrator.executor.shutdown()
+
+
+def png(size=(8, 8)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def archive(members) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_batch_expands_archives(client):
+    files = [
+        ("files", ("a.png", png((8, 8)), "image/png")),
+        ("files", ("b.zip", archive([("c.png", png((4, 6))), ("bad.png", b"nope")]), "application/zip")),
+    ]
+    r = client.post("/face/identify_batch", files=files)
+
+    assert r.status_code == 200
+    responses = {item["filename"]: item["response"] for item in r.json()["responses"]}
+    assert responses["a.png"] == {"size": [8, 8]} and responses["c.png"] == {"size": [4, 6]}
+    assert "error" in responses["bad.png"]
+
+
+@pytest.mark.parametrize("members", [
+    [(f"{i}.png", b"x") for i in range(face_router.MAX_BATCH_IMAGES + 1)],
+    [("bomb.png", b"\0" * (1024 * 1024 + 1))],
+])
+def test_oversized_archive_is_rejected_before_decompression(client, monkeypatch, members):
+    monkeypatch.setattr(face_router, "MAX_BATCH_BYTES", 1024 * 1024)
+    data = archive(members)
+    read = []
+    monkeypatch.setattr(zipfile.ZipFile, "read", lambda self, name, pwd=None: read.append(name))
+
+    r = client.post("/face/identify_batch", files=[("files", ("batch.zip", data, "application/zip"))])
+
+    assert r.status_code == 413
+    assert read == []
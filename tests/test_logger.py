@@ -0,0 +1,26 @@
+import logging
+import threading
+
+from utils import logger
+
+
+def test_reconfiguring_replaces_the_listener(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    logger.configure_logging(extra_loggers=("test-extra",))
+    old_listener, old_handler = logger._listener, logger._queue_handler
+    threads = threading.active_count()
+
+    try:
+        logger.configure_logging()
+
+        assert threading.active_count() == threads
+        old_file = next(h for h in old_listener.handlers if isinstance(h, logging.FileHandler))
+        assert old_file.stream is None
+        assert old_handler not in logging.getLogger("test-extra").handlers
+
+        logger.get_logger("test").warning("written once")
+        logger._stop()
+        (log_file,) = (tmp_path / "logs").iterdir()
+        assert log_file.read_text().count("written once") == 1
+    finally:
+        logger.configure_logging()
@@ -0,0 +1,105 @@
+import threading
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import stream_router
+from core.executor import InferenceExecutor
+from core.video import VideoPipeline
+from face_engine.engine import FaceDetections
+
+
+class StubEngine:
+    """One face at a fixed box; counts the faces embedded."""
+
+    def __init__(self, bbox=(100.0, 100.0, 300.0, 320.0)):
+        self.bbox = bbox
+        self.embedded = 0
+
+    def detect(self, frame, max_num=0):
+        x1, y1, x2, y2 = self.bbox
+        kps = np.array([[[x1 + 0.3 * (x2 - x1), y1 + 0.4 * (y2 - y1)]] * 5], dtype=np.float32)
+        return FaceDetections(None, np.array([self.bbox], dtype=np.float32), kps, np.array([0.9], dtype=np.float32))
+
+    def embed(self, detections):
+        self.embedded += len(detections)
+        detections.embeddings = np.ones((len(detections), 512), dtype=np.float32)
+        return detections
+
+
+class StubOrchestrator:
+    def __init__(self):
+        self.fr_engine = StubEngine()
+
+    def open_image(self, data):
+        return data
+
+    def resolve_detections(self, detections, register_unknown=True):
+        # Nobody in the gallery
+        return [(None, None, False, None)] * len(detections)
+
+    def quality_filter(self, detections):
+        return list(range(len(detections)))
+
+
+FRAME = np.zeros((480, 640, 3), dtype=np.uint8)
+
+
+def test_static_unknown_face_is_embedded_once(monkeypatch):
+    orchestrator = StubOrchestrator()
+    monkeypatch.setattr(stream_router, "orchestrator", orchestrator)
+    pipeline = VideoPipeline(orchestrator, detect_every=1)
+    lock = threading.Lock()
+
+    for frame_index in range(30):
+        faces = stream_router._identify_frame(pipeline, lock, FRAME, frame_index)
+        assert [face["face_id"] for face in faces] == [None]
+
+    assert orchestrator.fr_engine.embedded == 1
+
+
+def test_unknown_face_is_reported_once():
+    orchestrator = StubOrchestrator()
+    pipeline = VideoPipeline(orchestrator, detect_every=1)
+
+    events = [event for frame_index in range(30) for event in pipeline.process_frame(FRAME, frame_index)]
+
+    assert [(event.type, event.face_id) for event in events] == [("identified", None)]
+
+
+def test_unknown_face_is_embedded_again_when_it_gets_bigger():
+    orchestrator = StubOrchestrator()
+    pipeline = VideoPipeline(orchestrator, detect_every=1)
+    pipeline.process_frame(FRAME, 0)
+
+    # Same track (IoU above the threshold), clearly larger area
+    orchestrator.fr_engine.bbox = (90.0, 90.0, 320.0, 345.0)
+    pipeline.process_frame(FRAME, 1)
+
+    assert orchestrator.fr_engine.embedded == 2
+
+
+def test_websocket_tracks_a_face_across_frames(monkeypatch):
+    orchestrator = StubOrchestrator()
+    orchestrator.ready = True
+    orchestrator.executor = InferenceExecutor(max_workers=1, max_pending=4)
+    orchestrator.open_image = lambda data: FRAME
+    monkeypatch.setattr(stream_router, "orchestrator", orchestrator)
+    app = FastAPI()
+    app.include_router(stream_router.router, prefix="/stream")
+
+    try:
+        with TestClient(app).websocket_connect("/stream/identify") as websocket:
+            websocket.send_text("not a frame")
+            assert "error" in websocket.receive_json()
+            replies = []
+            for _ in range(3):
+                websocket.send_bytes(b"frame")
+                replies.append(websocket.receive_json())
+    finally:
+        orchestrator.executor.shutdown()
+
+    assert [reply["frame"] for reply in replies] == [0, 1, 2]
+    assert len({reply["faces"][0]["track_id"] for reply in replies}) == 1
+    assert orchestrator.fr_engine.embedded == 1
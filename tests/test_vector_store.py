@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from vector_db.store import VectorStore
+
+DIM = 512
+THRESHOLD = 0.3
+
+
+def open_store(directory: str) -> VectorStore:
+    return VectorStore(
+        dim=DIM,
+        index_path=os.path.join(directory, "faiss.index"),
+        embeddings_path=os.path.join(directory, "embeddings.pkl"),
+        gallery_path=os.path.join(directory, "gallery.f32"),
+        compact_ratio=0.2,
+        # No background passes: the test compacts and checkpoints itself
+        fsync_interval=60.0,
+    )
+
+
+def embeddings(count: int) -> np.ndarray:
+    x = np.random.default_rng(0).standard_normal((count, DIM)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def test_checkpoint_after_delete_and_rebuild_is_adopted(tmp_path):
+    faces = embeddings(10)
+    store = open_store(str(tmp_path))
+    store.add_embeddings(faces)
+    store.delete([3])
+    store.rebuild()
+    store.save()
+    assert store.index.ntotal == 9
+    store.close()
+
+    store = open_store(str(tmp_path))
+    try:
+        # Adopted rather than replayed from the gallery
+        assert store._checkpointed_rows == 10
+        assert store.index.ntotal == 9 and len(store) == 9
+        results = store.search_batch(faces, top_k=1, threshold=THRESHOLD)
+        assert [r[0][0] if r else None for r in results] == [0, 1, 2, None, 4, 5, 6, 7, 8, 9]
+        face_ids, _ = store.face_embeddings(range(10))
+        assert 3 not in face_ids.tolist()
+
+        # A later delete is still a tombstone in the index
+        store.delete([5])
+        assert len(store) == 8
+
+        store.compact()
+        assert len(store.gallery) == 8 and len(store) == 8
+    finally:
+        store.close()
+
+    store = open_store(str(tmp_path))
+    try:
+        results = store.search_batch(faces, top_k=1, threshold=THRESHOLD)
+        assert [r[0][0] if r else None for r in results] == [0, 1, 2, None, 4, None, 6, 7, 8, 9]
+    finally:
+        store.close()
@@ -0,0 +1,200 @@
+"""Concurrent identify-or-register against one VectorStore gallery.
+
+Writer threads, in one or more processes sharing the gallery files, present
+noisy views of the same synthetic identities in different orders through
+``match_or_add`` while reader threads search and the index is checkpointed
+and re-read continuously. Every identity must end up with exactly one face
+id, no face id may mix identities, and a store reopened from the files must
+agree.
+"""
+import multiprocessing
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from vector_db.store import VectorStore
+
+DIM = 512
+THRESHOLD = 0.3
+IDENTITIES = 30
+VIEWS = 3
+WRITERS = 4
+READERS = 2
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def make_identities(count: int, seed: int = 0) -> np.ndarray:
+    return _unit(np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32))
+
+
+def view(identity: np.ndarray, rng, cos: float = 0.8) -> np.ndarray:
+    """A noisy view at cosine ``cos`` to ``identity``; two views are ~cos**2 apart."""
+    noise = rng.standard_normal(DIM).astype(np.float32)
+    noise = _unit(noise - noise.dot(identity) * identity)
+    return cos * identity + np.sqrt(1.0 - cos ** 2) * noise
+
+
+def open_store(directory: str) -> VectorStore:
+    return VectorStore(
+        dim=DIM,
+        index_path=os.path.join(directory, "faiss.index"),
+        embeddings_path=os.path.join(directory, "embeddings.pkl"),
+        gallery_path=os.path.join(directory, "gallery.f32"),
+        checkpoint_interval=0.2,
+        checkpoint_rows=20,
+    )
+
+
+def run_worker(directory: str, identities: np.ndarray, worker: int = 0) -> list:
+    """Run writer, reader and checkpoint threads; returns (identity, face_id) pairs."""
+    store = open_store(directory)
+    pairs, errors = [], []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def writer(thread: int):
+        rng = np.random.default_rng(worker * 100 + thread)
+        work = np.repeat(np.arange(len(identities)), VIEWS)
+        rng.shuffle(work)
+        try:
+            for i in work:
+                (face_id, _, _), = store.match_or_add(view(identities[i], rng)[None], threshold=THRESHOLD)
+                with lock:
+                    pairs.append((int(i), face_id))
+        except Exception as e:
+            errors.append(f"writer {worker}.{thread}: {e!r}")
+
+    def reader(thread: int):
+        rng = np.random.default_rng(10 ** 6 + worker * 100 + thread)
+        while not done.is_set():
+            try:
+                store.search_batch(view(identities[rng.integers(len(identities))], rng)[None], 1, THRESHOLD)
+            except Exception as e:
+                errors.append(f"reader {worker}.{thread}: {e!r}")
+                return
+
+    def checkpointer():
+        # Races the background checkpoint and re-reads whatever is on disk
+        while not done.is_set():
+            try:
+                store.save()
+                if os.path.exists(store.index_path):
+                    faiss.read_index(store.index_path)
+            except Exception as e:
+                errors.append(f"checkpoint {worker}: {e!r}")
+                return
+            done.wait(0.01)
+
+    writers = [threading.Thread(target=writer, args=(t,)) for t in range(WRITERS)]
+    others = [threading.Thread(target=reader, args=(t,)) for t in range(READERS)]
+    others.append(threading.Thread(target=checkpointer))
+    for t in writers + others:
+        t.start()
+    for t in writers:
+        t.join()
+    done.set()
+    for t in others:
+        t.join()
+    store.close()
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return pairs
+
+
+def _process_main(directory, identities, worker, queue):
+    try:
+        queue.put(("ok", run_worker(directory, identities, worker)))
+    except Exception as e:
+        queue.put(("error", repr(e)))
+
+
+def check(directory: str, identities: np.ndarray, pairs: list):
+    faces_of, identities_of = {}, {}
+    for identity, face_id in pairs:
+        faces_of.setdefault(identity, set()).add(face_id)
+        identities_of.setdefault(face_id, set()).add(identity)
+    assert len(faces_of) == len(identities)
+    assert {i: f for i, f in faces_of.items() if len(f) > 1} == {}
+    assert {f: i for f, i in identities_of.items() if len(i) > 1} == {}
+
+    # Reopen from the checkpoint and gallery files as a restarted worker would
+    faiss.read_index(os.path.join(directory, "faiss.index"))
+    store = open_store(directory)
+    try:
+        ids = np.array(store.gallery.read_ids(0, len(store.gallery)))
+        assert len(np.unique(ids)) == len(ids) == len(identities_of) == store.index.ntotal
+        results = store.search_batch(identities, top_k=1, threshold=THRESHOLD)
+        assert [r[0][0] if r else None for r in results] == [next(iter(faces_of[i])) for i in range(len(identities))]
+    finally:
+        store.close()
+
+
+def test_threads_register_each_identity_once(tmp_path):
+    identities = make_identities(IDENTITIES)
+    pairs = run_worker(str(tmp_path), identities)
+    assert len(pairs) == IDENTITIES * VIEWS * WRITERS
+    check(str(tmp_path), identities, pairs)
+
+
+def test_processes_sharing_a_gallery_register_each_identity_once(tmp_path):
+    identities = make_identities(IDENTITIES)
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_process_main, args=(str(tmp_path), identities, w, queue)) for w in range(2)]
+    for p in procs:
+        p.start()
+    pairs = []
+    try:
+        for _ in procs:
+            status, result = queue.get(timeout=120)
+            assert status == "ok", result
+            pairs.extend(result)
+    finally:
+        for p in procs:
+            p.join(10)
+            if p.is_alive():
+                p.terminate()
+    check(str(tmp_path), identities, pairs)
+
+
+def test_searches_run_while_an_unknown_face_is_checked_again(tmp_path):
+    identities = make_identities(2)
+    store = open_store(str(tmp_path))
+    store.match_or_add(identities[:1], threshold=THRESHOLD)
+    search_faces = store._search_faces
+    rechecking, release = threading.Event(), threading.Event()
+
+    def blocking_search(queries, top_k, threshold):
+        if threading.current_thread().name == "register":
+            rechecking.set()
+            release.wait(5)
+        return search_faces(queries, top_k, threshold)
+
+    store._search_faces = blocking_search
+    # The first search of the unknown face misses before blocking on the re-check
+    store.search_batch = lambda *args, **kwargs: [[]]
+    register = threading.Thread(
+        target=store.match_or_add, args=(identities[1:],), kwargs={"threshold": THRESHOLD}, name="register"
+    )
+    register.start()
+    try:
+        assert rechecking.wait(5)
+        found = []
+
+        def search():
+            found.append(VectorStore.search_batch(store, identities[:1], 1, THRESHOLD))
+
+        searcher = threading.Thread(target=search)
+        searcher.start()
+        searcher.join(2)
+        assert found and found[0][0][0][0] == 0
+    finally:
+        release.set()
+        register.join()
+        store.close()
+    assert len(store) == 2
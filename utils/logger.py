@@ -1,42 +1,218 @@
+"""Application logging, kept off the request path.
+
+Loggers only create the record and put it on a bounded in-memory queue; a
+listener thread formats it and writes the console and file handlers. If
+the queue is full the record is dropped and counted instead of blocking
+the caller. Call sites pass %-style arguments, so nothing is formatted
+for records below the logger's level.
+
+Configuration is read from the environment, so uvicorn worker processes
+inherit what ``main.py`` was started with:
+
+    FR_LOG_LEVEL   level of the application loggers (default INFO)
+    FR_LOG_LEVELS  per-module levels, e.g. "vector_db.store=DEBUG,storage.db=WARNING"
+    FR_LOG_JSON    "1" writes one JSON object per line
+    FR_LOG_RATE    INFO and DEBUG records per second let through from any one
+                   call site (default 20, 0 for no limit); warnings and
+                   errors are never limited
+"""
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 from datetime import datetime
+from typing import Dict, Optional
 
-_LOGGER = None
+ROOT_LOGGER = "FacialRecognitionEngine"
+QUEUE_SIZE = 10000
+FORMAT = "%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s"
 
+_lock = threading.RLock()
+_configured = False
+_listener = None
+_queue_handler = None
+_module_loggers = []
+# Loggers that send records to _queue_handler
+_routed_loggers = []
 
-def get_logger():
-    global _LOGGER
-    if _LOGGER:
-        return _LOGGER
 
-    logger = logging.getLogger("FacialRecognitionEngine")
-    logger.setLevel(logging.INFO)
-    logger.propagate = False
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records unformatted; drop them when the queue is full."""
 
-    if not logger.handlers:
-        os.makedirs("logs", exist_ok=True)
+    dropped = 0
+
+    def prepare(self, record):
+        # The queue never leaves the process, so the record need not be made
+        # picklable and formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site for INFO and DEBUG records.
+
+    The first record let through after others from the same line were
+    dropped carries their count as ``record.suppressed``.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        # (pathname, lineno) -> [tokens, last refill time, suppressed]
+        self._buckets: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, record.created, 0]
+            bucket[0] = min(self.burst, bucket[0] + (record.created - bucket[1]) * self.rate)
+            bucket[1] = record.created
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" [{suppressed} similar suppressed]"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "location": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
 
-        today = datetime.now().strftime("%Y-%m-%d")
-        log_file = f"logs/facial_recognition_{today}.log"
 
-        formatter = logging.Formatter(
-            "%(asctime)s - %(levelname)s - "
-            "%(filename)s:%(lineno)d - %(message)s"
-        )
+def _parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            module, level = item.split("=", 1)
+            levels[module.strip()] = level.strip().upper()
+    return levels
 
-        # Console handler
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.INFO)
-        ch.setFormatter(formatter)
 
+def configure_logging(
+    level: Optional[str] = None,
+    module_levels: Optional[Dict[str, str]] = None,
+    json_output: Optional[bool] = None,
+    rate: Optional[float] = None,
+    extra_loggers: tuple = ()
+):
+    """(Re)configure the queue, its listener and the logger levels.
+
+    Unset arguments fall back to the FR_LOG_* environment variables.
+    ``extra_loggers`` (e.g. "uvicorn") are routed through the same queue.
+    """
+    global _configured, _listener, _queue_handler
+    level = (level or os.environ.get("FR_LOG_LEVEL") or "INFO").upper()
+    if module_levels is None:
+        module_levels = _parse_levels(os.environ.get("FR_LOG_LEVELS", ""))
+    if json_output is None:
+        json_output = os.environ.get("FR_LOG_JSON", "") not in ("", "0")
+    if rate is None:
+        rate = float(os.environ.get("FR_LOG_RATE", 20))
+
+    with _lock:
+        _teardown()
+
+        os.makedirs("logs", exist_ok=True)
+        today = datetime.now().strftime("%Y-%m-%d")
+        formatter = JsonFormatter() if json_output else TextFormatter(FORMAT)
+        console = logging.StreamHandler()
+        console.setFormatter(formatter)
         # File handler (date in filename)
-        fh = logging.FileHandler(log_file, encoding="utf-8")
-        fh.setLevel(logging.INFO)
-        fh.setFormatter(formatter)
+        log_file = logging.FileHandler(f"logs/facial_recognition_{today}.log", encoding="utf-8")
+        log_file.setFormatter(formatter)
+
+        log_queue = queue.Queue(QUEUE_SIZE)
+        _queue_handler = _QueueHandler(log_queue)
+        _queue_handler.addFilter(RateLimitFilter(rate))
+        _listener = logging.handlers.QueueListener(log_queue, console, log_file)
+        _listener.start()
+
+        for name in (ROOT_LOGGER,) + tuple(extra_loggers):
+            routed = logging.getLogger(name)
+            routed.setLevel(level)
+            routed.propagate = False
+            routed.handlers = [_queue_handler]
+            _routed_loggers.append(routed)
+
+        for logger in _module_loggers:
+            logger.setLevel(logging.NOTSET)
+        _module_loggers.clear()
+        for module, module_level in module_levels.items():
+            logger = logging.getLogger(f"{ROOT_LOGGER}.{module}")
+            logger.setLevel(module_level)
+            _module_loggers.append(logger)
+
+        if not _configured:
+            atexit.register(_stop)
+        _configured = True
+
+
+def _teardown():
+    """Stop the current listener, close its handlers and unhook its queue."""
+    global _listener
+    if _listener is not None:
+        # Drains the queue, so records logged before this are written
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    for routed in _routed_loggers:
+        if _queue_handler in routed.handlers:
+            routed.removeHandler(_queue_handler)
+    _routed_loggers.clear()
+
+
+def _stop():
+    with _lock:
+        _teardown()
+
+
+def dropped_records() -> int:
+    """Records dropped because the queue was full."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
 
-        logger.addHandler(ch)
-        logger.addHandler(fh)
 
-    _LOGGER = logger
-    return logger
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    """The application logger, or its child for module ``name`` (pass ``__name__``)."""
+    with _lock:
+        if not _configured:
+            configure_logging()
+    return logging.getLogger(ROOT_LOGGER if not name else f"{ROOT_LOGGER}.{name}")
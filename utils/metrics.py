@@ -0,0 +1,235 @@
+"""In-process metrics rendered in the Prometheus text format.
+
+``stage(name)`` times a block into the ``fr_stage_seconds`` histogram and,
+when a request is collecting timings (see ``collect_timings``), adds the
+duration to that request's per-stage totals for the Server-Timing header.
+Timings follow the request into executor threads through contextvars; the
+batch scheduler attributes batched work to every request in the batch.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-stage totals (seconds) of the requests the current code runs for
+_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=())
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in values]
+
+
+class Gauge(_Metric):
+    """A gauge read from ``fn`` at scrape time; ``fn`` returns a number or a {labels: value} dict."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning("Gauge %s failed: %s", self.name, e)
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in value.items()]
+        return [f"{self.name} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = [(k, list(counts), total) for k, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add ``metric``; a metric of the same name is replaced (gauges re-bound on restart)."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "fr_stage_seconds", "Time spent in each pipeline stage", ["stage"]
+))
+
+
+def counter(name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, fn: Callable, labelnames: Iterable[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, fn, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Iterable[str] = (), buckets: Tuple = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as stage ``name``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        for timings in _timings.get():
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed(name: str):
+    """Decorator form of ``stage``."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect_timings(timings: Optional[dict] = None):
+    """Accumulate per-stage seconds of the enclosed work (and threads it hands
+    its context to) into ``timings``, which is yielded."""
+    timings = {} if timings is None else timings
+    token = _timings.set(_timings.get() + (timings,))
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def current_timings() -> tuple:
+    """The timing dicts the current context reports into, for handing work to another thread."""
+    return _timings.get()
+
+
+@contextmanager
+def attribute_to(timings: Iterable[tuple]):
+    """Report stages of the enclosed block to every request in ``timings`` (batched work)."""
+    targets = tuple(t for group in timings for t in group)
+    token = _timings.set(targets)
+    try:
+        yield
+    finally:
+        _timings.reset(token)
+
+
+def server_timing(timings: dict, total: float) -> str:
+    """Server-Timing header value: per-stage and total durations in ms."""
+    parts = [f"{name.replace('.', '-')};dur={seconds * 1000.0:.2f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000.0:.2f}")
+    return ", ".join(parts)
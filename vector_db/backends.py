@@ -0,0 +1,105 @@
+import math
+
+import faiss
+import numpy as np
+
+# Index backends VectorStore can run. Every index is wrapped in IndexIDMap2
+# so searches return face ids whichever structure sits underneath.
+BACKENDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+IVF_PQ_SUBQUANTIZERS = 64
+IVF_PQ_BITS = 8
+# FAISS wants roughly 39+ training points per centroid
+IVF_TRAIN_POINTS_PER_LIST = 50
+IVF_MAX_TRAIN_ROWS = 200000
+
+
+def ivf_nlist(rows: int) -> int:
+    """Number of inverted lists for a gallery of ``rows`` (about 4 * sqrt(n)).
+
+    Capped so the gallery itself always holds enough training points.
+    """
+    return max(1, min(65536, int(4 * math.sqrt(max(rows, 1))), rows // IVF_TRAIN_POINTS_PER_LIST))
+
+
+def make_index(backend: str, dim: int, dtype=np.float32, rows: int = 0):
+    """Create an empty, untrained index for ``backend``.
+
+    ``rows`` is the expected gallery size; IVF backends size their
+    coarse quantizer from it. float16 stores vectors as fp16 where the
+    backend keeps raw vectors (flat, hnsw, ivf_flat).
+    """
+    fp16 = np.dtype(dtype) == np.float16
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if backend == "flat":
+        if fp16:
+            base = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, metric)
+        else:
+            base = faiss.IndexFlatIP(dim)
+    elif backend == "hnsw":
+        if fp16:
+            base = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_fp16, HNSW_M, metric)
+        else:
+            base = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif backend in ("ivf_flat", "ivf_pq"):
+        nlist = ivf_nlist(rows)
+        quantizer = faiss.IndexFlatIP(dim)
+        if backend == "ivf_pq":
+            base = faiss.IndexIVFPQ(quantizer, dim, nlist, IVF_PQ_SUBQUANTIZERS, IVF_PQ_BITS, metric)
+        elif fp16:
+            base = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_fp16, metric)
+        else:
+            base = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        # The quantizer must outlive this function along with the index
+        base.own_fields = True
+        quantizer.this.disown()
+        # IndexIDMap2.reconstruct needs positions -> vectors on IVF indexes
+        base.set_direct_map_type(faiss.DirectMap.Array)
+    else:
+        raise ValueError(f"Unknown index backend {backend!r}; expected one of {BACKENDS}")
+
+    return faiss.IndexIDMap2(base)
+
+
+def backend_of(index) -> str:
+    """Name of the backend an (IndexIDMap2-wrapped) index was built with."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, (faiss.IndexHNSWFlat, faiss.IndexHNSWSQ)):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, (faiss.IndexIVFFlat, faiss.IndexIVFScalarQuantizer)):
+        return "ivf_flat"
+    return "flat"
+
+
+def train_rows_needed(index) -> int:
+    """Minimum number of rows needed to train ``index`` (0 if untrained use is fine)."""
+    base = faiss.downcast_index(index.index)
+    if isinstance(base, faiss.IndexIVF):
+        return base.nlist * IVF_TRAIN_POINTS_PER_LIST
+    return 0
+
+
+def train(index, rows: np.ndarray, seed: int = 1234):
+    """Train ``index`` on a random sample of ``rows`` if it needs training."""
+    if index.is_trained:
+        return
+    sample = rows
+    if len(rows) > IVF_MAX_TRAIN_ROWS:
+        pick = np.random.default_rng(seed).choice(len(rows), IVF_MAX_TRAIN_ROWS, replace=False)
+        sample = rows[np.sort(pick)]
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Apply runtime recall/latency knobs; ignored by backends they do not apply to."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if nprobe is not None and isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(int(nprobe), base.nlist)
+    if ef_search is not None and isinstance(base, (faiss.IndexHNSWFlat, faiss.IndexHNSWSQ)):
+        base.hnsw.efSearch = int(ef_search)
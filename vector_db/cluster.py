@@ -0,0 +1,81 @@
+"""Grouping of embeddings that likely show the same person.
+
+Each embedding is linked to those of its ``k`` nearest neighbours that are
+at least ``threshold`` similar, and clusters are the connected components of
+that graph. Neighbours come from an exact index for small inputs and from
+an IVF index of about sqrt(n) lists above ``exact_max_rows``: each embedding
+is then compared with the rows of its ``nprobe`` nearest lists, about
+nprobe * sqrt(n), rather than with all n. A clustering run builds its index
+from scratch, and IVF builds far faster than HNSW.
+"""
+import math
+import time
+
+import faiss
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SEARCH_BATCH = 4096
+# k-means sample per IVF list
+TRAIN_POINTS_PER_LIST = 50
+
+
+def knn_graph(embeddings: np.ndarray, k: int = 10, threshold: float = 0.3,
+              exact_max_rows: int = 20000, nprobe: int = 8):
+    """Edges ``(rows, cols)`` from each embedding to its near neighbours.
+
+    ``embeddings`` must be L2-normalised float32 rows.
+    """
+    n, dim = embeddings.shape
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    with metrics.stage("cluster.build"):
+        if n <= exact_max_rows:
+            index = faiss.IndexFlatIP(dim)
+        else:
+            nlist = int(math.sqrt(n))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            sample = np.random.default_rng(0).choice(n, min(n, nlist * TRAIN_POINTS_PER_LIST), replace=False)
+            index.train(embeddings[np.sort(sample)])
+            index.nprobe = min(nprobe, nlist)
+        # Search results are row positions
+        index.add(embeddings)
+
+    rows, cols = [], []
+    with metrics.stage("cluster.search"):
+        for start in range(0, n, SEARCH_BATCH):
+            stop = min(n, start + SEARCH_BATCH)
+            # One extra neighbour, as every row finds itself
+            similarities, neighbours = index.search(embeddings[start:stop], k + 1)
+            source = np.arange(start, stop, dtype=np.int64)[:, None]
+            keep = (similarities >= threshold) & (neighbours >= 0) & (neighbours != source)
+            rows.append(np.broadcast_to(source, neighbours.shape)[keep])
+            cols.append(neighbours[keep])
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def cluster_embeddings(embeddings: np.ndarray, k: int = 10, threshold: float = 0.3,
+                       exact_max_rows: int = 20000, nprobe: int = 8) -> np.ndarray:
+    """Cluster label of each embedding; labels run from 0 to the number of clusters - 1."""
+    n = len(embeddings)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    started = time.perf_counter()
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rows, cols = knn_graph(embeddings, k=k, threshold=threshold, exact_max_rows=exact_max_rows, nprobe=nprobe)
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    count, labels = connected_components(graph, directed=True, connection="weak")
+    logger.info(
+        "Clustered %s embeddings into %s clusters over %s edges in %.2fs",
+        n, count, len(rows), time.perf_counter() - started
+    )
+    return labels.astype(np.int64)
@@ -0,0 +1,318 @@
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts run a single worker
+    fcntl = None
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_MAGIC = b"FRGL"
+_VERSION = 2
+_HEADER = struct.Struct("<4sIII")  # magic, version, dim, dtype code
+_DTYPES = {0: np.float32, 1: np.float16}
+_DTYPE_CODES = {np.dtype(dtype): code for code, dtype in _DTYPES.items()}
+_ID_DTYPE = np.dtype(np.int64)
+
+# Journal records amend the rows of a gallery generation without rewriting them
+JOURNAL_DTYPE = np.dtype([("op", np.int64), ("key", np.int64), ("face", np.int64)])
+OP_DELETE = 1     # row ``key`` is a tombstone
+OP_ALIAS = 2      # row ``key`` is an embedding of face ``face``
+OP_HIGHWATER = 3  # ``key`` is the largest key ever issued (kept across compactions)
+
+
+class SharedGallery:
+    """Append-only embedding matrix in files shared by all worker processes.
+
+    Embeddings live in one contiguous matrix file (a fixed header followed
+    by float32 or float16 rows) and their 64-bit keys in a parallel ``.ids``
+    file, so keys do not depend on row position. A row's key is also its
+    face id unless the ``.journal`` file aliases it to another face; the
+    journal also records tombstones. Together they form the append-only
+    embedding log: writers append while holding an exclusive ``flock`` on a
+    sidecar lock file, so keys are assigned consistently across processes.
+    Readers never lock: they memory-map the files and only trust rows
+    present in both, so a partially written trailing row is treated as not
+    yet present.
+
+    :meth:`compact` rewrites the log without tombstoned rows as a new
+    generation of files (``gallery.f32.1``, ``gallery.f32.2``, ...) and
+    switches to it by atomically replacing the ``.gen`` pointer file.
+    Processes keep reading the generation they opened until they
+    :meth:`reopen`; :meth:`replaced` tells them when to.
+    """
+
+    def __init__(self, path: str, dim: int, dtype=np.float32):
+        self.path = path
+        self.gen_path = path + ".gen"
+        self.dim = dim
+        self._requested_dtype = np.dtype(dtype)
+        self._thread_lock = threading.Lock()
+        # Guards the open files against reopen() while they are in use
+        self._io_lock = threading.Lock()
+        self._dirty = False
+        self._files = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock_file = open(path + ".lock", "a+b")
+        with self.lock():
+            self._open()
+            if self._requested_dtype != self.dtype:
+                logger.warning("%s stores %s; ignoring requested dtype %s", self.data_path, self.dtype, self._requested_dtype)
+            self._upgrade_v1()
+            self._truncate_torn_row()
+
+    def _paths(self, generation: int) -> tuple:
+        data_path = self.path if generation == 0 else f"{self.path}.{generation}"
+        return data_path, data_path + ".ids", data_path + ".journal"
+
+    def _pointer_stamp(self):
+        try:
+            st = os.stat(self.gen_path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def current_generation(self) -> int:
+        """Generation the ``.gen`` pointer currently names (0 without one)."""
+        try:
+            with open(self.gen_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def replaced(self) -> bool:
+        """True once another generation has replaced the one this object reads."""
+        return self._pointer_stamp() != self._stamp
+
+    def _open(self):
+        self._stamp = self._pointer_stamp()
+        self.generation = self.current_generation()
+        self.data_path, self.ids_path, self.journal_path = self._paths(self.generation)
+        if self.generation == 0 and (
+            not os.path.exists(self.data_path) or os.path.getsize(self.data_path) < _HEADER.size
+        ):
+            self._write_header(self.data_path, self._requested_dtype)
+        self._read_header()
+        self._files = tuple(
+            os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b", buffering=0)
+            for path in (self.data_path, self.ids_path, self.journal_path)
+        )
+        self._fd, self._ids_fd, self._journal_fd = (f.fileno() for f in self._files)
+
+    def _close_files(self):
+        self._fsync()
+        for f in self._files:
+            f.close()
+
+    def reopen(self):
+        """Switch to the current generation, e.g. after another process compacted."""
+        with self._io_lock:
+            self._close_files()
+            self._open()
+        logger.info("Reopened gallery generation %s (%s rows)", self.generation, len(self))
+
+    def _write_header(self, path: str, dtype):
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self.dim, _DTYPE_CODES[np.dtype(dtype)]))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_header(self):
+        with open(self.data_path, "rb") as f:
+            magic, version, dim, dtype_code = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version not in (1, _VERSION):
+            raise ValueError(f"{self.data_path} is not a gallery file")
+        if dim != self.dim:
+            raise ValueError(f"Gallery dimension {dim} does not match store dimension {self.dim}")
+        self.version = version
+        # Version 1 files were float32 rows whose position was the face id
+        self.dtype = np.dtype(np.float32 if version == 1 else _DTYPES[dtype_code])
+        self.row_bytes = self.dim * self.dtype.itemsize
+
+    def _upgrade_v1(self):
+        """Give a version 1 gallery an ids file holding its positional ids."""
+        if self.version != 1:
+            return
+        rows = self._matrix_rows()
+        os.ftruncate(self._ids_fd, 0)
+        os.pwrite(self._ids_fd, np.arange(rows, dtype=_ID_DTYPE).tobytes(), 0)
+        os.fsync(self._ids_fd)
+        os.pwrite(self._fd, _HEADER.pack(_MAGIC, _VERSION, self.dim, 0), 0)
+        os.fsync(self._fd)
+        self.version = _VERSION
+        logger.info("Upgraded %s to version %s with %s positional ids", self.data_path, _VERSION, rows)
+
+    @contextmanager
+    def lock(self):
+        """Exclusive writer lock across threads and processes."""
+        with self._thread_lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _matrix_rows(self) -> int:
+        return max(0, os.fstat(self._fd).st_size - _HEADER.size) // self.row_bytes
+
+    def _id_rows(self) -> int:
+        return os.fstat(self._ids_fd).st_size // _ID_DTYPE.itemsize
+
+    def __len__(self) -> int:
+        # Ids are written after their vectors, so both must be present
+        return min(self._matrix_rows(), self._id_rows())
+
+    def journal_len(self) -> int:
+        return os.fstat(self._journal_fd).st_size // JOURNAL_DTYPE.itemsize
+
+    def _truncate_torn_row(self) -> int:
+        """Drop rows and journal records left half written by a writer that died mid-append."""
+        rows = len(self)
+        matrix_size = _HEADER.size + rows * self.row_bytes
+        ids_size = rows * _ID_DTYPE.itemsize
+        journal_size = self.journal_len() * JOURNAL_DTYPE.itemsize
+        if (
+            os.fstat(self._fd).st_size != matrix_size
+            or os.fstat(self._ids_fd).st_size != ids_size
+            or os.fstat(self._journal_fd).st_size != journal_size
+        ):
+            logger.warning("Truncating torn trailing rows in %s", self.data_path)
+            os.ftruncate(self._fd, matrix_size)
+            os.ftruncate(self._ids_fd, ids_size)
+            os.ftruncate(self._journal_fd, journal_size)
+        return rows
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        """Return rows ``[start, stop)`` as a read-only memory-mapped array.
+
+        The mapping stays valid after a compaction replaces this generation.
+        """
+        if stop <= start:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        return np.memmap(
+            self._files[0],
+            dtype=self.dtype,
+            mode="r",
+            offset=_HEADER.size + start * self.row_bytes,
+            shape=(stop - start, self.dim),
+        )
+
+    def read_ids(self, start: int, stop: int) -> np.ndarray:
+        """Return the keys of rows ``[start, stop)``."""
+        if stop <= start:
+            return np.empty((0,), dtype=_ID_DTYPE)
+        return np.memmap(
+            self._files[1],
+            dtype=_ID_DTYPE,
+            mode="r",
+            offset=start * _ID_DTYPE.itemsize,
+            shape=(stop - start,),
+        )
+
+    def read_journal(self, start: int, stop: int) -> np.ndarray:
+        """Return journal records ``[start, stop)``."""
+        if stop <= start:
+            return np.empty((0,), dtype=JOURNAL_DTYPE)
+        size = JOURNAL_DTYPE.itemsize
+        data = os.pread(self._journal_fd, (stop - start) * size, start * size)
+        return np.frombuffer(data, dtype=JOURNAL_DTYPE)
+
+    def append(self, embeddings: np.ndarray, ids: np.ndarray) -> int:
+        """Append rows with their keys and return the first row position.
+
+        Costs two ``pwrite`` calls regardless of gallery size. Durability is
+        deferred to :meth:`flush` so bursts of appends share one fsync.
+        The caller must hold :meth:`lock` and choose keys that are unique.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype).reshape(-1, self.dim)
+        ids = np.ascontiguousarray(ids, dtype=_ID_DTYPE).reshape(-1)
+        if len(ids) != len(embeddings):
+            raise ValueError("Need exactly one id per embedding")
+        first = self._truncate_torn_row()
+        os.pwrite(self._fd, embeddings.tobytes(), _HEADER.size + first * self.row_bytes)
+        os.pwrite(self._ids_fd, ids.tobytes(), first * _ID_DTYPE.itemsize)
+        self._dirty = True
+        return first
+
+    def append_journal(self, records: np.ndarray):
+        """Append journal records; the caller must hold :meth:`lock`."""
+        records = np.ascontiguousarray(records, dtype=JOURNAL_DTYPE)
+        os.pwrite(self._journal_fd, records.tobytes(), self.journal_len() * JOURNAL_DTYPE.itemsize)
+        self._dirty = True
+
+    def compact(self, drop, journal: np.ndarray) -> int:
+        """Write the next generation without the rows whose keys are in ``drop``.
+
+        ``journal`` becomes the new generation's journal. The caller must
+        hold :meth:`lock`. This object keeps reading the old generation until
+        :meth:`reopen`; the old files are unlinked, which open handles survive.
+        Returns the number of rows kept.
+        """
+        if self.replaced():
+            raise RuntimeError(f"{self.data_path} was already replaced; reopen before compacting")
+        generation = self.generation + 1
+        data_path, ids_path, journal_path = self._paths(generation)
+        drop = np.fromiter(drop, dtype=_ID_DTYPE)
+        rows = len(self)
+        kept = 0
+
+        self._write_header(data_path, self.dtype)
+        with open(data_path, "ab") as matrix, open(ids_path, "wb") as ids, open(journal_path, "wb") as records:
+            for start in range(0, rows, 65536):
+                stop = min(rows, start + 65536)
+                keys = np.array(self.read_ids(start, stop))
+                keep = ~np.isin(keys, drop)
+                matrix.write(np.ascontiguousarray(self.read_rows(start, stop)[keep]).tobytes())
+                ids.write(keys[keep].tobytes())
+                kept += int(keep.sum())
+            records.write(np.ascontiguousarray(journal, dtype=JOURNAL_DTYPE).tobytes())
+            for f in (matrix, ids, records):
+                f.flush()
+                os.fsync(f.fileno())
+
+        tmp_path = self.gen_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.gen_path)
+        dir_fd = os.open(os.path.dirname(self.gen_path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        for path in self._paths(self.generation):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        logger.info("Compacted %s: kept %s of %s rows as generation %s", self.data_path, kept, rows, generation)
+        return kept
+
+    def _fsync(self):
+        if self._dirty:
+            self._dirty = False
+            os.fsync(self._fd)
+            os.fsync(self._ids_fd)
+            os.fsync(self._journal_fd)
+
+    def flush(self):
+        """fsync appended rows, if any, since the last flush."""
+        with self._io_lock:
+            self._fsync()
+
+    def close(self):
+        with self._io_lock:
+            self._close_files()
+        self._lock_file.close()
@@ -0,0 +1,144 @@
+"""Recall / latency comparison of ANN backends against the exact flat index.
+
+Usage:
+    python -m vector_db.recall_bench --rows 200000 --backends hnsw ivf_flat ivf_pq
+    python -m vector_db.recall_bench --gallery vector_db/gallery.f32 --json results.json
+
+recall@1 counts queries whose exact top-1 similarity clears the match
+threshold (0.3 by default, as in Orchestrator) and checks that the backend
+returns the same face id. Decision agreement additionally counts queries
+with no exact match, which the backend must also reject.
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from vector_db import backends
+from vector_db.gallery import SharedGallery
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def synthetic_gallery(rows: int, dim: int, rng) -> tuple:
+    return _unit(rng.standard_normal((rows, dim)).astype(np.float32)), np.arange(rows, dtype=np.int64)
+
+
+def load_gallery(path: str, dim: int) -> tuple:
+    gallery = SharedGallery(path, dim)
+    rows = len(gallery)
+    embeddings = np.array(gallery.read_rows(0, rows), dtype=np.float32)
+    ids = np.array(gallery.read_ids(0, rows))
+    gallery.close()
+    return embeddings, ids
+
+
+def make_queries(gallery: np.ndarray, count: int, rng, known_fraction: float = 0.7) -> np.ndarray:
+    """Noisy views of gallery faces (cosine 0.35-0.85 to the original) plus unknown faces."""
+    dim = gallery.shape[1]
+    known = int(count * known_fraction)
+    picks = gallery[rng.integers(0, len(gallery), known)]
+    cos = rng.uniform(0.35, 0.85, (known, 1)).astype(np.float32)
+    noise = rng.standard_normal((known, dim)).astype(np.float32)
+    noise = _unit(noise - (noise * picks).sum(axis=1, keepdims=True) * picks)
+    views = cos * picks + np.sqrt(1.0 - cos ** 2) * noise
+    unknown = rng.standard_normal((count - known, dim)).astype(np.float32)
+    return _unit(np.vstack([views, unknown]).astype(np.float32))
+
+
+def build(backend: str, embeddings: np.ndarray, ids: np.ndarray, dtype):
+    started = time.perf_counter()
+    index = backends.make_index(backend, embeddings.shape[1], dtype, len(embeddings))
+    backends.train(index, embeddings)
+    index.add_with_ids(embeddings, ids)
+    return index, time.perf_counter() - started
+
+
+def evaluate(index, queries: np.ndarray, truth_ids: np.ndarray, truth_scores: np.ndarray, threshold: float) -> dict:
+    latencies = []
+    found_ids = np.empty(len(queries), dtype=np.int64)
+    found_scores = np.empty(len(queries), dtype=np.float32)
+    # One query per call, as the identify path does
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        D, I = index.search(query[None, :], 1)
+        latencies.append(time.perf_counter() - started)
+        found_ids[i], found_scores[i] = I[0, 0], D[0, 0]
+
+    matchable = truth_scores >= threshold
+    same_id = found_ids == truth_ids
+    accepted = found_scores >= threshold
+    agree = np.where(matchable, accepted & same_id, ~accepted)
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "recall_at_1": float(same_id[matchable].mean()) if matchable.any() else None,
+        "decision_agreement": float(agree.mean()),
+        "matchable_queries": int(matchable.sum()),
+        "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+        "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+        "qps": float(len(queries) / max(latencies_ms.sum() / 1000.0, 1e-9)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gallery", help="Gallery file to benchmark; synthetic data if omitted")
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic gallery size")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--backends", nargs="+", default=["hnsw", "ivf_flat", "ivf_pq"], choices=backends.BACKENDS)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.gallery:
+        embeddings, ids = load_gallery(args.gallery, args.dim)
+    else:
+        embeddings, ids = synthetic_gallery(args.rows, args.dim, rng)
+    queries = make_queries(embeddings, args.queries, rng)
+    print(f"Gallery: {len(embeddings)} x {embeddings.shape[1]}, queries: {len(queries)}, threshold: {args.threshold}")
+
+    flat, build_s = build("flat", embeddings, ids, args.dtype)
+    D, I = flat.search(queries, 1)
+    truth_ids, truth_scores = I[:, 0], D[:, 0]
+
+    results = [{"backend": "flat", "param": None, "build_s": build_s,
+                **evaluate(flat, queries, truth_ids, truth_scores, args.threshold)}]
+    for backend in args.backends:
+        if backend == "flat":
+            continue
+        index, build_s = build(backend, embeddings, ids, args.dtype)
+        if backend == "hnsw":
+            sweep = [("efSearch", value, {"ef_search": value}) for value in args.ef_search]
+        else:
+            sweep = [("nprobe", value, {"nprobe": value}) for value in args.nprobe]
+        for name, value, knob in sweep:
+            backends.set_search_params(index, **knob)
+            results.append({"backend": backend, "param": f"{name}={value}", "build_s": build_s,
+                            **evaluate(index, queries, truth_ids, truth_scores, args.threshold)})
+
+    print(f"{'backend':<10}{'param':<14}{'recall@1':>9}{'agree':>8}{'p50 ms':>9}{'p95 ms':>9}{'qps':>10}{'build s':>9}")
+    for r in results:
+        recall = "n/a" if r["recall_at_1"] is None else f"{r['recall_at_1']:.4f}"
+        print(
+            f"{r['backend']:<10}{r['param'] or '-':<14}{recall:>9}{r['decision_agreement']:>8.4f}"
+            f"{r['latency_ms_p50']:>9.3f}{r['latency_ms_p95']:>9.3f}{r['qps']:>10.0f}{r['build_s']:>9.1f}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": len(embeddings), "queries": len(queries), "threshold": args.threshold,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    faiss.omp_set_num_threads(1)
+    main()
@@ -1,54 +1,703 @@
+import atexit
 import faiss
 import numpy as np
 import os
 import pickle
+import threading
+import time
+from vector_db import backends
+from vector_db.gallery import SharedGallery, JOURNAL_DTYPE, OP_ALIAS, OP_DELETE, OP_HIGHWATER
+from utils import metrics
 from utils.logger import get_logger
+from utils.rwlock import RWLock
 
-logger = get_logger()
+logger = get_logger(__name__)
 
 class VectorStore:
-    def __init__(self, dim: int, index_path: str = "vector_db/faiss.index", embeddings_path: str = "vector_db/embeddings.pkl"):
+    def __init__(
+        self,
+        dim: int,
+        index_path: str = "vector_db/faiss.index",
+        embeddings_path: str = "vector_db/embeddings.pkl",
+        gallery_path: str = "vector_db/gallery.f32",
+        sync_interval: float = 0.0,
+        fsync_interval: float = 0.05,
+        checkpoint_interval: float = 300.0,
+        checkpoint_rows: int = 10000,
+        dtype: str = "float32",
+        backend: str = "flat",
+        ann_min_rows: int = 50000,
+        rebuild_growth: float = 4.0,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        compact_ratio: float = 0.2
+    ):
         self.dim = dim
         self.index_path = index_path
         self.embeddings_path = embeddings_path
+        # Upper bound on how stale this process's index may be relative to
+        # registrations made by other workers; 0 checks before every search.
+        self.sync_interval = sync_interval
+        # Appends are fsynced in groups at most fsync_interval apart (0 fsyncs
+        # every append); a crash can lose at most that window of registrations.
+        self.fsync_interval = fsync_interval
+        # The index is checkpointed in the background after checkpoint_rows
+        # new rows or checkpoint_interval seconds, whichever comes first.
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_rows = checkpoint_rows
+        if backend not in backends.BACKENDS:
+            raise ValueError(f"Unknown index backend {backend!r}; expected one of {backends.BACKENDS}")
+        # Galleries below ann_min_rows stay on the exact flat index. Past it
+        # the configured backend is built in the background, and IVF indexes
+        # are retrained whenever the gallery grows by rebuild_growth.
+        self.backend = backend
+        self.ann_min_rows = ann_min_rows
+        self.rebuild_growth = rebuild_growth
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        # Deleted rows stay in the index and gallery as tombstones until they
+        # make up compact_ratio of either; then a background compaction
+        # rewrites the gallery without them and rebuilds the index.
+        self.compact_ratio = compact_ratio
+        self._rebuild_thread = None
+        self._rebuild_retry_at = 0.0
+        self._last_sync = 0.0
+        # Searches share the lock; syncs, appends and index swaps take it
+        # exclusively
+        self._lock = RWLock()
+        self._checkpoint_lock = threading.Lock()
 
-        # Load index if exists
-        if os.path.exists(index_path):
-            self.index = faiss.read_index(index_path)
-        else:
-            self.index = faiss.IndexFlatIP(dim)
+        # The gallery files are the append-only log shared by all workers and
+        # the source of truth; the FAISS index is a per-process view of it.
+        # float16 halves both the file and the in-memory index.
+        self.gallery = SharedGallery(gallery_path, dim, dtype=np.dtype(dtype))
+        self._migrate_pickle()
 
-        # Load embeddings if exists
-        if os.path.exists(embeddings_path):
-            with open(embeddings_path, "rb") as f:
-                self.embeddings = pickle.load(f)
-        else:
-            self.embeddings = []
+        # Index rows are keyed by 64-bit keys. A key is its own face id
+        # unless the journal aliased it to another face (re-embeds, merges).
+        self._max_id = -1
+        self._reset_journal()
+        self._load_checkpoint()
+        backends.set_search_params(self.index, self.nprobe, self.ef_search)
+        # The gallery size the index was built for
+        self._built_rows = self._synced_rows
+        self._checkpointed_rows = self._synced_rows
+        self._last_checkpoint = time.monotonic()
+        # Replay the log tail written after the checkpoint
+        self.sync(force=True)
+        logger.info(
+            "VectorStore loaded %s embeddings (%s from checkpoint) from %s",
+            self.index.ntotal, self._checkpointed_rows, gallery_path
+        )
 
-    def add_embedding(self, embedding: np.ndarray):
+        self._closed = threading.Event()
+        self._background = threading.Thread(target=self._run_background, name="vector-store-flush", daemon=True)
+        self._background.start()
+        atexit.register(self.close)
+
+    def _new_index(self, backend: str = "flat", rows: int = 0):
+        """Empty index keyed by explicit 64-bit face ids."""
+        return backends.make_index(backend, self.dim, self.gallery.dtype, rows)
+
+    def _load_checkpoint(self):
+        """Adopt the last index checkpoint if it covers a prefix of the gallery log."""
+        if os.path.exists(self.index_path):
+            try:
+                if self._adopt(faiss.read_index(self.index_path)):
+                    return
+                logger.warning("Checkpoint %s does not match the gallery; rebuilding", self.index_path)
+            except Exception as e:
+                logger.warning("Could not load checkpoint %s: %s; rebuilding", self.index_path, e)
+        self._adopt(self._new_index())
+
+    def _adopt(self, index) -> bool:
+        """Make ``index`` current if it holds a prefix of the gallery rows.
+
+        Rows the journal deleted may be missing from the prefix: a rebuild
+        leaves them out. Keys in the index that are no longer in the gallery
+        were dropped by a compaction, so they are tombstones. Returns False
+        if the index does not belong to this gallery.
+        """
+        if not isinstance(index, faiss.IndexIDMap2) or index.d != self.dim:
+            return False
+        labels = faiss.vector_to_array(index.id_map)
+        total = len(self.gallery)
+        ids = np.array(self.gallery.read_ids(0, total))
+        present = np.isin(ids, labels)
+        records = self.gallery.read_journal(0, self.gallery.journal_len())
+        dropped = ~present & np.isin(ids, records["key"][records["op"] == OP_DELETE])
+        covered = present | dropped
+        prefix = total if covered.all() else int(np.argmin(covered))
+        if present[prefix:].any() or (not present[:prefix].any() and len(labels)):
+            return False
+        indexed = np.flatnonzero(present[:prefix])
+        if len(indexed) and backends.backend_of(index) != "ivf_pq":
+            # Same keys but different vectors means a different gallery;
+            # PQ codes only reconstruct approximately
+            last = int(indexed[-1])
+            row = np.asarray(self.gallery.read_rows(last, last + 1)[0], dtype=np.float32)
+            if not np.allclose(index.reconstruct(int(ids[last])), row, atol=1e-3):
+                return False
+
+        self.index = index
+        self._synced_rows = prefix
+        self._dead = set(np.setdiff1d(labels, ids[:prefix]).tolist())
+        self._dropped = set(ids[:prefix][dropped[:prefix]].tolist())
+        if len(labels):
+            self._max_id = max(self._max_id, int(labels.max()))
+        return True
+
+    def _reset_journal(self):
+        # Keys in the index that were deleted
+        self._dead = set()
+        # Deleted keys a rebuild left out of the index; their rows stay in
+        # the gallery until a compaction
+        self._dropped = set()
+        # Aliased key -> face id, and face id -> its aliased keys
+        self._alias = {}
+        self._members = {}
+        # Journal records applied, and tombstones among them
+        self._journal_pos = 0
+        self._file_dead = 0
+
+    def _apply_journal(self, records: np.ndarray):
+        for op, key, face in records.tolist():
+            if op == OP_DELETE:
+                if key not in self._dropped:
+                    self._dead.add(key)
+                self._file_dead += 1
+                self._unalias(key)
+            elif op == OP_ALIAS:
+                self._unalias(key)
+                if key != face:
+                    self._alias[key] = face
+                    self._members.setdefault(face, set()).add(key)
+            elif op == OP_HIGHWATER:
+                self._max_id = max(self._max_id, key)
+
+    def _unalias(self, key: int):
+        face = self._alias.pop(key, None)
+        if face is not None:
+            members = self._members[face]
+            members.discard(key)
+            if not members:
+                del self._members[face]
+
+    def _journal(self, records: list):
+        """Append records to the shared journal and apply them here.
+
+        The caller must hold both the gallery lock and ``_lock``.
+        """
+        records = np.array(records, dtype=JOURNAL_DTYPE)
+        self.gallery.append_journal(records)
+        self._apply_journal(records)
+        self._journal_pos += len(records)
+        if self.fsync_interval <= 0:
+            self.gallery.flush()
+
+    def _migrate_pickle(self):
+        """One-time import of the legacy embeddings.pkl into the gallery."""
+        if not os.path.exists(self.embeddings_path):
+            return
+        with self.gallery.lock():
+            if len(self.gallery) > 0:
+                return
+            with open(self.embeddings_path, "rb") as f:
+                embeddings = pickle.load(f)
+            if embeddings:
+                # Legacy face ids were list positions
+                self.gallery.append(np.vstack(embeddings), np.arange(len(embeddings)))
+                self.gallery.flush()
+                logger.info("Migrated %s embeddings from %s", len(embeddings), self.embeddings_path)
+
+    def __len__(self):
+        return self.index.ntotal - len(self._dead)
+
+    def sync(self, force: bool = False):
+        """Apply rows and journal records written by any process since the last sync."""
+        now = time.monotonic()
+        if not force and now - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = now
+        # Checked without the lock so searches only queue up when there is
+        # something to apply
+        if not (
+            self.gallery.replaced()
+            or len(self.gallery) > self._synced_rows
+            or self.gallery.journal_len() > self._journal_pos
+        ):
+            return
+        with self._lock.write():
+            if self.gallery.replaced():
+                self._switch_generation()
+            total = len(self.gallery)
+            if total > self._synced_rows:
+                ids = np.array(self.gallery.read_ids(self._synced_rows, total))
+                rows = np.array(self.gallery.read_rows(self._synced_rows, total), dtype=np.float32)
+                self.index.add_with_ids(rows, ids)
+                self._max_id = max(self._max_id, int(ids.max()))
+                self._synced_rows = total
+            # Read after the rows: writers journal an alias before its row
+            records = self.gallery.journal_len()
+            if records > self._journal_pos:
+                self._apply_journal(self.gallery.read_journal(self._journal_pos, records))
+                self._journal_pos = records
+
+    def _switch_generation(self):
+        """Follow a compaction: reopen the gallery and re-line the index up with it."""
+        self.gallery.reopen()
+        self._reset_journal()
+        if not self._adopt(self.index):
+            logger.warning("Index does not match the compacted gallery; reloading it from the gallery")
+            self._adopt(self._new_index())
+            backends.set_search_params(self.index, self.nprobe, self.ef_search)
+        self._built_rows = self._synced_rows
+        self._checkpointed_rows = -1
+
+    def desired_backend(self) -> str:
+        if self.backend != "flat" and self._synced_rows >= self.ann_min_rows:
+            return self.backend
+        return "flat"
+
+    def needs_rebuild(self) -> bool:
+        current = backends.backend_of(self.index)
+        if current != self.desired_backend():
+            return True
+        if self._dead and len(self._dead) >= self.compact_ratio * self.index.ntotal:
+            return True
+        return current.startswith("ivf") and self._synced_rows >= self._built_rows * self.rebuild_growth
+
+    def needs_compaction(self) -> bool:
+        return self._file_dead > 0 and self._file_dead >= self.compact_ratio * len(self.gallery)
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """Change the IVF nprobe / HNSW efSearch knobs at runtime."""
+        with self._lock.write():
+            if nprobe is not None:
+                self.nprobe = nprobe
+            if ef_search is not None:
+                self.ef_search = ef_search
+            backends.set_search_params(self.index, self.nprobe, self.ef_search)
+
+    def rebuild(self, backend: str = None):
+        """Build a fresh index from the live gallery rows and swap it in.
+
+        Training and bulk adds run without the lock, so searches keep using
+        the old index meanwhile. Tombstoned rows are left out. Rows appended
+        during the build are added just before the swap.
+        """
+        backend = backend or self.desired_backend()
+        with self._lock.read():
+            rows = self._synced_rows
+            generation = self.gallery.generation
+            dead = set(self._dead)
+            # Mappings stay valid even if a compaction replaces these files
+            matrix = self.gallery.read_rows(0, rows)
+            keys = self.gallery.read_ids(0, rows)
+        started = time.monotonic()
+        index = self._new_index(backend, rows - len(dead))
+        drop = np.fromiter(dead, dtype=np.int64)
+
+        needed = backends.train_rows_needed(index)
+        if needed > rows - len(dead):
+            self._rebuild_retry_at = time.monotonic() + 60.0
+            logger.warning("Not rebuilding as %s: %s rows, %s needed for training", backend, rows - len(dead), needed)
+            return
+        backends.train(index, matrix)
+        for start in range(0, rows, 65536):
+            stop = min(rows, start + 65536)
+            ids = np.array(keys[start:stop])
+            live = ~np.isin(ids, drop)
+            index.add_with_ids(np.array(matrix[start:stop][live], dtype=np.float32), ids[live])
+
+        with self._lock.write():
+            if self.gallery.generation != generation:
+                # A compaction renumbered the rows; try again on the new files
+                self._rebuild_retry_at = time.monotonic() + 1.0
+                logger.info("Gallery was compacted during the rebuild; retrying")
+                return
+            if self._synced_rows > rows:
+                index.add_with_ids(
+                    np.array(self.gallery.read_rows(rows, self._synced_rows), dtype=np.float32),
+                    np.array(self.gallery.read_ids(rows, self._synced_rows))
+                )
+            backends.set_search_params(index, self.nprobe, self.ef_search)
+            self.index = index
+            self._built_rows = self._synced_rows
+            # Only rows deleted during the build are still in the new index
+            self._dead -= dead
+            self._dropped |= dead
+            # Force the next background pass to checkpoint the new index
+            self._checkpointed_rows = -1
+        logger.info("Rebuilt %s index over %s embeddings in %.1fs", backend, index.ntotal, time.monotonic() - started)
+
+    def compact(self):
+        """Rewrite the gallery without tombstoned rows, then rebuild the index.
+
+        The gallery is copied while holding the writer lock, so
+        registrations in every worker wait for the copy; searches do not.
+        Other workers switch to the compacted gallery on their next sync.
+        """
+        with self.gallery.lock():
+            self.sync(force=True)
+            if not self.needs_compaction():
+                return
+            with self._lock.read():
+                drop = self._dead | self._dropped
+                journal = [(OP_HIGHWATER, self._max_id, -1)]
+                journal += [(OP_ALIAS, key, face) for key, face in self._alias.items()]
+            self.gallery.compact(drop, np.array(journal, dtype=JOURNAL_DTYPE))
+            self.sync(force=True)
+        self.rebuild()
+
+    def _start_rebuild(self):
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        if time.monotonic() < self._rebuild_retry_at:
+            return
+        self._rebuild_thread = threading.Thread(target=self._run_rebuild, name="vector-store-rebuild", daemon=True)
+        self._rebuild_thread.start()
+
+    def _run_rebuild(self):
+        if self._closed.is_set():
+            return
+        try:
+            if self.needs_compaction():
+                self.compact()
+            else:
+                self.rebuild()
+        except Exception as e:
+            self._rebuild_retry_at = time.monotonic() + 60.0
+            logger.error("VectorStore rebuild failed: %s", e)
+
+    def _has_key(self, key: int) -> bool:
+        try:
+            self.index.reconstruct(int(key))
+            return True
+        except RuntimeError:
+            return False
+
+    def _live_keys(self, face_id: int) -> list:
+        """Keys of the embeddings currently representing ``face_id``."""
+        keys = list(self._members.get(face_id, ()))
+        if face_id not in self._alias and face_id not in self._dead and self._has_key(face_id):
+            keys.append(face_id)
+        return keys
+
+    def contains(self, face_id) -> bool:
+        return bool(self._live_keys(int(face_id)))
+
+    def add_embedding(self, embedding: np.ndarray, face_id=None):
         if embedding.shape[0] != self.dim:
             return "Embedding dimension does not match store dimension"
-        embedding = embedding / np.linalg.norm(embedding)
-        self.index.add(np.expand_dims(embedding, axis=0))
-        self.embeddings.append(embedding)
+        ids = None if face_id is None else [face_id]
+        return self.add_embeddings(np.expand_dims(embedding, axis=0), ids)[0]
 
-        logger.info(f"Added new embedding. Total embeddings: {len(self.embeddings)}")
-        # Save to disk immediately
-        self.save()
-        return len(self.embeddings) - 1  # Return index of embedding
+    def _normalize(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def _append(self, embeddings: np.ndarray, ids: np.ndarray):
+        """Write rows to the gallery and the index; the caller holds both locks.
+
+        Appending and indexing under one ``_lock`` hold means a concurrent
+        sync() cannot pick the new rows up from the file a second time.
+        """
+        self.gallery.append(embeddings, ids)
+        self.index.add_with_ids(embeddings, ids)
+        self._max_id = max(self._max_id, int(ids.max()))
+        self._synced_rows += len(ids)
+        if self.fsync_interval <= 0:
+            self.gallery.flush()
+
+    def add_embeddings(self, embeddings: np.ndarray, ids=None) -> list:
+        """Append several embeddings with one gallery write; returns their face ids.
+
+        New ids continue after the largest id ever issued, so they are
+        never reused. Explicit ``ids`` must not already be in the gallery.
+        """
+        embeddings = self._normalize(embeddings)
+
+        with metrics.stage("vector.add"):
+            with self.gallery.lock():
+                # Catch up first so id allocation sees every other worker's rows
+                self.sync(force=True)
+                with self._lock.write():
+                    if ids is None:
+                        ids = np.arange(self._max_id + 1, self._max_id + 1 + len(embeddings), dtype=np.int64)
+                    else:
+                        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+                        taken = [int(i) for i in ids if self._has_key(i)]
+                        if taken or len(set(ids.tolist())) != len(ids):
+                            raise ValueError(f"Face ids already in use: {taken or ids.tolist()}")
+                    self._append(embeddings, ids)
+
+        logger.info("Added %s new embedding(s). Total embeddings: %s", len(embeddings), self.index.ntotal)
+        return [int(i) for i in ids]
+
+    def delete(self, face_ids) -> list:
+        """Remove faces from search immediately; returns the ids that existed.
+
+        Their embeddings become tombstones that searches skip until the
+        background compaction drops them from the index and the gallery.
+        """
+        deleted = []
+        with self.gallery.lock():
+            self.sync(force=True)
+            with self._lock.write():
+                keys = []
+                for face_id in dict.fromkeys(int(f) for f in face_ids):
+                    live = self._live_keys(face_id)
+                    if live:
+                        deleted.append(face_id)
+                        keys.extend(live)
+                if keys:
+                    self._journal([(OP_DELETE, key, -1) for key in keys])
+        logger.info("Deleted face ids %s; %s tombstones in the index", deleted, len(self._dead))
+        return deleted
+
+    def merge(self, source_id, target_id) -> int:
+        """Fold face ``source_id`` into ``target_id``; returns the embeddings moved.
+
+        The source's embeddings stay in the index as extra exemplars of the
+        target, so faces that used to match the source now match the target.
+        """
+        source_id, target_id = int(source_id), int(target_id)
+        if source_id == target_id:
+            raise ValueError("Cannot merge a face into itself")
+        with self.gallery.lock():
+            self.sync(force=True)
+            with self._lock.write():
+                keys = self._live_keys(source_id)
+                if not keys or not self._live_keys(target_id):
+                    raise ValueError(f"Unknown face id {source_id if not keys else target_id}")
+                self._journal([(OP_ALIAS, key, target_id) for key in keys])
+        logger.info("Merged face id %s into %s (%s embedding(s))", source_id, target_id, len(keys))
+        return len(keys)
+
+    def replace_embedding(self, face_id, embedding: np.ndarray) -> int:
+        """Re-embed ``face_id``: ``embedding`` replaces all of its embeddings.
+
+        Returns the key of the new row. The face id itself does not change.
+        """
+        face_id = int(face_id)
+        embedding = self._normalize(embedding)
+        with self.gallery.lock():
+            self.sync(force=True)
+            with self._lock.write():
+                old = self._live_keys(face_id)
+                if not old:
+                    raise ValueError(f"Unknown face id {face_id}")
+                key = self._max_id + 1
+                # Journal the alias before the row so no reader sees the row
+                # as a face of its own
+                self._journal([(OP_ALIAS, key, face_id)] + [(OP_DELETE, k, -1) for k in old])
+                self._append(embedding, np.array([key], dtype=np.int64))
+        logger.info("Re-embedded face id %s as key %s", face_id, key)
+        return key
+
+    def match_or_add(self, embeddings: np.ndarray, threshold: float = 0.3) -> list:
+        """Identify-or-register that never registers the same face twice.
+
+        Each embedding resolves to its best face at or above ``threshold``,
+        or is added as a new face. Misses are searched again under the
+        gallery lock, after catching up with every thread and worker, so
+        concurrent callers presenting the same unknown face agree on one new
+        face id. An embedding that matches an earlier new one from the same
+        call reuses its id. Returns ``(face_id, similarity, is_new)`` per
+        embedding; similarity is None for new faces.
+        """
+        embeddings = self._normalize(embeddings)
+        resolved = [None] * len(embeddings)
+        misses = []
+        for k, result in enumerate(self.search_batch(embeddings, top_k=1, threshold=threshold)):
+            if result:
+                resolved[k] = (int(result[0][0]), result[0][1], False)
+            else:
+                misses.append(k)
+        if not misses:
+            return resolved
+
+        with metrics.stage("vector.add"):
+            with self.gallery.lock():
+                self.sync(force=True)
+                # Only gallery lock holders add rows, so the misses can be
+                # searched again while other threads keep searching
+                with self._lock.read():
+                    results = self._search_faces(embeddings[misses], 1, threshold)
+                    next_id = self._max_id + 1
+                new_rows, new_ids = [], []
+                for k, result in zip(misses, results):
+                    if result:
+                        resolved[k] = (int(result[0][0]), result[0][1], False)
+                        continue
+                    if new_rows:
+                        sims = np.vstack(new_rows) @ embeddings[k]
+                        j = int(np.argmax(sims))
+                        if sims[j] >= threshold:
+                            resolved[k] = (new_ids[j], sims[j], False)
+                            continue
+                    new_id = next_id + len(new_ids)
+                    new_rows.append(embeddings[k])
+                    new_ids.append(new_id)
+                    resolved[k] = (new_id, None, True)
+                if new_rows:
+                    with self._lock.write():
+                        self._append(np.vstack(new_rows), np.array(new_ids, dtype=np.int64))
+
+        if new_rows:
+            logger.info("Added %s new embedding(s). Total embeddings: %s", len(new_rows), self.index.ntotal)
+        return resolved
+
+    def face_embeddings(self, face_ids) -> tuple:
+        """One normalised embedding per live face among ``face_ids``.
+
+        A face with several embeddings (re-embeds, merges) is represented by
+        their mean. Returns ``(face_ids, embeddings)`` with the faces in
+        ascending id order; ids that are not in the gallery are left out.
+        """
+        wanted = np.fromiter((int(f) for f in face_ids), dtype=np.int64)
+        self.sync()
+        with self._lock.read():
+            rows = self._synced_rows
+            keys = np.array(self.gallery.read_ids(0, rows))
+            faces = keys.copy()
+            if self._alias:
+                aliased = np.fromiter(self._alias.keys(), dtype=np.int64, count=len(self._alias))
+                at = np.flatnonzero(np.isin(keys, aliased))
+                faces[at] = [self._alias[int(key)] for key in keys[at]]
+            live = np.isin(faces, wanted)
+            deleted = self._dead | self._dropped
+            if deleted:
+                live &= ~np.isin(keys, np.fromiter(deleted, dtype=np.int64, count=len(deleted)))
+            picked = np.flatnonzero(live)
+            # Copied under the lock: a compaction may replace the files
+            matrix = np.array(self.gallery.read_rows(0, rows)[picked], dtype=np.float32)
+        faces = faces[picked]
+
+        order = np.argsort(faces, kind="stable")
+        faces, matrix = faces[order], matrix[order]
+        ids, starts = np.unique(faces, return_index=True)
+        if len(ids) == len(faces):
+            return ids, matrix
+        sums = np.add.reduceat(matrix, starts, axis=0) if len(ids) else matrix
+        return ids, sums / np.linalg.norm(sums, axis=1, keepdims=True)
 
     def search(self, query_embedding: np.ndarray, top_k: int = 1, threshold: float = 0.3):
         if query_embedding.shape[0] != self.dim:
             return "Query embedding dimension does not match store dimension"
-        query_embedding = query_embedding / np.linalg.norm(query_embedding)
-        D, I = self.index.search(np.expand_dims(query_embedding, axis=0), top_k)
-        results = [(idx, score) for idx, score in zip(I[0], D[0]) if score >= threshold]
-        logger.info(f"Search results: {results}")
+        results = self.search_batch(np.expand_dims(query_embedding, axis=0), top_k, threshold)[0]
+        logger.debug("Search results: %s", results)
+        return results
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 1, threshold: float = 0.3) -> list:
+        """Search many queries in one FAISS call; returns one result list per query."""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if len(queries) == 0:
+            return []
+        with metrics.stage("vector.search"):
+            self.sync()
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+            with self._lock.read():
+                return self._search_faces(queries, top_k, threshold)
+
+    def _search_faces(self, queries: np.ndarray, top_k: int, threshold: float) -> list:
+        """Best ``top_k`` faces per query, skipping tombstones and counting
+        each face once however many embeddings it has.
+
+        Over-fetches when there are tombstones or aliases, and searches
+        again deeper for queries whose candidates were all filtered out.
+        """
+        results = [[] for _ in range(len(queries))]
+        ntotal = self.index.ntotal
+        fetch = top_k
+        if self._dead or self._alias:
+            fetch = top_k + min(len(self._dead) + len(self._alias), 4 * top_k + 12)
+        pending = list(range(len(queries)))
+        while pending and ntotal:
+            k = min(fetch, ntotal)
+            D, I = self.index.search(queries[pending], k)
+            deeper = []
+            for q, keys, scores in zip(pending, I, D):
+                faces, seen = [], set()
+                for key, score in zip(keys, scores):
+                    if key < 0 or score < threshold:
+                        break
+                    if key in self._dead:
+                        continue
+                    face_id = self._alias.get(key, key)
+                    if face_id in seen:
+                        continue
+                    seen.add(face_id)
+                    faces.append((face_id, score))
+                    if len(faces) == top_k:
+                        break
+                else:
+                    if k < ntotal:
+                        deeper.append(q)
+                results[q] = faces
+            pending = deeper
+            fetch *= 4
         return results
 
+    def checkpoint(self):
+        """Atomically write the FAISS index; startup replays only rows after it.
+
+        The index is serialized under the lock and written outside it, so
+        searches and appends are blocked only for an in-memory copy.
+        """
+        # One checkpoint at a time per process: save() may race the
+        # background thread for the same tmp file
+        with self._checkpoint_lock:
+            with self._lock.read():
+                rows = self._synced_rows
+                if rows == self._checkpointed_rows and os.path.exists(self.index_path):
+                    return
+                data = faiss.serialize_index(self.index)
+
+            # The checkpoint may not be ahead of durable log rows
+            self.gallery.flush()
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+            self._checkpointed_rows = rows
+            self._last_checkpoint = time.monotonic()
+        logger.info("VectorStore checkpointed %s embeddings to %s", rows, self.index_path)
+
+    def flush(self):
+        """Make every appended row durable now, without checkpointing the index."""
+        self.gallery.flush()
+
     def save(self):
-        """Persist FAISS index and embeddings."""
-        faiss.write_index(self.index, self.index_path)
-        with open(self.embeddings_path, "wb") as f:
-            pickle.dump(self.embeddings, f)
-            logger.info("VectorStore saved to disk.")
+        """Persist everything now: fsync the log and checkpoint the index."""
+        self.gallery.flush()
+        self.checkpoint()
+
+    def _run_background(self):
+        tick = self.fsync_interval if self.fsync_interval > 0 else 1.0
+        while not self._closed.wait(tick):
+            try:
+                self.gallery.flush()
+                pending = self._synced_rows - self._checkpointed_rows
+                due = time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+                if pending >= self.checkpoint_rows or (pending > 0 and due) or self._checkpointed_rows < 0:
+                    self.checkpoint()
+                if self.needs_compaction() or self.needs_rebuild():
+                    self._start_rebuild()
+            except Exception as e:
+                logger.error("VectorStore background flush failed: %s", e)
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._background.join()
+        # A rebuild or compaction still reads the gallery files closed below
+        rebuild = self._rebuild_thread
+        if rebuild is not None:
+            rebuild.join()
+        self.save()
+        self.gallery.close()